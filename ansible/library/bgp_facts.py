@@ -7,6 +7,8 @@ author:         John Arnold (johnar@microsoft.com)
 short_description: Retrieve BGP neighbor information from Quagga
 description:
     - Retrieve BGP neighbor information from Quagga, using the VTYSH command line
+    - With FRR, the summary and the IPv4 and IPv6 neighbors are retrieved in one vtysh call
+      with JSON output, the text output is parsed when JSON output is not supported
     - Retrieved facts will be inserted into the 'bgp_neighbors' key
 '''
 
@@ -45,6 +47,26 @@ Next connect timer due in 31 seconds
 Read thread: off  Write thread: off
 '''
 
+import json
+
+# FRR JSON keys of the message statistics of a neighbor, in the naming of the text output
+MESSAGE_STATS = [
+    ('Opens', 'opens'),
+    ('Notifications', 'notifications'),
+    ('Updates', 'updates'),
+    ('Keepalives', 'keepalives'),
+    ('Route Refresh', 'routeRefresh'),
+    ('Capability', 'capability'),
+    ('Total', 'total'),
+]
+
+
+def camel_to_words(value):
+    """
+        'advertisedAndReceived' -> 'advertised and received'
+    """
+    return re.sub(r'([A-Z])', r' \1', value).lower()
+
 
 class BgpModule(object):
     def __init__(self):
@@ -73,10 +95,14 @@ class BgpModule(object):
             Main method of the class
         """
         for instance in self.instances:
-            self.collect_data('summary', instance)
-            self.parse_summary()
-            self.collect_data('neighbor',instance)
-            self.parse_neighbors()
+            if self.collect_json_data(instance):
+                self.parse_summary_json()
+                self.parse_neighbors_json()
+            else:
+                self.collect_data('summary', instance)
+                self.parse_summary()
+                self.collect_data('neighbor',instance)
+                self.parse_neighbors()
             self.get_statistics()
         self.module.exit_json(ansible_facts=self.facts)
 
@@ -96,6 +122,105 @@ class BgpModule(object):
 
         return
 
+    def collect_json_data(self, instance):
+        """
+            Collect the summary and the neighbors with JSON output of one 'vtysh' call.
+            Returns False when vtysh doesn't support JSON output of these commands.
+        """
+        docker_cmd = 'docker exec -i {} vtysh -c "show ip bgp summary json" -c "show ip bgp neighbors json"'.format(instance)
+        try:
+            rc, out, err = self.module.run_command(docker_cmd, executable='/bin/bash', use_unsafe_shell=True)
+        except Exception as e:
+            self.module.fail_json(msg=str(e))
+
+        if rc != 0:
+            return False
+
+        # vtysh prints the JSON objects of the commands one after another
+        decoder = json.JSONDecoder()
+        objects = []
+        out = out.strip()
+        pos = 0
+        try:
+            while pos < len(out):
+                obj, pos = decoder.raw_decode(out, pos)
+                objects.append(obj)
+                while pos < len(out) and out[pos].isspace():
+                    pos += 1
+        except ValueError:
+            return False
+
+        if len(objects) != 2 or not all(isinstance(obj, dict) for obj in objects):
+            return False
+
+        self.summary, self.neighbors = objects
+        return True
+
+    def parse_summary_json(self):
+        # 'show ip bgp summary json' has the AS at the top level or per address family
+        for summary in [self.summary] + self.summary.values():
+            if isinstance(summary, dict) and 'as' in summary:
+                self.facts['bgp_localasn'] = str(summary['as'])
+                return
+        for neighbor in self.neighbors.itervalues():
+            if 'localAs' in neighbor:
+                self.facts['bgp_localasn'] = str(neighbor['localAs'])
+                return
+
+    def parse_neighbors_json(self):
+        neighbors = {}
+
+        try:
+            for neighbor_ip, n in self.neighbors.iteritems():
+                if not isinstance(n, dict):
+                    continue
+                neighbor = {}
+                capabilities = {}
+                message_stats = {}
+
+                neighbor_ip = neighbor_ip.lstrip('*').lower()
+                neighbor['ip_version'] = 6 if ':' in neighbor_ip else 4
+                neighbor['admin'] = 'down' if n.get('adminShutDown') else 'up'
+                neighbor['accepted prefixes'] = sum(af.get('acceptedPrefixCounter', 0) for af in n.get('addressFamilyInfo', {}).itervalues())
+
+                if 'remoteAs' in n: neighbor['remote AS'] = int(n['remoteAs'])
+                if 'localAs' in n: neighbor['local AS'] = int(n['localAs'])
+                if 'nbrDesc' in n: neighbor['description'] = n['nbrDesc']
+                if 'remoteRouterId' in n: neighbor['remote routerid'] = n['remoteRouterId']
+                if 'bgpState' in n: neighbor['state'] = n['bgpState'].lower()
+                if 'minBtwnAdvertisementRunsTimerMsecs' in n: neighbor['mrai'] = n['minBtwnAdvertisementRunsTimerMsecs'] / 1000
+                if 'connectionsEstablished' in n: neighbor['connections established'] = n['connectionsEstablished']
+                if 'connectionsDropped' in n: neighbor['connections dropped'] = n['connectionsDropped']
+                if 'peerGroup' in n: neighbor['peer group'] = n['peerGroup']
+                if 'peerSubnetRangeGroup' in n: neighbor['subnet'] = n['peerSubnetRangeGroup']
+
+                caps = n.get('neighborCapabilities', {})
+                if 'gracefulRestart' in caps: capabilities['graceful restart'] = camel_to_words(caps['gracefulRestart']).split()[0]
+                if 'gracefulRestartRemoteTimerMsecs' in caps: capabilities['peer restart timer'] = caps['gracefulRestartRemoteTimerMsecs'] / 1000
+                peer_afs = caps.get('addressFamiliesByPeer', {})
+                if isinstance(peer_afs, dict):
+                    if 'ipv4Unicast' in peer_afs: capabilities['peer af ipv4 unicast'] = camel_to_words(peer_afs['ipv4Unicast'])
+                    if 'ipv6Unicast' in peer_afs: capabilities['peer af ipv6 unicast'] = camel_to_words(peer_afs['ipv6Unicast'])
+
+                stats = n.get('messageStats', {})
+                for key, json_key in MESSAGE_STATS:
+                    if json_key + 'Sent' in stats and json_key + 'Recv' in stats:
+                        message_stats[key] = {'sent': stats[json_key + 'Sent'], 'rcvd': stats[json_key + 'Recv']}
+
+                if capabilities:
+                    neighbor['capabilities'] = capabilities
+
+                if message_stats:
+                    neighbor['message statistics'] = message_stats
+
+                neighbors[neighbor_ip] = neighbor
+
+        except Exception as e:
+            self.module.fail_json(msg=str(e))
+
+        self.facts['bgp_neighbors'].update(neighbors)
+        return
+
     def parse_summary(self):
         regex_asn = re.compile(r'.*local AS number (\d+).*')
         if regex_asn.match(self.out):
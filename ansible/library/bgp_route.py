@@ -12,6 +12,8 @@ description:
       Currently supported parsing commands:
         * show ip bgp 100.0.0.1  ### show ip bgp prefix info
         * show ip bgp neighbor 10.0.0.1 adv   ### show ip bgp neighbor nei_address advertised routes
+    - With FRR, the JSON output of the commands is parsed, the text output is parsed when
+      JSON output is not supported
     - Retrieved facts will be inserted into the 'bgp_route'  or 'bgp_route_neiadv'
 Options:
     - option-name: prefix
@@ -143,6 +145,9 @@ SAMPLE_COMMAND_DATA = '''
 
 ### TODO: Not fully tested ipv6 route entries parsing option, need continue working on ipv6 specific commands###
 
+# Origin codes of the text output for the long origin names of the JSON output
+ORIGIN_CODES = {'IGP': 'i', 'EGP': 'e', 'incomplete': '?'}
+
 class BgpRoutes(object):
     '''
         parsing bgp routing information
@@ -200,6 +205,42 @@ class BgpRoutes(object):
                 self.facts['bgp_route_neiadv'][prefix] = entry
 
 
+    def parse_bgp_route_adv_json(self, data):
+        '''
+        parse BGP routing facts of neighbor advertised routes from JSON output
+        '''
+        self.facts['bgp_route_neiadv']['neighbor'] = self.neighbor
+        for prefix, route in data.get('advertisedRoutes', {}).items():
+            entry = dict()
+            entry['aspath'] = route.get('path', '').split()
+            entry['nexthop'] = route.get('nextHop')
+            if 'bgpOriginCode' in route:
+                entry['origin'] = route['bgpOriginCode']
+            else:
+                entry['origin'] = ORIGIN_CODES.get(route.get('origin'), route.get('origin'))
+            entry['weight'] = str(route.get('weight', 0))
+            self.facts['bgp_route_neiadv'][prefix] = entry
+
+    def parse_bgp_route_prefix_json(self, data):
+        '''
+        parse BGP facts for specific prefix from JSON output
+        '''
+        prefix = self.prefix
+        self.facts['bgp_route'] = defaultdict(dict)
+        if 'paths' not in data or prefix not in data.get('prefix', ''):
+            self.facts['bgp_route'][prefix]['found'] = False
+            return
+
+        self.facts['bgp_route'][prefix]['found'] = True
+        self.facts['bgp_route'][prefix]['path_num'] = str(len(data['paths']))
+        self.facts['bgp_route'][prefix]['aspath'] = []
+        for path in data['paths']:
+            aspath = path.get('aspath', '')
+            if isinstance(aspath, dict):
+                aspath = aspath.get('string', '')
+            # The text output shows an empty AS path as 'Local'
+            self.facts['bgp_route'][prefix]['aspath'].append(aspath or 'Local')
+
     def parse_bgp_route_prefix(self, cmd_result):
         '''
         parse BGP facts for specific prefix
@@ -290,6 +331,32 @@ class BgpRoutes(object):
                 raise Exception("cannot parse bgp prefix info correctly " + str(state) + str(self.facts))
 
 
+def run_vtysh(module, show_cmd, check_rc=True):
+    '''
+    run the show command in the bgp container, returns None on failure when check_rc is False
+    '''
+    command = "docker exec -i bgp vtysh -c '" + show_cmd + "'"
+    rc, out, err = module.run_command(command)
+    if rc != 0:
+        if not check_rc:
+            return None
+        err_message = "command %s failed rc=%d, out=%s, err=%s" %(command, rc, out, err)
+        module.fail_json(msg=err_message)
+    return out
+
+
+def run_vtysh_json(module, show_cmd):
+    '''
+    run the show command with JSON output, returns None when it is not supported
+    '''
+    out = run_vtysh(module, show_cmd + " json", check_rc=False)
+    try:
+        data = json.loads(out)
+    except (TypeError, ValueError):
+        return None
+    return data if isinstance(data, dict) else None
+
+
 def main():
     module = AnsibleModule(
             argument_spec=dict(
@@ -322,27 +389,25 @@ def main():
 
         if prefix:
             if regex_ipv4.match(prefix):
-                command = "docker exec -i bgp vtysh -c 'show ip bgp " + str(prefix) + "'"
+                show_cmd = "show ip bgp " + str(prefix)
+            else:
+                show_cmd = "show ipv6 bgp " + str(prefix)
+            data = run_vtysh_json(module, show_cmd)
+            if data is not None:
+                bgproute.parse_bgp_route_prefix_json(data)
             else:
-                command = "docker exec -i bgp vtysh -c 'show ipv6 bgp " + str(prefix) +  "'"
-            rc, out, err = module.run_command(command)
-            if rc != 0:
-                err_message = "command %s failed rc=%d, out=%s, err=%s" %(command, rt, out, err)
-                module.fail_json(msg=err_message)
-                return
-            bgproute.parse_bgp_route_prefix(out)
+                bgproute.parse_bgp_route_prefix(run_vtysh(module, show_cmd))
 
         elif neighbor:
             if netaddr.valid_ipv4(neighbor):
-                command = "docker exec -i bgp vtysh -c 'show ip bgp neighbor " + str(neighbor) + " " + str(direction) + "'"
+                show_cmd = "show ip bgp neighbor " + str(neighbor) + " " + str(direction)
+            else:
+                show_cmd = "show ipv6 bgp neighbor " + str(neighbor) + " " + str(direction)
+            data = run_vtysh_json(module, show_cmd)
+            if data is not None:
+                bgproute.parse_bgp_route_adv_json(data)
             else:
-                command = "docker exec -i bgp vtysh -c 'show ipv6 bgp neighbor " + str(neighbor) + " " + str(direction) + "'"
-            rc, out, err = module.run_command(command)
-            if rc !=  0:
-                err_message = "command %s failed rc=%d, out=%s, err=%s" %(command, rt, out, err)
-                module.fail_json(msg=err_message)
-                return
-            bgproute.parse_bgp_route_adv(out)
+                bgproute.parse_bgp_route_adv(run_vtysh(module, show_cmd))
 
         results = bgproute.get_facts()
         module.exit_json(ansible_facts=results)
@@ -355,6 +420,7 @@ def main():
 
 from ansible.module_utils.basic import *
 from collections  import defaultdict
+import json
 import netaddr
 if __name__ == "__main__":
     main()
@@ -5,8 +5,9 @@ module:  extract_log
 version_added:  "1.0"
 short_description: Unrotate logs and extract information starting from a row with predefined string
 description: The module scans the 'directory' in search of files which filenames start with 'file_prefix'.
-The found files are ungzipped and combined together in the rotation order. After that all lines after
-'start_string' are copied into a file with name 'target_filename'. All input strings with 'nsible' in it
+The found files are scanned from the newest to the oldest one (plain files are read backwards) until the
+last copy of 'start_string' is found. After that all lines after it are streamed in the rotation order
+into a file with name 'target_filename'. All input strings with 'nsible' in it
 aren't considered as 'start_string' to avoid clashing with ansible output.
 
 Options:
@@ -30,6 +31,12 @@ Options:
       required: True
       Default: None
 
+    - option-name: index_filename
+      description: a filename of a file where positions of the found start strings are cached between runs.
+                   Files are tracked by inode, so the cache survives log rotation. Set to empty string to disable.
+      required: False
+      Default: /tmp/extract_log.index
+
 '''
 
 EXAMPLES = '''
@@ -77,82 +84,149 @@ import os
 import gzip
 import re
 import sys
-from datetime import datetime
+import json
+import shutil
+import binascii
 from ansible.module_utils.basic import *
 
 
-def extract_lines(directory, filename, target_string):
-    path = os.path.join(directory, filename)
-    file = None
+READ_BLOCK_SIZE = 64 * 1024
+NUMBER_RE = re.compile(r'\d+')
+# Number of bytes at the start of a file stored in the index to detect a rewritten file
+HEAD_SIZE = 128
+
+
+def open_log(path):
     if 'gz' in path:
-        file = gzip.GzipFile(path)
+        return gzip.GzipFile(path)
     else:
-        file = open(path)
-    result = None
-    with file:
-        # This might be a gunzip file or logrotate issue, there has
-        # been '\x00's in front of the log entry timestamp which
-        # messes up with the comparator.
-        # Prehandle lines to remove these sub-strings
-        dt = datetime.datetime.fromtimestamp(os.path.getctime(path))
-        result = [(filename, dt, line.replace('\x00', '')) for line in file if target_string in line and 'nsible' not in line]
+        return open(path)
+
+
+def is_start_line(line, target_string):
+    return target_string in line and 'nsible' not in line
+
+
+def reverse_lines(file, start, end):
+    """Yields (offset, line) for lines located between @start and @end offsets
+    of the file, from the last line to the first one. Lines are without '\\n'"""
+
+    pos = end
+    tail = ''
+    while pos > start:
+        size = min(READ_BLOCK_SIZE, pos - start)
+        pos -= size
+        file.seek(pos)
+        lines = (file.read(size) + tail).split('\n')
+        # The first line may continue in the previous block
+        first = 1 if pos > start else 0
+        tail = lines[0]
+        offsets = []
+        offset = pos
+        for line in lines:
+            offsets.append(offset)
+            offset += len(line) + 1
+        for i in range(len(lines) - 1, first - 1, -1):
+            yield offsets[i], lines[i]
+
+
+def find_last_line(path, target_string, start=0):
+    """Returns (offset, line) of the last line with @target_string located after @start offset
+    of the file, None if there is no such line"""
+
+    with open_log(path) as file:
+        if isinstance(file, gzip.GzipFile):
+            # gzip can't be read backwards, scan it forward
+            result = None
+            offset = 0
+            for line in file:
+                if offset >= start and is_start_line(line, target_string):
+                    result = (offset, line)
+                offset += len(line)
+            return result
+
+        file.seek(0, os.SEEK_END)
+        for offset, line in reverse_lines(file, start, file.tell()):
+            if is_start_line(line, target_string):
+                return (offset, line + '\n')
+
+    return None
+
+
+def load_index(index_filename):
+    if not index_filename or not os.path.exists(index_filename):
+        return {}
+    try:
+        with open(index_filename) as fp:
+            return json.load(fp)
+    except ValueError:
+        return {}
 
-    return result
 
+def save_index(index_filename, index):
+    if not index_filename:
+        return
+    tmp_filename = index_filename + '.tmp'
+    with open(tmp_filename, 'w') as fp:
+        json.dump(index, fp)
+    os.rename(tmp_filename, index_filename)
 
-def extract_number(s):
-    """Extracts number from string, if not number found returns 0"""
-    ns = re.findall(r'\d+', s)
-    if len(ns) == 0:
-        return 0
-    else:
-        return int(ns[0])
 
+def read_head(path):
+    with open(path, 'rb') as fp:
+        return binascii.hexlify(fp.read(HEAD_SIZE))
 
-def convert_date(fct, s):
-    dt = None
-    re_result = re.findall(r'^\S{3}\s{1,2}\d{1,2} \d{2}:\d{2}:\d{2}\.?\d*', s)
-    # Workaround for pytest-ansible
-    loc = locale.getlocale()
-    locale.setlocale(locale.LC_ALL, (None, None))
-
-    if len(re_result) > 0:
-        str_date = '{:04d} '.format(fct.year) + re_result[0]
-        try:
-            dt = datetime.datetime.strptime(str_date, '%Y %b %d %X.%f')
-        except ValueError:
-            dt = datetime.datetime.strptime(str_date, '%Y %b %d %X')
-        # Handle the wrap around of year (Dec 31 to Jan 1)
-        # Generally, last metadata change time should be larger than generated log message timestamp
-        # but we still perform some wrap around test to avoid the race condition
-        # 183 is the number of days in half year, just a reasonable choice
-        if (dt - fct).days > 183:
-            dt.replace(year = dt.year - 1)
-    else:
-        re_result = re.findall(r'^\d{4}-\d{2}-\d{2}\.\d{2}:\d{2}:\d{2}\.\d{6}', s)
-        str_date = re_result[0]
-        dt = datetime.datetime.strptime(str_date, '%Y-%m-%d.%X.%f')
-    locale.setlocale(locale.LC_ALL, loc)
 
-    return dt
+def extract_lines(directory, filename, target_string, index=None):
+    """Returns (filename, offset, line) for the last line with @target_string in the file,
+    None if the file doesn't contain it.
+    @index is a dict of per-file entries, keyed by inode, with already found lines. A file which
+    has only grown since it was indexed is scanned starting from the previously scanned size.
+    A file whose first bytes changed was rewritten in place (e.g. by copytruncate), it is
+    scanned from the start even if it has grown back past the indexed size"""
 
+    path = os.path.join(directory, filename)
+    st = os.stat(path)
+    if index is None:
+        index = {}
+    key = '{}:{}'.format(st.st_dev, st.st_ino)
+    entry = index.get(key)
+    head = read_head(path)
+    if (entry is None or entry['size'] > st.st_size or ('gz' in path and entry['size'] != st.st_size)
+            or not head.startswith(entry.get('head', ''))):
+        entry = {'size': st.st_size, 'lines': {}}
+        index[key] = entry
+
+    found = entry['lines'].get(target_string)
+    if found is None or found['size'] != st.st_size:
+        start = found['size'] if found is not None and 'gz' not in path else 0
+        result = find_last_line(path, target_string, start)
+        if result is None and found is not None and found['offset'] is not None:
+            result = (found['offset'], found['line'])
+        found = {'size': st.st_size, 'offset': None, 'line': None}
+        if result is not None:
+            found['offset'], found['line'] = result
+        entry['size'] = st.st_size
+        entry['lines'][target_string] = found
+    entry['head'] = head
+
+    if found['offset'] is None:
+        return None
+
+    # This might be a gunzip file or logrotate issue, there has
+    # been '\x00's in front of the log entry timestamp which
+    # messes up with the comparator.
+    # Prehandle lines to remove these sub-strings
+    return (filename, found['offset'], found['line'].replace('\x00', ''))
 
-def comparator(l, r):
-    nl = extract_number(l[0])
-    nr = extract_number(r[0])
-    if nl == nr:
-        dl = convert_date(l[1], l[2])
-        dr = convert_date(r[1], r[2])
-        if dl == dr:
-            return 0
-        elif dl < dr:
-            return -1
-        else:
-            return 1
-    elif nl > nr:
-        return -1
+
+def extract_number(s):
+    """Extracts number from string, if not number found returns 0"""
+    ns = NUMBER_RE.findall(s)
+    if len(ns) == 0:
+        return 0
     else:
-        return 1
+        return int(ns[0])
 
 
 def filename_comparator(l, r):
@@ -180,29 +254,19 @@ def list_files(directory, prefixname):
         if filename.startswith(prefixname)], cmp=filename_comparator)
 
 
-def extract_latest_line_with_string(directory, filenames, start_string):
+def extract_latest_line_with_string(directory, filenames, start_string, index=None):
     """Extracts latest line with string @start_string. Assumes @filenames are sorted
-    and first file in @filenames is the newest log file"""
+    and first file in @filenames is the newest log file.
+    Returns (filename, offset, line)"""
 
-    target_lines = []
     for filename in filenames:
-        extracted_lines = extract_lines(directory, filename, start_string)
-        if extracted_lines:
-            # found lines are the lates since we start from the newest file
-            # assignt to target_lines and break the loop
-            target_lines = extracted_lines
-            break
-
-    # find the latest line from traget_lines comparing by date in line
-    target = target_lines[0] if len(target_lines) > 0 else None
-    for line in target_lines:
-        if comparator(line, target) > 0:
-            target = line
+        target = extract_lines(directory, filename, start_string, index)
+        if target is not None:
+            # found line is the latest since we start from the newest file
+            # and read every file from its end
+            return target
 
-    if target is None:
-        raise Exception("{} was not found in {}".format(start_string, directory))
-
-    return target
+    raise Exception("{} was not found in {}".format(start_string, directory))
 
 
 def calculate_files_to_copy(filenames, file_with_latest_line):
@@ -210,29 +274,36 @@ def calculate_files_to_copy(filenames, file_with_latest_line):
     return files_to_copy
 
 
-def combine_logs_and_save(directory, filenames, start_string, target_filename):
-    do_copy = False
+def combine_logs_and_save(directory, filenames, start_offset, target_filename):
+    """Streams the oldest file of @filenames starting from @start_offset
+    and all newer files after it into @target_filename.
+    Rotated files hold consecutive time ranges, so copying them in the rotation order
+    gives the same result as merging their lines by timestamp"""
+
     with open(target_filename, 'w') as fp:
+        offset = start_offset
         for filename in reversed(filenames):
-            path = os.path.join(directory, filename)
-            file = None
-            if 'gz' in path:
-                file = gzip.GzipFile(path)
-            else:
-                file = open(path)
-            with file:
-                for line in file:
-                    if line == start_string:
-                        do_copy = True
-                    if do_copy:
-                        fp.write(line)
-
-
-def extract_log(directory, prefixname, target_string, target_filename):
+            with open_log(os.path.join(directory, filename)) as file:
+                file.seek(offset)
+                shutil.copyfileobj(file, fp, READ_BLOCK_SIZE)
+            offset = 0
+
+
+def extract_log(directory, prefixname, target_string, target_filename, index_filename=None):
+    indexes = load_index(index_filename)
     filenames = list_files(directory, prefixname)
-    file_with_latest_line, file_create_time, latest_line = extract_latest_line_with_string(directory, filenames, target_string)
+    index = indexes.setdefault(directory, {})
+    file_with_latest_line, start_offset, latest_line = extract_latest_line_with_string(directory, filenames, target_string, index)
     files_to_copy = calculate_files_to_copy(filenames, file_with_latest_line)
-    combine_logs_and_save(directory, files_to_copy, latest_line, target_filename)
+    combine_logs_and_save(directory, files_to_copy, start_offset, target_filename)
+
+    # Forget files which don't exist anymore
+    inodes = set('{}:{}'.format(st.st_dev, st.st_ino) for st in
+                 [os.stat(os.path.join(directory, filename)) for filename in filenames])
+    for key in list(index.keys()):
+        if key not in inodes:
+            del index[key]
+    save_index(index_filename, indexes)
 
 
 def main():
@@ -242,12 +313,13 @@ def main():
             file_prefix=dict(required=True, type='str'),
             start_string=dict(required=True, type='str'),
             target_filename=dict(required=True, type='str'),
+            index_filename=dict(required=False, type='str', default='/tmp/extract_log.index'),
         ),
         supports_check_mode=False)
 
     p = module.params;
     try:
-        extract_log(p['directory'], p['file_prefix'], p['start_string'], p['target_filename'])
+        extract_log(p['directory'], p['file_prefix'], p['start_string'], p['target_filename'], p['index_filename'])
     except:
         err = str(sys.exc_info())
         module.fail_json(msg="Error: %s" % err)
@@ -1,13 +1,12 @@
 import EntityManager
 import Tac
-import socket
-import pickle
 import argparse
 import datetime
 from pprint import pprint
+from proxy_transport import Conn, PTF_PROXY_PORT
 
 
-g_ptf_host = None
+g_ptf_conn = None
 g_log_fp = None
 
 
@@ -40,12 +39,10 @@ class IntfMonitor(Tac.Notifiee):
             return
 
         self.state[self.notifier_.intfId] = self.notifier_.linkStatus
-        conn = Conn()
         data = {"intf": self.notifier_.intfId, "linkStatus": self.notifier_.linkStatus}
         log("Event: intf %s changed its state %s" % (self.notifier_.intfId, self.notifier_.linkStatus))
         log("Send data %s" % str(data))
-        conn.write(data)
-        data = conn.read()
+        data = g_ptf_conn.request(data)
         log("Received reply: %s" % str(data))
 
 
@@ -58,32 +55,12 @@ def setup_sw():
     return Tac.collectionChangeReactor(intfStatusDir.intfStatus, IntfMonitor)
 
 
-class Conn(object):
-    def __init__(self):
-        self.conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.conn.connect((g_ptf_host, 9877))
-
-    def __del__(self):
-        self.conn.close()
-
-    def read(self):
-        fp = self.conn.makefile('rb', 1024)
-        data = pickle.load(fp)
-        fp.close()
-        return data
-
-    def write(self, data):
-        fp = self.conn.makefile('wb', 1024)
-        pickle.dump(data, fp, pickle.HIGHEST_PROTOCOL)
-        fp.close()
-
-
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("ptf_host", type=str, help="ip address of ptf host")
     args = parser.parse_args()
-    global g_ptf_host
-    g_ptf_host = str(args.ptf_host)
+    global g_ptf_conn
+    g_ptf_conn = Conn(str(args.ptf_host), PTF_PROXY_PORT)
 
     global g_log_fp
     g_log_fp = open("/tmp/fanout_listener.log", "w")
@@ -1,8 +1,6 @@
 import sys
 import os
 import time
-import socket
-import pickle
 import argparse
 import datetime
 import signal
@@ -13,9 +11,10 @@ sys.path.append('/usr/local/lib/python2.7/dist-packages/python_sdk_api/')
 sys.path.append('/usr/local/lib/python2.7/site-packages/python_sdk_api/')
 
 from sx_api import *
+from proxy_transport import Conn, PTF_PROXY_PORT
 
 
-g_ptf_host = None
+g_ptf_conn = None
 g_log_fp = None
 
 
@@ -29,26 +28,6 @@ def log(message, output_on_console=False):
         g_log_fp.flush()
 
 
-class PtfHostConn(object):
-    def __init__(self):
-        self.conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.conn.connect((g_ptf_host, 9877))
-
-    def __del__(self):
-        self.conn.close()
-
-    def read(self):
-        fp = self.conn.makefile('rb', 1024)
-        data = pickle.load(fp)
-        fp.close()
-        return data
-
-    def write(self, data):
-        fp = self.conn.makefile('wb', 1024)
-        pickle.dump(data, fp, pickle.HIGHEST_PROTOCOL)
-        fp.close()
-
-
 class IntfMonitor():
     def __init__(self):
         self.sx_hdl = None
@@ -155,12 +134,10 @@ class IntfMonitor():
         return name
 
     def sendLinkChangeToPtfHost(self, intf, linkStatus):
-        conn = PtfHostConn()
         data = {"intf": intf, "linkStatus": linkStatus}
         log("Event: intf %s changed its state %s" % (intf, linkStatus))
         log("Send data %s" % str(data))
-        conn.write(data)
-        data = conn.read()
+        data = g_ptf_conn.request(data)
         log("Received reply: %s" % str(data))
 
 
@@ -168,8 +145,8 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("ptf_host", type=str, help="ip address of ptf host")
     args = parser.parse_args()
-    global g_ptf_host
-    g_ptf_host = str(args.ptf_host)
+    global g_ptf_conn
+    g_ptf_conn = Conn(str(args.ptf_host), PTF_PROXY_PORT)
 
     global g_log_fp
     g_log_fp = open("/tmp/fanout_listener.log", "w")
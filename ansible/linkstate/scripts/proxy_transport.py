@@ -0,0 +1,215 @@
+'''
+Transport between the link state scripts.
+
+fanout_listener.py -> ptf_proxy.py -> vm_tcp_listener.py keep one long-lived TCP connection
+per peer. Every request and reply is a frame: a header with the payload length and the
+request id, followed by a JSON payload. Requests can be pipelined over the connection and
+replies are matched to them by the request id.
+'''
+
+import json
+import Queue
+import socket
+import SocketServer
+import struct
+import threading
+
+
+VM_LISTENER_PORT = 9876
+PTF_PROXY_PORT = 9877
+
+# Payload length, request id
+HEADER = struct.Struct('!II')
+MAX_PAYLOAD = 1 << 20
+REPLY_TIMEOUT = 30
+
+
+class TransportError(Exception):
+    pass
+
+
+def _to_str(value):
+    # json gives unicode strings, the scripts and Sysdb expect str
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, dict):
+        return {_to_str(k): _to_str(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_to_str(v) for v in value]
+    return value
+
+
+def encode_frame(req_id, data):
+    payload = json.dumps(data, separators=(',', ':'))
+    return HEADER.pack(len(payload), req_id) + payload
+
+
+def read_frame(rfile):
+    '''
+    Returns (request id, data) of the next frame or None when the peer closed the connection.
+    '''
+    header = rfile.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return None
+    length, req_id = HEADER.unpack(header)
+    if length > MAX_PAYLOAD:
+        raise TransportError("Frame of %d bytes is too long" % length)
+    payload = rfile.read(length)
+    if len(payload) < length:
+        return None
+    return req_id, _to_str(json.loads(payload))
+
+
+class Reply(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.data = None
+        self.error = None
+
+    def set(self, data=None, error=None):
+        self.data = data
+        self.error = error
+        self.event.set()
+
+    def get(self):
+        # Waiting without a timeout doesn't poll, the connection fails late replies
+        self.event.wait()
+        if self.error is not None:
+            raise TransportError(self.error)
+        return self.data
+
+
+class Conn(object):
+    '''
+    Long-lived connection to a peer. It is opened on the first request and reopened on the
+    next request after a failure. send() doesn't wait for the reply, so many requests can be
+    in flight, request() sends one and waits for its reply. When replies are pending and none
+    arrives in REPLY_TIMEOUT seconds, the connection is closed and the pending requests fail.
+    '''
+    def __init__(self, ip, port):
+        self.address = (ip, port)
+        self.lock = threading.Lock()
+        self.sock = None
+        self.pending = {}
+        self.next_id = 0
+
+    def connect(self):
+        sock = socket.create_connection(self.address)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(REPLY_TIMEOUT)
+        self.sock = sock
+        reader = threading.Thread(target=self.read_replies, args=(sock,))
+        reader.daemon = True
+        reader.start()
+
+    def disconnect(self, error):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.sock.close()
+        self.sock = None
+        for reply in self.pending.values():
+            reply.set(error=error)
+        self.pending = {}
+
+    def close(self):
+        with self.lock:
+            if self.sock is not None:
+                self.disconnect("Connection closed")
+
+    def send(self, data):
+        reply = Reply()
+        with self.lock:
+            try:
+                if self.sock is None:
+                    self.connect()
+                self.next_id = (self.next_id + 1) & 0xffffffff
+                self.pending[self.next_id] = reply
+                self.sock.sendall(encode_frame(self.next_id, data))
+            except socket.error as e:
+                if self.sock is not None:
+                    self.disconnect(str(e))
+                reply.set(error=str(e))
+        return reply
+
+    def request(self, data):
+        return self.send(data).get()
+
+    def read_replies(self, sock):
+        rfile = sock.makefile('rb')
+        error = "Connection closed by peer"
+        try:
+            while True:
+                try:
+                    frame = read_frame(rfile)
+                except socket.timeout:
+                    with self.lock:
+                        idle = not self.pending
+                    if idle:
+                        continue
+                    error = "No reply in %d seconds" % REPLY_TIMEOUT
+                    break
+                if frame is None:
+                    break
+                req_id, data = frame
+                with self.lock:
+                    reply = self.pending.pop(req_id, None)
+                if reply is not None:
+                    reply.set(data)
+        except (socket.error, ValueError, TransportError) as e:
+            error = str(e)
+        finally:
+            rfile.close()
+        with self.lock:
+            if self.sock is sock:
+                self.disconnect(error)
+
+
+class FramedRequestHandler(SocketServer.StreamRequestHandler):
+    '''
+    Serves the framed requests of one connection until the peer closes it. process() returns
+    the reply, or a callable which waits for it, so the next requests are read while earlier
+    ones are still in progress. Replies are written in the order of the requests.
+    '''
+    def handle(self):
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.replies = Queue.Queue()
+        writer = threading.Thread(target=self.write_replies)
+        writer.daemon = True
+        writer.start()
+        try:
+            while True:
+                frame = read_frame(self.rfile)
+                if frame is None:
+                    break
+                req_id, data = frame
+                self.replies.put((req_id, self.process(data)))
+        finally:
+            self.replies.put(None)
+            writer.join()
+
+    def write_replies(self):
+        while True:
+            item = self.replies.get()
+            if item is None:
+                return
+            req_id, reply = item
+            if callable(reply):
+                try:
+                    reply = reply()
+                except TransportError as e:
+                    reply = {'status': 'ERROR', 'error': str(e)}
+            try:
+                self.connection.sendall(encode_frame(req_id, reply))
+            except socket.error:
+                return
+
+    def process(self, data):
+        raise NotImplementedError
+
+
+class FramedServer(SocketServer.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+    request_queue_size = 64
@@ -1,12 +1,11 @@
-import SocketServer
-import pickle
-import socket
 import argparse
+import threading
 import yaml
 import xml.etree.ElementTree as ET
 import datetime
 import os.path
 from pprint import pprint
+from proxy_transport import Conn, FramedRequestHandler, FramedServer, VM_LISTENER_PORT, PTF_PROXY_PORT
 
 
 g_log_fp = None
@@ -22,44 +21,42 @@ def log(message, output_on_console=False):
         g_log_fp.flush()
 
 
-class TCPHandler(SocketServer.StreamRequestHandler):
-    def handle(self):
-        data = pickle.load(self.rfile)
+class TCPHandler(FramedRequestHandler):
+    def process(self, data):
         log("Received request: %s" % str(data))
         key = self.client_address[0], data['intf']
-        if key in self.server.x_table:
-            value = self.server.x_table[key]
-            conn = Conn(value[0])
-            data['intf'] = value[1]
-            log("Send data %s to %s" % (str(value[0]), str(data)))
-            conn.write(data)
-            data = conn.read()
-            log("Received reply %s" % str(data))
-        else:
+        if key not in self.server.x_table:
             data = {'status': 'OK'}
-        data = {'status': 'OK'}
-        log("Send reply %s" % str(data))
-        pickle.dump(data, self.wfile, pickle.HIGHEST_PROTOCOL)
+            log("Send reply %s" % str(data))
+            return data
 
+        value = self.server.x_table[key]
+        data = dict(data, intf=value[1])
+        log("Send data %s to %s" % (str(value[0]), str(data)))
+        reply = self.server.get_vm_conn(value[0]).send(data)
 
-class Conn(object):
-    def __init__(self, ip):
-        self.conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.conn.connect((ip, 9876))
+        def wait_reply():
+            log("Received reply %s" % str(reply.get()))
+            data = {'status': 'OK'}
+            log("Send reply %s" % str(data))
+            return data
+
+        return wait_reply
 
-    def __del__(self):
-        self.conn.close()
 
-    def read(self):
-        fp = self.conn.makefile('rb', 1024)
-        data = pickle.load(fp)
-        fp.close()
-        return data
+class ProxyServer(FramedServer):
+    def __init__(self, address, x_table):
+        FramedServer.__init__(self, address, TCPHandler)
+        self.x_table = x_table
+        self.vm_conns = {}
+        self.vm_conns_lock = threading.Lock()
 
-    def write(self, data):
-        fp = self.conn.makefile('wb', 1024)
-        pickle.dump(data, fp, pickle.HIGHEST_PROTOCOL)
-        fp.close()
+    def get_vm_conn(self, ip):
+        # One connection per VM, shared by all the fanouts
+        with self.vm_conns_lock:
+            if ip not in self.vm_conns:
+                self.vm_conns[ip] = Conn(ip, VM_LISTENER_PORT)
+            return self.vm_conns[ip]
 
 
 def parse_lab_connection_graph(lab_connection_file, dut):
@@ -168,10 +165,7 @@ def main():
 
     x_table = generate_x_table(base_vm, dut)
 
-    server = SocketServer.TCPServer(("0.0.0.0", 9877), TCPHandler)
-    server.request_queue_size = 64
-    server.allow_reuse_address = True
-    server.x_table = x_table
+    server = ProxyServer(("0.0.0.0", PTF_PROXY_PORT), x_table)
     server.serve_forever()
 
     return
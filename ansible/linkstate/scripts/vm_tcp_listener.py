@@ -1,7 +1,8 @@
 from pprint import pprint
 import pickle
-import SocketServer
 import datetime
+import threading
+from proxy_transport import FramedRequestHandler, FramedServer, VM_LISTENER_PORT
 
 
 g_log_fp = None
@@ -17,14 +18,12 @@ def log(message, output_on_console=False):
         g_log_fp.flush()
 
 
-class TCPHandler(SocketServer.StreamRequestHandler):
-    def handle(self):
-        data = pickle.load(self.rfile)
+class TCPHandler(FramedRequestHandler):
+    def process(self, data):
         log("Received and send request %s" % str(data))
-        self.server.fifo_client.write(data)
-        data = self.server.fifo_client.read()
+        data = self.server.fifo_client.request(data)
         log("Received and send reply %s" % str(data))
-        pickle.dump(data, self.wfile, pickle.HIGHEST_PROTOCOL)
+        return data
 
 
 class FIFOClient(object):
@@ -33,6 +32,13 @@ class FIFOClient(object):
     def __init__(self):
         self.fifow = open(self.FIFOw)
         self.fifor = open(self.FIFOr, 'w')
+        self.lock = threading.Lock()
+
+    def request(self, data):
+        # The fifo is shared by the connections of all the peers
+        with self.lock:
+            self.write(data)
+            return self.read()
 
     def write(self, data):
         pickle.dump(data, self.fifor, pickle.HIGHEST_PROTOCOL)
@@ -48,7 +54,7 @@ def main():
         g_log_fp = open("/tmp/vm_tcp_listener.log", "w")
 
         fifo = FIFOClient()
-        server = SocketServer.TCPServer(("0.0.0.0", 9876), TCPHandler)
+        server = FramedServer(("0.0.0.0", VM_LISTENER_PORT), TCPHandler)
         server.fifo_client = fifo
         server.serve_forever()
     except:
@@ -1,24 +1,101 @@
 #!/usr/bin/env python
+'''
+Inject routes into exabgp instances through their http_api.py.
 
-import cPickle
-import os
+Input file has one 'command;port' line per route. Commands of every port are sent in batches
+over one persistent HTTP connection, all the ports at the same time. Every batch is confirmed
+by http_api.py with the number of commands it passed to exabgp, and a single 'flush route'
+is sent to every port once all the batches were confirmed.
+
+Usage: announce_routes.py <routes file> [batch size]
+'''
+
+import httplib
+import threading
 import time
+import urllib
 import sys
 
-with open(sys.argv[1]) as f:
-    routes = f.readlines()
+BATCH_SIZE = 1000
+HTTP_TIMEOUT = 60
+
+
+class Injector(threading.Thread):
+    def __init__(self, port, commands, batch_size):
+        threading.Thread.__init__(self)
+        self.port = port
+        self.commands = commands
+        self.batch_size = batch_size
+        self.conn = None
+        self.error = None
+        self.elapsed = 0.0
+
+    def post(self, commands):
+        body = urllib.urlencode({'commands': '\n'.join(commands)})
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        # A kept alive connection may be closed by the server, reconnect once
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = httplib.HTTPConnection('localhost', self.port, timeout=HTTP_TIMEOUT)
+            try:
+                self.conn.request('POST', '/', body, headers)
+                response = self.conn.getresponse()
+                reply = response.read()
+                break
+            except (httplib.HTTPException, IOError):
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+        if response.status != 200 or reply.split() != ['OK', str(len(commands))]:
+            raise Exception('port %s: %d commands were not confirmed, reply %d %s'
+                            % (self.port, len(commands), response.status, reply.strip()))
+
+    def run(self):
+        start = time.time()
+        try:
+            for i in range(0, len(self.commands), self.batch_size):
+                self.post(self.commands[i:i + self.batch_size])
+            self.post(['flush route'])
+        except Exception as e:
+            self.error = e
+        finally:
+            if self.conn is not None:
+                self.conn.close()
+        self.elapsed = time.time() - start
+
+
+def main():
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else BATCH_SIZE
+    commands = {}
+    with open(sys.argv[1]) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            command, port = line.rsplit(';', 1)
+            commands.setdefault(port.strip(), []).append(command.strip())
+
+    start = time.time()
+    injectors = [Injector(port, port_commands, batch_size) for port, port_commands in commands.items()]
+    for injector in injectors:
+        injector.start()
+    for injector in injectors:
+        injector.join()
+    elapsed = time.time() - start
 
-routes=[x.strip() for x in routes]
-ports = set()
+    total = 0
+    for injector in injectors:
+        if injector.error is not None:
+            print 'port %s: failed: %s' % (injector.port, injector.error)
+            continue
+        total += len(injector.commands)
+        print 'port %s: %d prefixes in %.2f seconds, %.0f prefixes/sec' % (
+            injector.port, len(injector.commands), injector.elapsed, len(injector.commands) / max(injector.elapsed, 1e-6))
+    print 'total: %d prefixes in %.2f seconds, %.0f prefixes/sec' % (total, elapsed, total / max(elapsed, 1e-6))
 
-for route in routes:
-   [command, port] = route.split(";")
-   port = port.strip()
-   ports.add(port)
-   os.system('curl -s --form "command=%s" http://localhost:%s/' % (command, port))
+    if any(injector.error is not None for injector in injectors):
+        sys.exit(1)
 
-for n in range(0, 20):
-    time.sleep(10)
-    for port in ports:
-        os.system('curl -s --form "command=flush route" http://localhost:%s/' % port)
 
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,18 @@
 import binascii
+import ctypes
 import socket
 import struct
 import select
+import signal
+import errno
 import json
+import mmap
+import time
 import argparse
 import os.path
 from fcntl import ioctl
 from pprint import pprint
-import logging
-logging.getLogger("scapy.runtime").setLevel(logging.ERROR)
-import ptf.packet as scapy
-import scapy.all as scapy2
-scapy2.conf.use_pcap=True
-import scapy.arch.pcapdnet
+
 
 def hexdump(data):
     print " ".join("%02x" % ord(d) for d in data)
@@ -29,35 +29,131 @@ def get_mac(iff):
     return get_if(iff, SIOCGIFHWADDR)[18:24]
 
 
+# Classic BPF opcodes (linux/filter.h)
+BPF_LD_W_ABS = 0x20
+BPF_LD_H_ABS = 0x28
+BPF_LD_B_ABS = 0x30
+BPF_JEQ_K    = 0x15
+BPF_RET_K    = 0x06
+SKF_AD_PKTTYPE = 0xfffff000 + 4
+PACKET_OUTGOING = 4
+
+# Filter accepting only ARP and ICMPv6 Neighbor Solicitation frames received by the interface.
+# VLAN tags are normally moved to the packet metadata by the kernel, but inline tags are accepted too.
+# Jump targets are either None (next instruction) or a label.
+ARP_ND_FILTER = [
+    (None,     BPF_LD_W_ABS, None,     None,     SKF_AD_PKTTYPE),
+    (None,     BPF_JEQ_K,    'drop',   None,     PACKET_OUTGOING),
+    (None,     BPF_LD_H_ABS, None,     None,     12),
+    (None,     BPF_JEQ_K,    'accept', None,     0x0806),
+    (None,     BPF_JEQ_K,    'ipv6',   None,     0x86dd),
+    (None,     BPF_JEQ_K,    'vlan',   'drop',   0x8100),
+    ('ipv6',   BPF_LD_B_ABS, None,     None,     20),
+    (None,     BPF_JEQ_K,    None,     'drop',   58),
+    (None,     BPF_LD_B_ABS, None,     None,     54),
+    (None,     BPF_JEQ_K,    'accept', 'drop',   135),
+    ('vlan',   BPF_LD_H_ABS, None,     None,     16),
+    (None,     BPF_JEQ_K,    'accept', None,     0x0806),
+    (None,     BPF_JEQ_K,    None,     'drop',   0x86dd),
+    (None,     BPF_LD_B_ABS, None,     None,     24),
+    (None,     BPF_JEQ_K,    None,     'drop',   58),
+    (None,     BPF_LD_B_ABS, None,     None,     58),
+    (None,     BPF_JEQ_K,    'accept', 'drop',   135),
+    ('accept', BPF_RET_K,    None,     None,     0xffff),
+    ('drop',   BPF_RET_K,    None,     None,     0),
+]
+
+def bpf_assemble(program):
+    labels = dict((insn[0], pc) for pc, insn in enumerate(program) if insn[0] is not None)
+    code = ''
+    for pc, (_, op, jt, jf, k) in enumerate(program):
+        jt = 0 if jt is None else labels[jt] - pc - 1
+        jf = 0 if jf is None else labels[jf] - pc - 1
+        code += struct.pack('HBBI', op, jt, jf, k)
+
+    return code
+
+def attach_filter(sock, program):
+    SO_ATTACH_FILTER = 26
+    code = bpf_assemble(program)
+    code_buf = ctypes.create_string_buffer(code)
+    fprog = struct.pack('HL', len(program), ctypes.addressof(code_buf))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+
+    return code_buf # has to stay alive while being referenced by the socket
+
+def checksum_add(data, csum=0):
+    if len(data) % 2:
+        data += '\x00'
+    return csum + sum(struct.unpack('!%dH' % (len(data) / 2), data))
+
+def checksum_fold(csum):
+    while csum >> 16:
+        csum = (csum & 0xffff) + (csum >> 16)
+    return ~csum & 0xffff
+
+
 class Interface(object):
     ETH_P_ALL = 0x03
-    RCV_TIMEOUT = 1000
-    RCV_SIZE = 4096
+    SOL_PACKET = 263
+    PACKET_RX_RING = 5
+    PACKET_VERSION = 10
+    TPACKET_V2 = 1
+    TP_STATUS_KERNEL = 0
+    TP_STATUS_USER = 1
+    TP_STATUS_VLAN_VALID = 0x10
+    TPACKET2_HDR = struct.Struct('IIIHHIIHH')
+    FRAME_SIZE = 2048
+    BLOCK_SIZE = 4096
+    RING_FRAMES = 256
 
     def __init__(self, iface):
         self.iface = iface
         self.socket = None
+        self.ring = None
+        self.frame = 0
         self.mac_address = get_mac(iface)
+        self.counters = {'rx': 0, 'tx': 0, 'tx_errors': 0, 'arp_requests': 0, 'ns_requests': 0, 'ignored': 0}
 
     def __del__(self):
+        if self.ring:
+            self.ring.close()
         if self.socket:
             self.socket.close()
 
     def bind(self):
-        self.socket = scapy2.conf.L2listen(iface=self.iface)
+        self.socket = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(self.ETH_P_ALL))
+        self.filter = attach_filter(self.socket, ARP_ND_FILTER)
+        self.socket.setsockopt(self.SOL_PACKET, self.PACKET_VERSION, self.TPACKET_V2)
+        req = struct.pack('IIII', self.BLOCK_SIZE, self.RING_FRAMES * self.FRAME_SIZE / self.BLOCK_SIZE, self.FRAME_SIZE, self.RING_FRAMES)
+        self.socket.setsockopt(self.SOL_PACKET, self.PACKET_RX_RING, req)
+        self.ring = mmap.mmap(self.socket.fileno(), self.RING_FRAMES * self.FRAME_SIZE, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        self.socket.bind((self.iface, self.ETH_P_ALL))
+        self.socket.setblocking(0)
 
     def handler(self):
-        return self.socket
+        return self.socket.fileno()
 
     def recv(self):
-        sniffed = self.socket.recv()
-        pkt = sniffed[0]
-        str_pkt = str(pkt).encode("HEX")
-        binpkt = binascii.unhexlify(str_pkt)
-        return binpkt
+        """ Yields (frame, vlan_id) for every frame the kernel has put into the RX ring """
+        while True:
+            offset = self.frame * self.FRAME_SIZE
+            status, _, snaplen, mac, _, _, _, vlan_tci, _ = self.TPACKET2_HDR.unpack_from(self.ring, offset)
+            if not status & self.TP_STATUS_USER:
+                return
+            data = self.ring[offset + mac:offset + mac + snaplen]
+            vlan_id = struct.pack('!H', vlan_tci & 0xfff) if status & self.TP_STATUS_VLAN_VALID and vlan_tci & 0xfff else None
+            self.ring[offset:offset + 4] = struct.pack('I', self.TP_STATUS_KERNEL)
+            self.frame = (self.frame + 1) % self.RING_FRAMES
+            self.counters['rx'] += 1
+            yield data, vlan_id
 
     def send(self, data):
-        scapy2.sendp(data, iface=self.iface)
+        try:
+            self.socket.send(data)
+            self.counters['tx'] += 1
+        except socket.error:
+            self.counters['tx_errors'] += 1
 
     def mac(self):
         return self.mac_address
@@ -67,71 +163,148 @@ class Interface(object):
 
 
 class Poller(object):
-    def __init__(self, interfaces, responder):
+    def __init__(self, interfaces, responder, stats_file=None, stats_interval=None):
         self.responder = responder
+        self.interfaces = interfaces
+        self.stats_file = stats_file
+        self.stats_interval = stats_interval
+        self.dump_requested = False
         self.mapping = {}
+        self.epoll = select.epoll()
         for interface in interfaces:
             self.mapping[interface.handler()] = interface
+            self.epoll.register(interface.handler(), select.EPOLLIN)
+
+    def request_stats(self, *args):
+        self.dump_requested = True
+
+    def dump_stats(self):
+        if not self.stats_file:
+            return
+        stats = dict((interface.name(), interface.counters) for interface in self.interfaces)
+        tmp_file = self.stats_file + '.tmp'
+        with open(tmp_file, 'w') as fp:
+            json.dump(stats, fp)
+        os.rename(tmp_file, self.stats_file)
 
     def poll(self):
-        handlers = self.mapping.keys()
+        timeout = self.stats_interval if self.stats_interval else -1
+        next_dump = time.time() + timeout
         while True:
-            (rdlist, _, _) = select.select(handlers, [], [])
-            for handler in rdlist:
-                self.responder.action(self.mapping[handler])
+            try:
+                events = self.epoll.poll(timeout)
+            except IOError as e:
+                if e.errno != errno.EINTR:
+                    raise
+                events = []
+            for fd, _ in events:
+                self.responder.action(self.mapping[fd])
+            if self.dump_requested or (self.stats_interval and time.time() >= next_dump):
+                self.dump_requested = False
+                next_dump = time.time() + timeout
+                self.dump_stats()
 
 
 class ARPResponder(object):
     ARP_PKT_LEN = 64
     ARP_OP_REQUEST = 1
+    ICMPV6_NS = 135
+    ICMPV6_NA = 136
+
     def __init__(self, ip_sets):
         self.arp_chunk = binascii.unhexlify('08060001080006040002') # defines a part of the packet for ARP Reply
         self.arp_pad = binascii.unhexlify('00' * 18)
 
         self.ip_sets = ip_sets
+        self.arp_templates = {}
+        self.na_templates = {}
+        for iface, ip_dict in ip_sets.items():
+            self.arp_templates[iface] = {}
+            self.na_templates[iface] = {}
+            for ip, mac in ip_dict.items():
+                if ip == 'vlan':
+                    continue
+                if ':' in ip:
+                    local_ip = socket.inet_pton(socket.AF_INET6, ip)
+                    self.na_templates[iface][local_ip] = self.generate_na_template(mac, local_ip)
+                else:
+                    local_ip = socket.inet_aton(ip)
+                    self.arp_templates[iface][local_ip] = self.generate_arp_template(mac, local_ip)
 
         return
 
     def action(self, interface):
-        data = interface.recv()
-        if len(data) > self.ARP_PKT_LEN:
-            return
+        for data, vlan_id in interface.recv():
+            eth_offset = 0
+            ether_type = data[12:14]
+            if ether_type == '\x81\x00' and data[14:16] != '\x00\x00':
+                eth_offset = 4
+                vlan_id = data[14:16]
+                ether_type = data[16:18]
+
+            if ether_type == '\x08\x06':
+                interface.counters['arp_requests'] += 1
+                reply = self.arp_reply(interface.name(), data, eth_offset, vlan_id)
+            else:
+                interface.counters['ns_requests'] += 1
+                reply = self.na_reply(interface.name(), data, eth_offset, vlan_id)
 
-        remote_mac, remote_ip, request_ip, op_type, vlan_id = self.extract_arp_info(data)
+            if reply is None:
+                interface.counters['ignored'] += 1
+            else:
+                interface.send(reply)
+
+        return
+
+    def arp_reply(self, iface, data, eth_offset, vlan_id):
+        if len(data) > self.ARP_PKT_LEN:
+            return None
 
         # Don't send ARP response if the ARP op code is not request
-        if op_type != self.ARP_OP_REQUEST:
-            return
+        if data[20 + eth_offset:22 + eth_offset] != '\x00\x01':
+            return None
 
-        request_ip_str = socket.inet_ntoa(request_ip)
-        if request_ip_str not in self.ip_sets[interface.name()]:
-            return
-        arp_reply = self.generate_arp_reply(self.ip_sets[interface.name()][request_ip_str], remote_mac, request_ip, remote_ip, vlan_id)
-        interface.send(arp_reply)
+        template = self.arp_templates[iface].get(data[38 + eth_offset:42 + eth_offset])
+        if template is None:
+            return None
 
-        return
+        reply = bytearray(template)
+        reply[0:6] = data[6:12]
+        reply[32:38] = data[6:12]
+        reply[38:42] = data[28 + eth_offset:32 + eth_offset]
+        if vlan_id is not None:
+            reply[12:12] = '\x81\x00' + vlan_id
 
-    def extract_arp_info(self, data):
-        # remote_mac, remote_ip, request_ip, op_type
-        rem_ip_start = 28
-        req_ip_start = 38
-        op_type_start = 20
-        eth_offset = 0
-        vlan_id = None
-        ether_type = str(data[12:14]).encode("HEX")
-        if (ether_type == '8100'):
-            vlan = str(data[14:16]).encode("HEX")
-            if (vlan != '0000'):
-                eth_offset = 4
-                vlan_id = data[14:16]
-        rem_ip_start = rem_ip_start + eth_offset
-        req_ip_start = req_ip_start + eth_offset
-        op_type_start = op_type_start + eth_offset
-        rem_ip_end = rem_ip_start + 4
-        req_ip_end = req_ip_start + 4
-        op_type_end = op_type_start + 1
+        return str(reply)
+
+    def na_reply(self, iface, data, eth_offset, vlan_id):
+        template = self.na_templates[iface].get(data[62 + eth_offset:78 + eth_offset])
+        if template is None:
+            return None
+
+        remote_ip = data[22 + eth_offset:38 + eth_offset]
+        if remote_ip == '\x00' * 16:
+            return None # Duplicate address detection probe
+
+        template, partial_csum = template
+        reply = bytearray(template)
+        reply[0:6] = data[6:12]
+        reply[38:54] = remote_ip
+        reply[56:58] = struct.pack('!H', checksum_fold(checksum_add(remote_ip, partial_csum)))
+        if vlan_id is not None:
+            reply[12:12] = '\x81\x00' + vlan_id
+
+        return str(reply)
+
+    def generate_arp_template(self, local_mac, local_ip):
+        return self.generate_arp_reply(local_mac, '\x00' * 6, local_ip, '\x00' * 4, None)
+
+    def generate_na_template(self, local_mac, local_ip):
+        icmp = struct.pack('!BBHI', self.ICMPV6_NA, 0, 0, 0x60000000) + local_ip + '\x02\x01' + local_mac
+        ipv6 = struct.pack('!IHBB', 0x60000000, len(icmp), 58, 255) + local_ip + '\x00' * 16
+        partial_csum = checksum_add(local_ip + struct.pack('!II', len(icmp), 58) + icmp)
 
-        return data[6:12], data[rem_ip_start:rem_ip_end], data[req_ip_start:req_ip_end], (ord(data[op_type_start]) * 256 + ord(data[op_type_end])), vlan_id
+        return '\x00' * 6 + local_mac + '\x86\xdd' + ipv6 + icmp, partial_csum
 
     def generate_arp_reply(self, local_mac, remote_mac, local_ip, remote_ip, vlan_id):
         eth_hdr = remote_mac + local_mac
@@ -145,6 +318,8 @@ def parse_args():
     parser = argparse.ArgumentParser(description='ARP autoresponder')
     parser.add_argument('--conf', '-c', type=str, dest='conf', default='/tmp/from_t1.json', help='path to json file with configuration')
     parser.add_argument('--extended', '-e', action='store_true', dest='extended', default=False, help='enable extended mode')
+    parser.add_argument('--stats', '-s', type=str, dest='stats', default='/tmp/arp_responder.stats.json', help='path to json file with per-interface counters')
+    parser.add_argument('--stats-interval', type=int, dest='stats_interval', default=10, help='interval in seconds between counters dumps. Send SIGUSR1 to dump the counters immediately')
     args = parser.parse_args()
 
     return args
@@ -188,7 +363,8 @@ def main():
 
     resp = ARPResponder(ip_sets)
 
-    p = Poller(ifaces, resp)
+    p = Poller(ifaces, resp, args.stats, args.stats_interval)
+    signal.signal(signal.SIGUSR1, p.request_stats)
     p.poll()
 
     return
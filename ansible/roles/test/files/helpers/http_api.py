@@ -1,16 +1,30 @@
 from flask import Flask, request
+from werkzeug.serving import WSGIRequestHandler
 import sys
 
 app = Flask(__name__)
 
+def get_commands():
+    # 'command' and 'commands' form fields and plain text bodies can hold many commands, one per line.
+    # 'commands' may also be separated with ';'
+    if 'commands' in request.form:
+        body = request.form['commands'].replace(';', '\n')
+    elif 'command' in request.form:
+        body = request.form['command']
+    else:
+        body = request.get_data()
+    return [command.strip() for command in body.splitlines() if command.strip()]
+
 # Setup a command route to listen for prefix advertisements
 @app.route('/', methods=['POST'])
 def run_command():
-    command = request.form['command']
-    sys.stdout.write('%s\n' % command)
+    commands = get_commands()
+    sys.stdout.write(''.join('%s\n' % command for command in commands))
     sys.stdout.flush()
-    return 'OK\n'
+    # The number of commands passed to exabgp confirms the whole batch was delivered
+    return 'OK %d\n' % len(commands)
 
 if __name__ == '__main__':
+    # Keep connections alive, so an injector can send all its batches over one connection
+    WSGIRequestHandler.protocol_version = 'HTTP/1.1'
     app.run(port=sys.argv[1])
-
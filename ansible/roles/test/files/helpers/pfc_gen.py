@@ -3,10 +3,17 @@
 """
 Script to generate PFC packets.
 
+With '--fps' the frames are sent at the target rate on every interface. Frames are sent in
+sendmmsg() batches, and the batches follow a schedule computed from the start time, so the
+rate does not drift with sleep inaccuracy. The achieved rate is reported at the end.
 """
 import binascii
 import sys
 import os
+import time
+import errno
+import ctypes
+import ctypes.util
 import optparse
 import logging
 import logging.handlers
@@ -16,6 +23,108 @@ from struct import *
 my_logger = logging.getLogger('MyLogger')
 my_logger.setLevel(logging.DEBUG)
 
+# Largest number of frames passed to a single sendmmsg() call
+MAX_BATCH = 1024
+# Interval between batches when pacing. Shorter intervals make smaller batches and a smoother storm
+PACING_INTERVAL = 0.001
+# Restart the schedule instead of bursting when the sender is late by more than that many seconds
+MAX_LAG = 0.1
+
+class iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+class msghdr(ctypes.Structure):
+    _fields_ = [("msg_name", ctypes.c_void_p), ("msg_namelen", ctypes.c_uint32),
+                ("msg_iov", ctypes.POINTER(iovec)), ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p), ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int)]
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", msghdr), ("msg_len", ctypes.c_uint)]
+
+def load_sendmmsg():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        sendmmsg = libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int]
+    sendmmsg.restype = ctypes.c_int
+    return sendmmsg
+
+class FrameSender(object):
+    """
+    Send copies of the same frame through a bound AF_PACKET socket, up to MAX_BATCH per system call
+    """
+    def __init__(self, sock, packet, sendmmsg):
+        self.sock = sock
+        self.packet = packet
+        self.sendmmsg = sendmmsg
+        self.sent = 0
+        if sendmmsg is not None:
+            self.buf = ctypes.create_string_buffer(packet, len(packet))
+            self.iov = iovec(ctypes.cast(self.buf, ctypes.c_void_p), len(packet))
+            self.msgs = (mmsghdr * MAX_BATCH)()
+            for msg in self.msgs:
+                msg.msg_hdr.msg_iov = ctypes.pointer(self.iov)
+                msg.msg_hdr.msg_iovlen = 1
+
+    def send(self, count):
+        """
+        Send count frames, returns when all of them are handed to the kernel
+        """
+        if self.sendmmsg is None:
+            for i in range(count):
+                self.sock.send(self.packet)
+            self.sent += count
+            return
+
+        fd = self.sock.fileno()
+        while count > 0:
+            res = self.sendmmsg(fd, self.msgs, min(count, MAX_BATCH), 0)
+            if res < 0:
+                err = ctypes.get_errno()
+                if err in (errno.EINTR, errno.EAGAIN, errno.ENOBUFS):
+                    continue
+                raise OSError(err, os.strerror(err))
+            count -= res
+            self.sent += res
+
+def storm(senders, num, fps):
+    """
+    Send num frames through every sender. With fps the frames of every sender are paced to fps,
+    otherwise they are sent as fast as possible.
+    Returns the time it took
+    """
+    batch = MAX_BATCH
+    if fps:
+        batch = max(1, min(MAX_BATCH, int(fps * PACING_INTERVAL)))
+
+    start = time.time()
+    sent = 0
+    while sent < num:
+        count = min(batch, num - sent)
+        if fps:
+            # The deadline of a batch is computed from the start time and the frames sent
+            # so far, so sleep inaccuracy of one batch is compensated by the next one
+            deadline = start + float(sent) / fps
+            now = time.time()
+            if deadline > now:
+                time.sleep(deadline - now)
+            elif now - deadline > MAX_LAG:
+                start = now - float(sent) / fps
+        for sender in senders:
+            sender.send(count)
+        sent += count
+
+    if fps:
+        # The last batch lasts until the next one would have been sent
+        remaining = start + float(sent) / fps - time.time()
+        if remaining > 0:
+            time.sleep(remaining)
+
+    return time.time() - start
+
 def checksum(msg):
     s = 0
 
@@ -41,6 +150,7 @@ def main():
     parser.add_option("-n", "--num", type="int", dest="num", help="Number of packets to be sent",metavar="number",default=1)
     parser.add_option("-r", "--rsyslog-server", type="string", dest="rsyslog_server", default="127.0.0.1", help="Rsyslog server IPv4 address",metavar="IPAddress") 
     parser.add_option('-g', "--global", action="store_true", dest="global_pf", help="Send global pause frames (not PFC)", default=False)
+    parser.add_option('-f', "--fps", type="int", dest="fps", help="Frames per second on each interface, every frame pauses all the enabled classes. 0 means as fast as possible", metavar="fps", default=0)
     (options, args) = parser.parse_args()
 
     if options.interface is None:
@@ -65,6 +175,11 @@ def main():
         parser.print_help()
         sys.exit(1)
 
+    if options.fps < 0:
+        print "Frame rate is not valid. Need to be 0 or more."
+        parser.print_help()
+        sys.exit(1)
+
     interfaces = options.interface.split(',')
 
     try:
@@ -147,12 +262,15 @@ def main():
     pre_str = 'GLOBAL_PF' if options.global_pf else 'PFC'
     print "Generating %s Packet(s)" % options.num
     my_logger.debug(pre_str + '_STORM_START')
-    iteration = options.num
-    while iteration > 0:
-        for s in sockets:
-            s.send(packet)
-        iteration -= 1
+    sendmmsg = load_sendmmsg()
+    senders = [FrameSender(s, packet, sendmmsg) for s in sockets]
+    duration = storm(senders, options.num, options.fps)
     my_logger.debug(pre_str + '_STORM_END')
 
+    for sender, interface in zip(senders, interfaces):
+        rate = sender.sent / duration if duration > 0 else 0
+        print "%s: sent %d frames in %.3f seconds, %.1f fps (target %s)" % \
+            (interface, sender.sent, duration, rate, options.fps if options.fps else "max")
+
 if __name__ == "__main__":
     main()
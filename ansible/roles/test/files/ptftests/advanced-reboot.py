@@ -25,6 +25,12 @@
 #    if BGP graceful restart is not enabled on DUT the test fails
 #    If BGP graceful restart timeout value is almost exceeded (less than 15 seconds) the test fails
 #    if BGP routes disappeares more then once, the test failed
+#    Every VM is polled on its own schedule (neigh_poll_interval), the states are read as json and every
+#    observation is timestamped with the middle of its command round trip
+#
+# With probe_rate=<pps> parameter the reachability of the data plane and the control plane is watched by continuous
+# probes instead of probing rounds: every probe packet carries a sequence number and a send timestamp, replies are
+# matched by a separate receiver, and the loss windows, duplicates and reordering are reported with ms accuracy.
 #
 # The test expects you're running the test with link state propagation helper.
 # That helper propagate a link state from fanout switch port to corresponding VM port
@@ -65,6 +71,7 @@ import itertools
 from device_connection import DeviceConnection
 
 from arista import Arista
+from reachability_probe import ReachabilityProbe
 import sad_path as sp
 
 
@@ -112,6 +119,11 @@ class ReloadTest(BaseTest):
     VLAN_BASE_MAC_PATTERN = '72060001{:04}'
     LAG_BASE_MAC_PATTERN = '5c010203{:04}'
     SOCKET_RECV_BUFFER_SIZE = 10 * 1024 * 1024
+    PROBE_WINDOW = 0.2          # Reachability is evaluated over the probes sent during that many seconds
+    PROBE_GRACE = 0.2           # Time given to the probe replies to arrive
+    PROBE_INTERVAL = 0.05       # Interval between evaluations of the probes
+    PROBE_TCP_SPORT = 1235      # Differs from the flow of send_in_background, so the sniffer ignores the probes
+    DATAPLANE_PROBES = ['servers->t1', 't1->servers']
 
     def __init__(self):
         BaseTest.__init__(self)
@@ -151,6 +163,8 @@ class ReloadTest(BaseTest):
         self.check_param('sniff_time_incr', 60, required = False)
         self.check_param('vnet', False, required = False)
         self.check_param('vnet_pkts', None, required = False)
+        self.check_param('probe_rate', 0, required = False) # pps of each continuous probe, 0 to probe in rounds
+        self.check_param('neigh_poll_interval', 0.5, required = False) # seconds between polls of the neighbor VMs state
         if not self.test_params['preboot_oper'] or self.test_params['preboot_oper'] == 'None':
             self.test_params['preboot_oper'] = None
         if not self.test_params['inboot_oper'] or self.test_params['inboot_oper'] == 'None':
@@ -188,6 +202,7 @@ class ReloadTest(BaseTest):
         self.max_nr_vl_pkts = 500 # FIXME: should be 1000.
                                   # But ptf is not fast enough + swss is slow for FDB and ARP entries insertions
         self.timeout_thr = None
+        self.probe = None
 
         self.time_to_listen = 180.0     # Listen for more then 180 seconds, to be used in sniff_in_background method.
         #   Inter-packet interval, to be used in send_in_background method.
@@ -532,6 +547,8 @@ class ReloadTest(BaseTest):
         self.generate_from_vlan()
         self.generate_ping_dut_lo()
         self.generate_arp_ping_packet()
+        if self.test_params['probe_rate']:
+            self.generate_probes()
 
         if self.reboot_type == 'warm-reboot':
             self.log(self.get_sad_info())
@@ -709,6 +726,32 @@ class ReloadTest(BaseTest):
         self.arp_resp.set_do_not_care_scapy(scapy.ARP,   'hwsrc')
         self.arp_src_port = src_port
 
+    def generate_probes(self):
+        rate = int(self.test_params['probe_rate'])
+        self.probe = ReachabilityProbe(log=self.log)
+
+        def probe_tcp_packet(packet):
+            packet = scapyall.Ether(packet)
+            packet[scapyall.TCP].sport = self.PROBE_TCP_SPORT
+            del packet[scapyall.TCP].chksum
+            return str(packet)
+
+        tcp_payload_offset  = 14 + 20 + 20  # Ethernet + IP + TCP
+        icmp_payload_offset = 14 + 20 + 8   # Ethernet + IP + ICMP
+        self.probe.add_flow('servers->t1',
+                            [('eth%d' % self.from_server_src_port, probe_tcp_packet(self.from_vlan_packet))],
+                            ['eth%d' % port for port in self.from_server_dst_ports],
+                            tcp_payload_offset, rate)
+        self.probe.add_flow('t1->servers',
+                            [('eth%d' % port, probe_tcp_packet(packet)) for port, packet in self.from_t1],
+                            ['eth%d' % port for port in self.vlan_ports],
+                            tcp_payload_offset, rate)
+        self.probe.add_flow('ping_dut',
+                            [('eth%d' % port, self.ping_dut_packet) for port in self.vlan_ports],
+                            ['eth%d' % port for port in self.vlan_ports],
+                            icmp_payload_offset, rate)
+        self.log("Continuous probes are sent with %d pps per flow" % rate)
+
     def generate_bidirectional(self):
         """
         This method is used to pre-generate packets to be sent in background thread.
@@ -858,11 +901,6 @@ class ReloadTest(BaseTest):
                 q.put('quit')
 
             def wait_for_ssh_threads():
-                while any(thr.is_alive() for thr, _ in self.ssh_jobs):
-                    for _, q in self.ssh_jobs:
-                        q.put('go')
-                    time.sleep(self.TIMEOUT)
-
                 for thr, _ in self.ssh_jobs:
                     thr.join()
 
@@ -920,11 +958,12 @@ class ReloadTest(BaseTest):
             self.log("LACP/BGP were down for (extracted from cli):")
             self.log("-"*50)
             for ip in sorted(self.cli_info.keys()):
-                self.log("    %s - lacp: %7.3f (%d) po_events: (%d) bgp v4: %7.3f (%d) bgp v6: %7.3f (%d)" \
+                self.log("    %s - lacp: %7.3f (%d) po_events: (%d) bgp v4: %7.3f (%d) bgp v6: %7.3f (%d) resolution: %.3f" \
                          % (ip, self.cli_info[ip]['lacp'][1],   self.cli_info[ip]['lacp'][0], \
                                 self.cli_info[ip]['po'][1], \
                                 self.cli_info[ip]['bgp_v4'][1], self.cli_info[ip]['bgp_v4'][0],\
-                                self.cli_info[ip]['bgp_v6'][1], self.cli_info[ip]['bgp_v6'][0]))
+                                self.cli_info[ip]['bgp_v6'][1], self.cli_info[ip]['bgp_v6'][0],\
+                                self.cli_info[ip]['resolution']))
 
             self.log("-"*50)
             self.log("Extracted from VM logs:")
@@ -938,6 +977,17 @@ class ReloadTest(BaseTest):
                         self.log("    %s" % self.logs_info[ip][msg])
                 self.log("-"*50)
 
+            if self.probe is not None:
+                self.log("Continuous probes (extracted from the sequence numbers):")
+                self.log("-"*50)
+                for name in self.DATAPLANE_PROBES + ['ping_dut']:
+                    report = self.probe.report(name)
+                    self.log("    %-12s sent %d received %d lost %d duplicates %d reordered %d" \
+                             % (name, report['sent'], report['received'], report['lost'], report['duplicates'], report['reordered']))
+                    self.log("    %-12s loss windows %d longest %.1f ms total %.1f ms" \
+                             % (name, report['loss_windows'], report['longest_loss_ms'], report['total_loss_ms']))
+                self.log("-"*50)
+
             self.log("Summary:")
             self.log("-"*50)
 
@@ -1039,16 +1089,12 @@ class ReloadTest(BaseTest):
 
     def wait_until_cpu_port_down(self):
         while True:
-            for _, q in self.ssh_jobs:
-                q.put('go')
             if self.cpu_state.get() == 'down':
                 break
             time.sleep(self.TIMEOUT)
 
     def wait_until_cpu_port_up(self):
         while True:
-            for _, q in self.ssh_jobs:
-                q.put('go')
             if self.cpu_state.get() == 'up':
                 break
             time.sleep(self.TIMEOUT)
@@ -1269,8 +1315,6 @@ class ReloadTest(BaseTest):
 
         while True:
             state = self.asic_state.get()
-            for _, q in self.ssh_jobs:
-                q.put('go')
             if state == 'down':
                 break
             time.sleep(self.TIMEOUT)
@@ -1465,6 +1509,9 @@ class ReloadTest(BaseTest):
     def reachability_watcher(self):
         # This function watches the reachability of the CPU port, and ASIC. It logs the state
         # changes for future analysis
+        if self.probe is not None:
+            return self.probe_reachability_watcher()
+
         self.watcher_is_stopped.clear() # Watcher is running.
         while self.watching:
             if self.dataplane_io_lock.acquire(False):
@@ -1492,6 +1539,61 @@ class ReloadTest(BaseTest):
         self.watcher_is_running.clear()     # Watcher has stopped.
 
 
+    def probe_reachability_watcher(self):
+        # Same as reachability_watcher, but the states are evaluated from the continuous probes.
+        # The probes don't wait for each other, so the evaluation takes no time
+        self.watcher_is_stopped.clear() # Watcher is running.
+        self.probe.start()
+        arp_watcher = threading.Thread(target=self.arp_ping_watcher)
+        arp_watcher.setDaemon(True)
+        arp_watcher.start()
+        while self.watching:
+            if self.dataplane_io_lock.acquire(False):
+                self.probe.resume(self.DATAPLANE_PROBES)
+                vlan_to_t1 = self.probe.window_stats('servers->t1', self.PROBE_WINDOW, self.PROBE_GRACE)
+                t1_to_vlan = self.probe.window_stats('t1->servers', self.PROBE_WINDOW, self.PROBE_GRACE)
+                if vlan_to_t1 is not None and t1_to_vlan is not None:
+                    self.log_probe_asic_state_change(vlan_to_t1, t1_to_vlan)
+                self.dataplane_io_lock.release()
+            else:
+                # send_in_background owns the data plane
+                self.probe.pause(self.DATAPLANE_PROBES)
+            ping_dut = self.probe.window_stats('ping_dut', self.PROBE_WINDOW, self.PROBE_GRACE)
+            if ping_dut is not None:
+                sent, received, duplicates = ping_dut
+                reachable              = received + duplicates > sent * 0.7
+                partial                = received > 0 and received < sent
+                flooding               = reachable and duplicates > 0
+                self.log_cpu_state_change(reachable, partial, flooding)
+            self.watcher_is_running.set()   # Watcher is running.
+            time.sleep(self.PROBE_INTERVAL)
+        self.probe.stop()
+        arp_watcher.join()
+        self.watcher_is_stopped.set()       # Watcher has stopped.
+        self.watcher_is_running.clear()     # Watcher has stopped.
+
+
+    def log_probe_asic_state_change(self, vlan_to_t1, t1_to_vlan):
+        vlan_to_t1_sent, vlan_to_t1_received, vlan_to_t1_dups = vlan_to_t1
+        t1_to_vlan_sent, t1_to_vlan_received, t1_to_vlan_dups = t1_to_vlan
+        reachable              = (t1_to_vlan_received + t1_to_vlan_dups > t1_to_vlan_sent * 0.7 and
+                                vlan_to_t1_received + vlan_to_t1_dups > vlan_to_t1_sent * 0.7)
+        partial                = (reachable and
+                                (t1_to_vlan_received < t1_to_vlan_sent or
+                                vlan_to_t1_received < vlan_to_t1_sent))
+        flooding               = reachable and (t1_to_vlan_dups > 0 or vlan_to_t1_dups > 0)
+        # Scale to the number of packets in a probing round, that is what the recorded reachability is compared with
+        t1_to_vlan_pkts        = (t1_to_vlan_received + t1_to_vlan_dups) * self.nr_vl_pkts / t1_to_vlan_sent
+        self.log_asic_state_change(reachable, partial, t1_to_vlan_pkts, flooding)
+
+
+    def arp_ping_watcher(self):
+        while self.watching:
+            total_rcv_pkt_cnt      = self.arpPing()
+            reachable              = total_rcv_pkt_cnt >= self.arp_ping_pkts
+            self.log_vlan_state_change(reachable)
+
+
     def pingFromServers(self):
         for i in xrange(self.nr_pc_pkts):
             testutils.send_packet(self, self.from_server_src_port, self.from_vlan_packet)
@@ -48,6 +48,7 @@ class Arista(object):
         self.info = set()
         self.min_bgp_gr_timeout = int(test_params['min_bgp_gr_timeout'])
         self.reboot_type = test_params['reboot_type']
+        self.poll_interval = float(test_params.get('neigh_poll_interval', 0.5))
 
     def __del__(self):
         self.disconnect()
@@ -95,49 +96,71 @@ class Arista(object):
 
         return
 
+    def query(self, cmd):
+        '''
+        @summary: Run a command, timestamp its output with the middle of the command round trip
+        @return: output and its timestamp. The observation was made within the round trip,
+            so the timestamp is precise to the half of it
+        '''
+        sent = time.time()
+        output = self.do_cmd(cmd)
+        received = time.time()
+        self.max_query_time = max(self.max_query_time, received - sent)
+        return output, (sent + received) / 2
+
+    def query_json(self, cmd):
+        output, timestamp = self.query(cmd + ' | json')
+        return self.parse_json(output), timestamp
+
+    def parse_json(self, output):
+        # strip the echoed command and the prompt
+        return json.loads("\n".join(output.split("\r\n")[1:-1]), strict=False)
+
     def run(self):
-        data = {}
+        # entity -> {timestamp: observed state}. Every observation has its own timestamp
+        series = defaultdict(dict)
         debug_data = {}
         run_once = False
         log_first_line = None
         quit_enabled = False
         v4_routing_ok = False
         v6_routing_ok = False
-        routing_works = True
+        self.max_query_time = 0.0
         self.connect()
 
-        cur_time = time.time()
-        sample = {}
-        samples = {}
-        portchannel_output = self.do_cmd("show interfaces po1 | json")
-        portchannel_output = "\n".join(portchannel_output.split("\r\n")[1:-1])
-        sample["po_changetime"] = json.loads(portchannel_output, strict=False)['interfaces']['Port-Channel1']['lastStatusChangeTimestamp']
-        samples[cur_time] = sample
+        obj, timestamp = self.query_json("show interfaces po1")
+        series['po_changetime'][timestamp] = self.parse_po_changetime(obj)
 
+        # The neighbor is polled on its own schedule, so the collectors of all the VMs run concurrently
+        # and don't wait for the test. The test only sends 'quit', which stops the polling once the routes are back
+        next_poll = time.time()
         while not (quit_enabled and v4_routing_ok and v6_routing_ok):
-            cmd = self.queue.get()
-            if cmd == 'quit':
-                quit_enabled = True
+            try:
+                if self.queue.get(timeout=max(next_poll - time.time(), 0)) == 'quit':
+                    quit_enabled = True
                 continue
-            cur_time = time.time()
-            info = {}
-            debug_info = {}
-            lacp_output = self.do_cmd('show lacp neighbor')
-            info['lacp'] = self.parse_lacp(lacp_output)
-            bgp_neig_output = self.do_cmd('show ip bgp neighbors')
-            info['bgp_neig'] = self.parse_bgp_neighbor(bgp_neig_output)
-
-            bgp_route_v4_output = self.do_cmd('show ip route bgp | json')
+            except Queue.Empty:
+                pass
+            next_poll = max(next_poll + self.poll_interval, time.time())
+
+            obj, timestamp = self.query_json('show lacp neighbor')
+            series['lacp'][timestamp] = self.parse_lacp(obj)
+            lacp_output = obj
+
+            # graceful restart timer is only shown in the text output
+            bgp_neig_output, timestamp = self.query('show ip bgp neighbors')
+            series['bgp_neig'][timestamp] = self.parse_bgp_neighbor(bgp_neig_output)
+
+            bgp_route_v4_output, timestamp = self.query_json('show ip route bgp')
             v4_routing_ok = self.parse_bgp_route(bgp_route_v4_output, self.v4_routes)
-            info['bgp_route_v4'] = v4_routing_ok
+            series['bgp_route_v4'][timestamp] = v4_routing_ok
 
-            bgp_route_v6_output = self.do_cmd("show ipv6 route bgp | json")
+            bgp_route_v6_output, timestamp = self.query_json('show ipv6 route bgp')
             v6_routing_ok = self.parse_bgp_route(bgp_route_v6_output, self.v6_routes)
-            info["bgp_route_v6"] = v6_routing_ok
+            series['bgp_route_v6'][timestamp] = v6_routing_ok
 
-            portchannel_output = self.do_cmd("show interfaces po1 | json")
-            portchannel_output = "\n".join(portchannel_output.split("\r\n")[1:-1])
-            sample["po_changetime"] = json.loads(portchannel_output, strict=False)['interfaces']['Port-Channel1']['lastStatusChangeTimestamp']
+            obj, timestamp = self.query_json("show interfaces po1")
+            series['po_changetime'][timestamp] = self.parse_po_changetime(obj)
 
             if not run_once:
                 # clear Portchannel counters
@@ -145,14 +168,12 @@ class Arista(object):
 
                 self.ipv4_gr_enabled, self.ipv6_gr_enabled, self.gr_timeout = self.parse_bgp_neighbor_once(bgp_neig_output)
                 if self.gr_timeout is not None:
-                    log_first_line = "session_begins_%f" % cur_time
+                    log_first_line = "session_begins_%f" % time.time()
                     self.do_cmd("send log message %s" % log_first_line)
                     run_once = True
 
-            data[cur_time] = info
-            samples[cur_time] = sample
             if self.DEBUG:
-                debug_data[cur_time] = {
+                debug_data[timestamp] = {
                     'show lacp neighbor' : lacp_output,
                     'show ip bgp neighbors' : bgp_neig_output,
                     'show ip route bgp' : bgp_route_v4_output,
@@ -179,7 +200,7 @@ class Arista(object):
 
         # save data for troubleshooting
         with open("/tmp/%s.data.pickle" % self.ip, "w") as fp:
-            pickle.dump(data, fp)
+            pickle.dump(dict(series), fp)
 
         # save debug data for troubleshooting
         if self.DEBUG:
@@ -188,12 +209,14 @@ class Arista(object):
             with open("/tmp/%s.logging" % self.ip, "w") as fp:
                 fp.write("\n".join(log_lines))
 
-        self.check_gr_peer_status(data)
+        self.check_gr_peer_status(series['bgp_neig'])
         cli_data = {}
-        cli_data['lacp']   = self.check_series_status(data, "lacp",         "LACP session")
-        cli_data['bgp_v4'] = self.check_series_status(data, "bgp_route_v4", "BGP v4 routes")
-        cli_data['bgp_v6'] = self.check_series_status(data, "bgp_route_v6", "BGP v6 routes")
-        cli_data['po']     = self.check_change_time(samples, "po_changetime", "PortChannel interface")
+        cli_data['lacp']   = self.check_series_status(series['lacp'],         "LACP session")
+        cli_data['bgp_v4'] = self.check_series_status(series['bgp_route_v4'], "BGP v4 routes")
+        cli_data['bgp_v6'] = self.check_series_status(series['bgp_route_v6'], "BGP v6 routes")
+        cli_data['po']     = self.check_change_time(series['po_changetime'],  "PortChannel interface")
+        # the down times above are precise to that many seconds
+        cli_data['resolution'] = self.max_query_time / 2
 
         route_timeout             = log_data['route_timeout']
         cli_data['route_timeout'] = route_timeout
@@ -293,8 +316,15 @@ class Arista(object):
 
         return result
 
-    def parse_lacp(self, output):
-        return output.find('Bundled') != -1
+    def parse_lacp(self, obj):
+        for portchannel in obj.get('portChannels', {}).values():
+            for intf in portchannel.get('interfaces', {}).values():
+                if intf.get('actorPortStatus', '').lower() == 'bundled':
+                    return True
+        return False
+
+    def parse_po_changetime(self, obj):
+        return obj['interfaces']['Port-Channel1']['lastStatusChangeTimestamp']
 
     def parse_bgp_neighbor_once(self, output):
         is_gr_ipv4_enabled = False
@@ -338,11 +368,8 @@ class Arista(object):
 
         return gr_active, gr_timer
 
-    def parse_bgp_route(self, output, expects):
+    def parse_bgp_route(self, obj, expects):
         prefixes = set()
-        data = "\n".join(output.split("\r\n")[1:-1])
-        obj = json.loads(data)
-
         if "vrfs" in obj and "default" in obj["vrfs"]:
             obj = obj["vrfs"]["default"]
         for prefix, attrs in obj["routes"].items():
@@ -475,25 +502,24 @@ class Arista(object):
         if self.gr_timeout < 120: # bgp graceful restart timeout less then 120 seconds
             self.fails.add("bgp graceful restart timeout is less then 120 seconds")
 
-        for when, other in sorted(output.items(), key = lambda x : x[0]):
-            gr_active, timer = other['bgp_neig']
+        for when, (gr_active, timer) in sorted(output.items(), key = lambda x : x[0]):
             # wnen it's False, it's ok, wnen it's True, check that inactivity timer not less then self.min_bgp_gr_timeout seconds
             if gr_active and datetime.datetime.strptime(timer, '%H:%M:%S') < datetime.datetime(1900, 1, 1, second = self.min_bgp_gr_timeout):
                 self.fails.add("graceful restart timer is almost finished. Less then %d seconds left" % self.min_bgp_gr_timeout)
 
-    def check_series_status(self, output, entity, what):
+    def check_series_status(self, output, what):
         # find how long anything was down
-        # Input parameter is a dictionary when:status
+        # Input parameter is a dictionary when:status of the entity
         # constraints:
         # entity must be down just once
         # entity must be up when the test starts
         # entity must be up when the test stops
 
         sorted_keys = sorted(output.keys())
-        if not output[sorted_keys[0]][entity]:
+        if not output[sorted_keys[0]]:
             self.fails.add("%s must be up when the test starts" % what)
             return 0, 0
-        if not output[sorted_keys[-1]][entity]:
+        if not output[sorted_keys[-1]]:
             self.fails.add("%s must be up when the test stops" % what)
             return 0, 0
 
@@ -501,10 +527,10 @@ class Arista(object):
         cur_state = True
         res = defaultdict(list)
         for when in sorted_keys[1:]:
-            if cur_state != output[when][entity]:
+            if cur_state != output[when]:
                 res[cur_state].append(when - start)
                 start = when
-                cur_state = output[when][entity]
+                cur_state = output[when]
         res[cur_state].append(when - start)
 
         is_down_count = len(res[False])
@@ -514,7 +540,7 @@ class Arista(object):
 
         return is_down_count, sum(res[False]) # summary_downtime
 
-    def check_change_time(self, output, entity, what):
+    def check_change_time(self, output, what):
         # find last changing time updated, if no update, the entity is never changed
         # Input parameter is a dictionary when:last_changing_time
         # constraints:
@@ -528,8 +554,8 @@ class Arista(object):
         prev_time = output[start]
         change_count = 0
         for when in sorted_keys[1:]:
-            if prev_time != output[when][entity]:
-                prev_time = output[when][entity]
+            if prev_time != output[when]:
+                prev_time = output[when]
                 change_count += 1
 
         if change_count > 0:
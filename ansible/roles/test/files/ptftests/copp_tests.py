@@ -21,6 +21,8 @@ import ptf.testutils as testutils
 from ptf.testutils import *
 from ptf.dataplane import match_exp_pkt
 import os
+import time
+import bisect
 import signal
 import datetime
 import subprocess
@@ -34,6 +36,15 @@ class ControlPlaneBaseTest(BaseTest):
     PPS_LIMIT_MAX = PPS_LIMIT * 1.1
     NO_POLICER_LIMIT = PPS_LIMIT * 1.4
     PKT_TX_COUNT = 100000
+    # Packets are sent at a fixed rate well above the policer CIR
+    TX_PPS = PPS_LIMIT * 10
+    # The rate is kept by sending a batch of packets every TX_BATCH_INTERVAL seconds
+    TX_BATCH_INTERVAL = 0.01
+    # Offered load is reached when the sent rate is at least this part of TX_PPS
+    TX_PPS_MARGIN = 0.95
+    # Part of the sending period cut from each of its ends for the rate calculation,
+    # while the policer bucket and the queues are still filling up or draining
+    STEADY_STATE_MARGIN = 0.1
     TARGET_PORT = "3"  # historically we have port 3 as a target port
     TASK_TIMEOUT = 300 # Wait up to 5 minutes for tasks to complete
 
@@ -48,6 +59,9 @@ class ControlPlaneBaseTest(BaseTest):
             self.pkt_tx_count = self.PKT_TX_COUNT
         self.pkt_rx_limit = self.pkt_tx_count * 0.90
 
+        self.tx_pps = int(test_params.get('tx_pps', self.TX_PPS))
+        self.offered_load_reached = False
+
         target_port_str = test_params.get('target_port', self.TARGET_PORT)
         self.target_port = int(target_port_str)
 
@@ -107,16 +121,77 @@ class ControlPlaneBaseTest(BaseTest):
             self.timeout_thr.cancel()
             self.timeout_thr = None
 
+    def send_at_rate(self, packet, count, send_intf):
+        '''
+        Send the packets at the rate of self.tx_pps, in batches written one right after another.
+        Returns the list of (time, number of packets sent) taken at the start and after every batch.
+        '''
+        batch_size = max(1, int(self.tx_pps * self.TX_BATCH_INTERVAL))
+        start_time = time.time()
+        tx_marks = [(start_time, 0)]
+        sent = 0
+        while sent < count:
+            batch = min(batch_size, count - sent)
+            for i in xrange(batch):
+                self.dataplane.send(send_intf[0], send_intf[1], packet)
+            sent += batch
+            now = time.time()
+            tx_marks.append((now, sent))
+            delay = start_time + float(sent) / self.tx_pps - now
+            if delay > 0:
+                time.sleep(delay)
+
+        return tx_marks
+
+    def receive_matched_packets(self, packet, recv_intf, timeout=None):
+        '''
+        Receive all packets on the port and return the times the matched packets arrived at the dataplane.
+        As soon as the packets stop arriving, the function waits for the timeout value and returns.
+        '''
+        if timeout is None:
+            timeout = ptf.ptfutils.default_timeout
+
+        rx_times = []
+        while True:
+            result = testutils.dp_poll(self, device_number=recv_intf[0], port_number=recv_intf[1], timeout=timeout)
+            if not isinstance(result, self.dataplane.PollSuccess):
+                break
+            if match_exp_pkt(packet, result.packet):
+                rx_times.append(result.time)
+
+        return rx_times
+
+    def steady_state_rates(self, tx_marks, rx_times):
+        '''
+        Calculate the sent and the received rates over the steady state window of the sending period.
+        '''
+        tx_start, tx_end = tx_marks[0][0], tx_marks[-1][0]
+        margin = (tx_end - tx_start) * self.STEADY_STATE_MARGIN
+        times = [mark[0] for mark in tx_marks]
+        first = bisect.bisect_left(times, tx_start + margin)
+        last = bisect.bisect_right(times, tx_end - margin) - 1
+        if last <= first:
+            # Too few batches for a window, take the whole period
+            first, last = 0, len(tx_marks) - 1
+
+        window_start, window_end = tx_marks[first][0], tx_marks[last][0]
+        window = max(window_end - window_start, 1e-3)
+        tx_pps = (tx_marks[last][1] - tx_marks[first][1]) / window
+        rx_times = sorted(rx_times)
+        rx_count = bisect.bisect_right(rx_times, window_end) - bisect.bisect_left(rx_times, window_start)
+        rx_pps = rx_count / window
+        self.log("Steady state window: %.3f seconds, %d packets sent, %d packets received" % \
+                (window, tx_marks[last][1] - tx_marks[first][1], rx_count))
+
+        return int(tx_pps), int(rx_pps)
+
     def copp_test(self, packet, count, send_intf, recv_intf):
         '''
         Pre-send some packets for a second to absorb the CBS capacity.
         '''
         if self.needPreSend:
-            sendInFirst=0
-            endTime = datetime.datetime.now() + datetime.timedelta(seconds=1)
-            while datetime.datetime.now() < endTime:
-                testutils.send_packet(self, send_intf, packet)
-                sendInFirst += 1
+            sendInFirst = self.tx_pps
+            self.send_at_rate(packet, sendInFirst, send_intf)
             rcv_pkt_cnt = testutils.count_matched_packets(self, packet, recv_intf[1], recv_intf[0],timeout=0.01)
             self.log("Send %d and receive %d packets in the first second (PolicyTest)" % (sendInFirst,  rcv_pkt_cnt))
             self.dataplane.flush()
@@ -128,12 +203,13 @@ class ControlPlaneBaseTest(BaseTest):
 
         start_time=datetime.datetime.now()
 
-        for i in xrange(count):
-            testutils.send_packet(self, send_intf, packet)
+        # The dataplane thread timestamps the received packets while they are still being sent
+        tx_marks = self.send_at_rate(packet, count, send_intf)
 
         end_time=datetime.datetime.now()
 
-        total_rcv_pkt_cnt = testutils.count_matched_packets(self, packet, recv_intf[1], recv_intf[0])
+        rx_times = self.receive_matched_packets(packet, recv_intf)
+        total_rcv_pkt_cnt = len(rx_times)
 
         e_c_0 = self.dataplane.get_counters(*send_intf)
         e_c_1 = self.dataplane.get_counters(*recv_intf)
@@ -159,22 +235,22 @@ class ControlPlaneBaseTest(BaseTest):
 
         time_delta = end_time - start_time
         time_delta_ms = (time_delta.microseconds + time_delta.seconds * 10**6) / 10**3
-        tx_pps = int(count/(float(time_delta_ms)/1000))
-        rx_pps = int(total_rcv_pkt_cnt/(float(time_delta_ms)/1000))
+        tx_pps, rx_pps = self.steady_state_rates(tx_marks, rx_times)
+        self.offered_load_reached = tx_pps >= self.tx_pps * self.TX_PPS_MARGIN
 
         return total_rcv_pkt_cnt, time_delta, time_delta_ms, tx_pps, rx_pps
 
     def contruct_packet(self, port_number):
         raise NotImplemented
 
-    def check_constraints(self, total_rcv_pkt_cnt, time_delta_ms, rx_pps):
+    def check_constraints(self, total_rcv_pkt_cnt, time_delta_ms, tx_pps, rx_pps):
         raise NotImplemented
 
     def one_port_test(self, port_number):
         packet = self.contruct_packet(port_number)
         total_rcv_pkt_cnt, time_delta, time_delta_ms, tx_pps, rx_pps = self.copp_test(str(packet), self.pkt_tx_count, (0, port_number), (1, port_number))
         self.printStats(self.pkt_tx_count, total_rcv_pkt_cnt, time_delta, tx_pps, rx_pps)
-        self.check_constraints(total_rcv_pkt_cnt, time_delta_ms, rx_pps)
+        self.check_constraints(total_rcv_pkt_cnt, time_delta_ms, tx_pps, rx_pps)
 
         return
 
@@ -191,6 +267,7 @@ class ControlPlaneBaseTest(BaseTest):
         self.log('Test time = %s' % str(time_delta))
         self.log('TX PPS = %d' % tx_pps)
         self.log('RX PPS = %d' % rx_pps)
+        self.log('Offered TX PPS = %d, reached: %s' % (self.tx_pps, str(self.offered_load_reached)))
 
         return
 
@@ -199,7 +276,7 @@ class NoPolicyTest(ControlPlaneBaseTest):
         ControlPlaneBaseTest.__init__(self)
         self.needPreSend=False
 
-    def check_constraints(self, total_rcv_pkt_cnt, time_delta_ms, rx_pps):
+    def check_constraints(self, total_rcv_pkt_cnt, time_delta_ms, tx_pps, rx_pps):
         self.log("")
         self.log("Checking constraints (NoPolicy):")
         self.log("rx_pps (%d) > NO_POLICER_LIMIT (%d): %s" % (int(rx_pps), int(self.NO_POLICER_LIMIT), str(rx_pps > self.NO_POLICER_LIMIT)))
@@ -214,12 +291,15 @@ class PolicyTest(ControlPlaneBaseTest):
         ControlPlaneBaseTest.__init__(self)
         self.needPreSend=True
 
-    def check_constraints(self, total_rcv_pkt_cnt, time_delta_ms, rx_pps):
+    def check_constraints(self, total_rcv_pkt_cnt, time_delta_ms, tx_pps, rx_pps):
         self.log("")
         self.log("Checking constraints (PolicyApplied):")
+        self.log("tx_pps (%d) > PPS_LIMIT_MAX (%d): %s" % (int(tx_pps), int(self.PPS_LIMIT_MAX), str(tx_pps > self.PPS_LIMIT_MAX)))
         self.log("PPS_LIMIT_MIN (%d) <= rx_pps (%d) <= PPS_LIMIT_MAX (%d): %s" % \
                 (int(self.PPS_LIMIT_MIN), int(rx_pps), int(self.PPS_LIMIT_MAX), str(self.PPS_LIMIT_MIN <= rx_pps <= self.PPS_LIMIT_MAX)))
 
+        # The policer is not tested unless the packets are sent faster than it lets them through
+        assert(tx_pps > self.PPS_LIMIT_MAX)
         assert(self.PPS_LIMIT_MIN <= rx_pps <= self.PPS_LIMIT_MAX)
 
 
@@ -421,7 +501,7 @@ class IP2METest(PolicyTest):
             packet = self.contruct_packet(port[1])
             total_rcv_pkt_cnt, time_delta, time_delta_ms, tx_pps, rx_pps = self.copp_test(str(packet), self.pkt_tx_count, (0, port_number), (1, port_number))
             self.printStats(self.pkt_tx_count, total_rcv_pkt_cnt, time_delta, tx_pps, rx_pps)
-            self.check_constraints(total_rcv_pkt_cnt, time_delta_ms, rx_pps)
+            self.check_constraints(total_rcv_pkt_cnt, time_delta_ms, tx_pps, rx_pps)
 
         return
 
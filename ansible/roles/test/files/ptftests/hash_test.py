@@ -5,8 +5,11 @@ Description:    This file contains the hash test for SONiC
 #---------------------------------------------------------------------
 # Global imports
 #---------------------------------------------------------------------
+import copy
 import logging
 import random
+import socket
+import struct
 
 from ipaddress import ip_address, ip_network
 
@@ -22,6 +25,21 @@ from ptf.testutils import *
 import fib
 import lpm
 
+def mac_to_bytes(mac):
+    return mac.replace(':', '').decode('hex')
+
+def checksum(data):
+    '''
+    @summary: Internet checksum of the data
+    '''
+    data = str(data)
+    if len(data) % 2:
+        data += "\0"
+    total = sum(struct.unpack("!%dH" % (len(data) // 2), data))
+    while total >> 16:
+        total = (total & 0xffff) + (total >> 16)
+    return ~total & 0xffff
+
 class HashTest(BaseTest):
 
     #---------------------------------------------------------------------
@@ -29,6 +47,15 @@ class HashTest(BaseTest):
     #---------------------------------------------------------------------
     DEFAULT_BALANCING_RANGE = 0.25
     BALANCING_TEST_TIMES = 10000
+    # Number of flows sent back to back before their packets are received,
+    # the PTF queue length of every port must be big enough to hold them
+    DEFAULT_BURST_SIZE = 1000
+    # Time to wait for the next packet of a burst, in seconds
+    RECEIVE_TIMEOUT = 2
+    # Flow id is carried at the end of the payload as the magic and the flow number
+    FLOW_TAG_FORMAT = "!4sI"
+    FLOW_TAG_LEN = struct.calcsize(FLOW_TAG_FORMAT)
+    FLOW_TAG_MAGIC = "hash"
 
     def __init__(self):
         '''
@@ -58,6 +85,7 @@ class HashTest(BaseTest):
         self.dst_macs = self.test_params.get('dst_macs', [])    # TODO
 
         self.balancing_range = self.test_params.get('balancing_range', self.DEFAULT_BALANCING_RANGE)
+        self.burst_size = int(self.test_params.get('burst_size', self.DEFAULT_BURST_SIZE))
 
     #---------------------------------------------------------------------
 
@@ -69,134 +97,231 @@ class HashTest(BaseTest):
         if exp_port_list <= 1:
             logging.warning("{} has only {} nexthop".format(dst_ip, exp_port_list))
             assert False
-        in_port = random.choice([port for port in self.in_ports if port not in exp_port_list])
 
-        hit_count_map = {}
         if hash_key == 'ingress-port': # The sample is too little for hash_key ingress-port, check it loose(just verify if the asic actually used the hash field as a load-balancing factor)
-            for in_port in [port for port in self.in_ports if port not in exp_port_list]:
-                logging.info("in_port: {}".format(in_port))
-                (matched_index, _) = self.check_ip_route(hash_key, in_port, dst_ip, exp_port_list)
-                hit_count_map[matched_index] = hit_count_map.get(matched_index, 0) + 1
+            in_ports = [port for port in self.in_ports if port not in exp_port_list]
+            logging.info("in_ports: {}".format(in_ports))
+            hit_count_map = self.check_ip_route(hash_key, in_ports, dst_ip, exp_port_list)
             logging.info("hit count map: {}".format(hit_count_map))
             assert True if len(hit_count_map.keys()) > 1 else False
         else:
-            for _ in range(0, self.BALANCING_TEST_TIMES):
-                logging.info("in_port: {}".format(in_port))
-                (matched_index, _) = self.check_ip_route(hash_key, in_port, dst_ip, exp_port_list)
-                hit_count_map[matched_index] = hit_count_map.get(matched_index, 0) + 1
+            in_port = random.choice([port for port in self.in_ports if port not in exp_port_list])
+            logging.info("in_port: {}".format(in_port))
+            hit_count_map = self.check_ip_route(hash_key, [in_port] * self.BALANCING_TEST_TIMES, dst_ip, exp_port_list)
             logging.info("hit count map: {}".format(hit_count_map))
 
             self.check_balancing(next_hop.get_next_hop(), hit_count_map)
 
-    def check_ip_route(self, hash_key, in_port, dst_ip, dst_port_list):
+    def check_ip_route(self, hash_key, in_ports, dst_ip, dst_port_list):
+        '''
+        @summary: Send one flow from each of the given ports and count the flows received on every port.
+        @param hash_key: hash key to build packets with.
+        @param in_ports: list of ports to send the flows from, one flow per entry
+        @param dst_ip: destination IP the flows are routed to
+        @param dst_port_list: list of ports on which to expect packets to come back from the switch
+        @return dict of port to the number of flows received on it
+        '''
         if ip_network(unicode(dst_ip)).version == 4:
-            (matched_index, received) = self.check_ipv4_route(hash_key, in_port, dst_port_list)
+            create_packets = self.create_ipv4_packets
         else:
-            (matched_index, received) = self.check_ipv6_route(hash_key, in_port, dst_port_list)
+            create_packets = self.create_ipv6_packets
 
-        assert received
+        # All the packets are built up front, so that they can be sent back to back.
+        # Scapy builds the packets of the first flow only, the packets of every flow
+        # are copies of them with the fields of the flow written in place.
+        flow_fields = [self.get_flow_fields(hash_key) for _ in in_ports]
+        (pkt, exp_pkt) = create_packets(hash_key, flow_fields[0])
+        masked_exp_pkt = Mask(exp_pkt)
+        masked_exp_pkt.set_do_not_care_scapy(scapy.Ether, "dst")
+        (pkt_layout, exp_pkt_layout) = (self.get_packet_layout(pkt), self.get_packet_layout(exp_pkt))
+        (pkt, exp_pkt) = (str(pkt), str(exp_pkt))
+
+        flows = []
+        for flow_id, (in_port, fields) in enumerate(zip(in_ports, flow_fields)):
+            flow_exp_pkt = copy.copy(masked_exp_pkt)
+            flow_exp_pkt.exp_pkt = self.patch_packet(exp_pkt, exp_pkt_layout, fields, flow_id, None, fields['dst_mac'])
+            flows.append((in_port, self.patch_packet(pkt, pkt_layout, fields, flow_id, fields['dst_mac'], fields['src_mac']), flow_exp_pkt))
+
+        hit_count_map = {}
+        for first in range(0, len(flows), self.burst_size):
+            received = self.send_burst(flows[first:first + self.burst_size], first, dst_port_list)
+            for matched_port in received.values():
+                hit_count_map[matched_port] = hit_count_map.get(matched_port, 0) + 1
 
-        matched_port = dst_port_list[matched_index]
-        logging.info("Received packet at " + str(matched_port))
+        return hit_count_map
 
-        return (matched_port, received)
+    def send_burst(self, flows, first_flow_id, dst_port_list):
+        '''
+        @summary: Send the packets of a burst of flows, then receive them and match every packet to its flow.
+        @param flows: list of (in port, packet, masked expected packet) with consecutive flow ids
+        @param first_flow_id: flow id of the first flow of the burst
+        @param dst_port_list: list of ports on which to expect packets to come back from the switch
+        @return dict of flow id to the port it was received on
+        '''
+        for in_port, pkt, _ in flows:
+            send_packet(self, in_port, pkt)
+        logging.info("Sent flows {} - {}".format(first_flow_id, first_flow_id + len(flows) - 1))
+
+        received = {}
+        while len(received) < len(flows):
+            result = dp_poll(self, timeout=self.RECEIVE_TIMEOUT)
+            if not isinstance(result, self.dataplane.PollSuccess):
+                break
+            index = self.get_flow_id(result.packet) - first_flow_id
+            if index < 0 or index >= len(flows) or index in received or result.port not in dst_port_list:
+                continue
+            if dataplane.match_exp_pkt(flows[index][2], result.packet):
+                received[index] = result.port
+
+        missing = [first_flow_id + index for index in range(len(flows)) if index not in received]
+        assert not missing, "Flows {} were not received on any of the ports {}".format(missing, dst_port_list)
+
+        return received
+
+    def get_flow_id(self, data):
+        '''
+        @return: flow id of the received packet, -1 if the packet doesn't belong to the test
+        '''
+        (magic, flow_id) = struct.unpack(self.FLOW_TAG_FORMAT, data[-self.FLOW_TAG_LEN:])
+        return flow_id if magic == self.FLOW_TAG_MAGIC else -1
 
-    def check_ipv4_route(self, hash_key, in_port, dst_port_list):
+    def get_flow_fields(self, hash_key):
         '''
-        @summary: Check IPv4 route works.
+        @summary: Choose the header fields of a flow, the field of the hash key is random.
         @param hash_key: hash key to build packet with.
-        @param in_port: index of port to use for sending packet to switch
-        @param dst_port_list: list of ports on which to expect packet to come back from the switch
         '''
         base_mac = self.dataplane.get_mac(0, 0)
-        ip_src = self.src_ip_interval.get_random_ip() if hash_key == 'src-ip' else self.src_ip_interval.get_first_ip()
-        ip_dst = self.dst_ip_interval.get_random_ip() if hash_key == 'dst-ip' else self.dst_ip_interval.get_first_ip()
-        sport = random.randint(0, 65535) if hash_key == 'src-port' else 1234
-        dport = random.randint(0, 65535) if hash_key == 'dst-port' else 80
-        src_mac = (base_mac[:-5] + "%02x" % random.randint(0, 255) + ":" + "%02x" % random.randint(0, 255)) if hash_key == 'src-mac' else base_mac
-        dst_mac = random.choice(self.dst_macs) if hash_key == 'dst-mac' else self.router_mac
-        vlan_id = random.choice(self.vlan_ids) if hash_key == 'vlan-id' else 0
-        ip_proto = random.randint(100, 200) if hash_key == 'ip-proto' else None
+        return {
+            'ip_src': self.src_ip_interval.get_random_ip() if hash_key == 'src-ip' else self.src_ip_interval.get_first_ip(),
+            'ip_dst': self.dst_ip_interval.get_random_ip() if hash_key == 'dst-ip' else self.dst_ip_interval.get_first_ip(),
+            'sport': random.randint(0, 65535) if hash_key == 'src-port' else 1234,
+            'dport': random.randint(0, 65535) if hash_key == 'dst-port' else 80,
+            'src_mac': (base_mac[:-5] + "%02x" % random.randint(0, 255) + ":" + "%02x" % random.randint(0, 255)) if hash_key == 'src-mac' else base_mac,
+            'dst_mac': random.choice(self.dst_macs) if hash_key == 'dst-mac' else self.router_mac,
+            'vlan_id': random.choice(self.vlan_ids) if hash_key == 'vlan-id' else 0,
+            'ip_proto': random.randint(100, 200) if hash_key == 'ip-proto' else None,
+        }
+
+    def get_packet_layout(self, pkt):
+        '''
+        @summary: Find the offsets of the fields which differ between the flows in the packet.
+        '''
+        size = len(pkt)
+        layout = {'vlan': size - len(pkt[scapy.Dot1Q]) if scapy.Dot1Q in pkt else None}
+        if scapy.IP in pkt:
+            l3 = size - len(pkt[scapy.IP])
+            layout.update({'family': socket.AF_INET, 'proto': l3 + 9, 'ip_chksum': l3 + 10,
+                           'ip_src': l3 + 12, 'ip_dst': l3 + 16, 'l3': l3})
+        else:
+            l3 = size - len(pkt[scapy.IPv6])
+            layout.update({'family': socket.AF_INET6, 'proto': l3 + 6, 'ip_chksum': None,
+                           'ip_src': l3 + 8, 'ip_dst': l3 + 24, 'l3': l3})
+        layout['l4'] = size - len(pkt[scapy.TCP])
+        return layout
 
+    def patch_packet(self, data, layout, fields, flow_id, eth_dst, eth_src):
+        '''
+        @summary: Write the fields of a flow and the flow id into a built packet and update its checksums.
+        @param data: packet built for another flow of the same hash key
+        @param layout: offsets of the fields in the packet
+        @param fields: header fields of the flow
+        @param flow_id: flow id to put at the end of the payload, which is not used for hashing
+        @param eth_dst: destination MAC address, None to keep the one of the packet
+        @param eth_src: source MAC address
+        @return packet of the flow
+        '''
+        pkt = bytearray(data)
+        if eth_dst is not None:
+            pkt[0:6] = mac_to_bytes(eth_dst)
+        pkt[6:12] = mac_to_bytes(eth_src)
+        if layout['vlan'] is not None:
+            pkt[layout['vlan']:layout['vlan'] + 2] = struct.pack("!H", fields['vlan_id'])
+        if fields['ip_proto'] is not None:
+            pkt[layout['proto']] = fields['ip_proto']
+        addr_len = 4 if layout['family'] == socket.AF_INET else 16
+        pkt[layout['ip_src']:layout['ip_src'] + addr_len] = socket.inet_pton(layout['family'], str(fields['ip_src']))
+        pkt[layout['ip_dst']:layout['ip_dst'] + addr_len] = socket.inet_pton(layout['family'], str(fields['ip_dst']))
+        l4 = layout['l4']
+        pkt[l4:l4 + 4] = struct.pack("!HH", fields['sport'], fields['dport'])
+        pkt[-self.FLOW_TAG_LEN:] = struct.pack(self.FLOW_TAG_FORMAT, self.FLOW_TAG_MAGIC, flow_id)
+
+        if layout['ip_chksum'] is not None:
+            l3 = layout['l3']
+            pkt[layout['ip_chksum']:layout['ip_chksum'] + 2] = "\0\0"
+            pkt[layout['ip_chksum']:layout['ip_chksum'] + 2] = struct.pack("!H", checksum(pkt[l3:l4]))
+        # TCP checksum over the pseudo header, scapy always takes TCP as its protocol
+        pkt[l4 + 16:l4 + 18] = "\0\0"
+        pseudo_header = pkt[layout['ip_src']:layout['ip_dst'] + addr_len] + struct.pack("!HH", socket.IPPROTO_TCP, len(pkt) - l4)
+        pkt[l4 + 16:l4 + 18] = struct.pack("!H", checksum(pseudo_header + pkt[l4:]))
+
+        return str(pkt)
+
+    def create_ipv4_packets(self, hash_key, fields):
+        '''
+        @summary: Build the IPv4 packet of a flow and the packet expected to come back from the switch.
+        @param hash_key: hash key to build packet with.
+        @param fields: header fields of the flow
+        @return (packet, expected packet)
+        '''
+        vlan_id = fields['vlan_id']
         pkt = simple_tcp_packet(pktlen=100 if vlan_id == 0 else 104,
-                            eth_dst=dst_mac,
-                            eth_src=src_mac,
+                            eth_dst=fields['dst_mac'],
+                            eth_src=fields['src_mac'],
                             dl_vlan_enable=False if vlan_id == 0 else True,
                             vlan_vid=vlan_id,
                             vlan_pcp=0,
-                            ip_src=ip_src,
-                            ip_dst=ip_dst,
-                            tcp_sport=sport,
-                            tcp_dport=dport,
+                            ip_src=fields['ip_src'],
+                            ip_dst=fields['ip_dst'],
+                            tcp_sport=fields['sport'],
+                            tcp_dport=fields['dport'],
                             ip_ttl=64)
         exp_pkt = simple_tcp_packet(
-                            eth_src=dst_mac,
-                            ip_src=ip_src,
-                            ip_dst=ip_dst,
-                            tcp_sport=sport,
-                            tcp_dport=dport,
+                            eth_src=fields['dst_mac'],
+                            ip_src=fields['ip_src'],
+                            ip_dst=fields['ip_dst'],
+                            tcp_sport=fields['sport'],
+                            tcp_dport=fields['dport'],
                             ip_ttl=63)
 
         if hash_key == 'ip-proto':
-            pkt['IP'].proto = ip_proto
-            exp_pkt['IP'].proto = ip_proto
-        masked_exp_pkt = Mask(exp_pkt)
-        masked_exp_pkt.set_do_not_care_scapy(scapy.Ether, "dst")
+            pkt['IP'].proto = fields['ip_proto']
+            exp_pkt['IP'].proto = fields['ip_proto']
 
-        send_packet(self, in_port, pkt)
-        logging.info("Sending packet from port " + str(in_port) + " to " + ip_dst)
-
-        return verify_packet_any_port(self, masked_exp_pkt, dst_port_list)
+        return (pkt, exp_pkt)
     #---------------------------------------------------------------------
 
-    def check_ipv6_route(self, hash_key, in_port, dst_port_list):
+    def create_ipv6_packets(self, hash_key, fields):
         '''
-        @summary: Check IPv6 route works.
+        @summary: Build the IPv6 packet of a flow and the packet expected to come back from the switch.
         @param hash_key: hash key to build packet with.
-        @param in_port: index of port to use for sending packet to switch
-        @param dst_port_list: list of ports on which to expect packet to come back from the switch
-        @return Boolean
+        @param fields: header fields of the flow
+        @return (packet, expected packet)
         '''
-        base_mac = self.dataplane.get_mac(0, 0)
-        ip_src = self.src_ip_interval.get_random_ip() if hash_key == 'src-ip' else self.src_ip_interval.get_first_ip()
-        ip_dst = self.dst_ip_interval.get_random_ip() if hash_key == 'dst-ip' else self.dst_ip_interval.get_first_ip()
-        sport = random.randint(0, 65535) if hash_key == 'src-port' else 1234
-        dport = random.randint(0, 65535) if hash_key == 'dst-port' else 80
-        src_mac = (base_mac[:-5] + "%02x" % random.randint(0, 255) + ":" + "%02x" % random.randint(0, 255)) if hash_key == 'src-mac' else base_mac
-        dst_mac = random.choice(self.dst_macs) if hash_key == 'dst-mac' else self.router_mac
-        vlan_id = random.choice(self.vlan_ids) if hash_key == 'vlan-id' else 0
-        ip_proto = random.randint(100, 200) if hash_key == "ip-proto" else None
-
+        vlan_id = fields['vlan_id']
         pkt = simple_tcpv6_packet(pktlen=100 if vlan_id == 0 else 104,
-                                eth_dst=dst_mac,
-                                eth_src=src_mac,
+                                eth_dst=fields['dst_mac'],
+                                eth_src=fields['src_mac'],
                                 dl_vlan_enable=False if vlan_id == 0 else True,
                                 vlan_vid=vlan_id,
                                 vlan_pcp=0,
-                                ipv6_dst=ip_dst,
-                                ipv6_src=ip_src,
-                                tcp_sport=sport,
-                                tcp_dport=dport,
+                                ipv6_dst=fields['ip_dst'],
+                                ipv6_src=fields['ip_src'],
+                                tcp_sport=fields['sport'],
+                                tcp_dport=fields['dport'],
                                 ipv6_hlim=64)
         exp_pkt = simple_tcpv6_packet(
-                                eth_src=dst_mac,
-                                ipv6_dst=ip_dst,
-                                ipv6_src=ip_src,
-                                tcp_sport=sport,
-                                tcp_dport=dport,
+                                eth_src=fields['dst_mac'],
+                                ipv6_dst=fields['ip_dst'],
+                                ipv6_src=fields['ip_src'],
+                                tcp_sport=fields['sport'],
+                                tcp_dport=fields['dport'],
                                 ipv6_hlim=63)
 
         if hash_key == 'ip-proto':
-            pkt['IPv6'].nh = ip_proto
-            exp_pkt['IPv6'].nh = ip_proto
-
-        masked_exp_pkt = Mask(exp_pkt)
-        masked_exp_pkt.set_do_not_care_scapy(scapy.Ether,"dst")
-
-        send_packet(self, in_port, pkt)
-        logging.info("Sending packet from port " + str(in_port) + " to " + ip_dst)
+            pkt['IPv6'].nh = fields['ip_proto']
+            exp_pkt['IPv6'].nh = fields['ip_proto']
 
-        return verify_packet_any_port(self, masked_exp_pkt, dst_port_list)
+        return (pkt, exp_pkt)
     #---------------------------------------------------------------------
     def check_within_expected_range(self, actual, expected):
         '''
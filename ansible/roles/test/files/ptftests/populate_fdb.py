@@ -1,6 +1,8 @@
 import ipaddress
 import json
 import logging
+import socket
+import struct
 import ptf
 
 # Packet Test Framework imports
@@ -18,6 +20,8 @@ class PopulateFdb(BaseTest):
     """
     TCP_DST_PORT = 5000
     TCP_SRC_PORT = 6000
+    # Number of packets sent to one port before moving to the next one
+    BATCH_SIZE = 256
 
     def __init__(self):
         """
@@ -101,6 +105,21 @@ class PopulateFdb(BaseTest):
         mac = "{:012x}".format(mac)
         return ":".join(mac[i : i + 2] for i in range(0, len(mac), 2))
 
+    def __checksum(self, data):
+        """
+            Calculates Internet checksum
+
+            Args:
+                data (bytearray): data to calculate checksum of, of even length
+
+            Returns:
+                checksum (int): checksum of the data
+        """
+        total = sum(struct.unpack("!%dH" % (len(data) // 2), str(data)))
+        while total >> 16:
+            total = (total & 0xffff) + (total >> 16)
+        return ~total & 0xffff
+
     def __prepareVmIp(self):
         """
             Prepares VM IP addresses
@@ -109,7 +128,7 @@ class PopulateFdb(BaseTest):
                 None
 
             Returns:
-                vmIp (dict): Map containing vlan to VM IP address
+                vmIp (dict): Map containing vlan to VM IP address as integer
         """
         vmIp = {}
         for vlan, config in self.configData["vlan_interfaces"].items():
@@ -123,46 +142,67 @@ class PopulateFdb(BaseTest):
                     numDistinctIp
                 )
             )
-            vmIp[vlan] = ipaddress.ip_address(unicode(config["addr"])) + 1
+            vmIp[vlan] = int(ipaddress.ip_address(unicode(config["addr"]))) + 1
 
         return vmIp
 
-    def __populateDutFdb(self):
+    def __preparePackets(self):
         """
-            Populates DUT FDB entries
+            Prepares packets to populate DUT FDB
 
             It accepts MAC to IP ratio and packet count. It generates packets withratio of distinct MAC addresses
             to distinct IP addresses as provided. The IP addresses starts from VLAN address pool.
 
+            Scapy builds one template packet. Every packet is a copy of the template with its source MAC,
+            source and destination IP addresses written in place and its IP and TCP checksums updated.
+
             Args:
                 None
 
             Returns:
-                None
+                packets (dict): Map containing port index to the list of its packets
         """
-        packet = testutils.simple_tcp_packet(
+        template = testutils.simple_tcp_packet(
             eth_dst=self.dutMac,
             tcp_sport=self.TCP_SRC_PORT,
             tcp_dport=self.TCP_DST_PORT
         )
+        size = len(template)
+        ipOffset = size - len(template[scapy.IP])
+        tcpOffset = size - len(template[scapy.TCP])
+        template = bytearray(str(template))
+
+        vlanAddr = {
+            vlan: socket.inet_aton(str(config["addr"]))
+            for vlan, config in self.configData["vlan_interfaces"].items()
+        }
         vmIp = self.__prepareVmIp()
         macInt = self.__convertMacToInt(self.startMac)
         numMac = numIp = 0
+        packets = {}
         for i in range(self.packetCount):
             port = i % len(self.configData["vlan_ports"])
             vlan = self.configData["vlan_ports"][port]["vlan"]
 
             if i % self.macToIpRatio[1] == 0:
-                mac = self.__convertMacToStr(macInt + i)
+                mac = struct.pack("!Q", macInt + i)[2:]
                 numMac += 1
             if i % self.macToIpRatio[0] == 0:
-                vmIp[vlan] = ipaddress.ip_address(unicode(vmIp[vlan])) + 1
+                vmIp[vlan] += 1
                 numIp += 1
 
-            packet[scapy.Ether].src = mac
-            packet[scapy.IP].src = str(vmIp[vlan])
-            packet[scapy.IP].dst = self.configData["vlan_interfaces"][vlan]["addr"]
-            testutils.send(self, self.configData["vlan_ports"][port]["index"], packet)
+            packet = bytearray(template)
+            packet[6:12] = mac
+            packet[ipOffset + 12:ipOffset + 16] = struct.pack("!I", vmIp[vlan])
+            packet[ipOffset + 16:ipOffset + 20] = vlanAddr[vlan]
+            packet[ipOffset + 10:ipOffset + 12] = "\0\0"
+            packet[ipOffset + 10:ipOffset + 12] = struct.pack("!H", self.__checksum(packet[ipOffset:tcpOffset]))
+            # TCP checksum covers the pseudo header of the IP addresses, protocol and TCP length
+            pseudoHeader = packet[ipOffset + 12:ipOffset + 20] + struct.pack("!HH", socket.IPPROTO_TCP, size - tcpOffset)
+            packet[tcpOffset + 16:tcpOffset + 18] = "\0\0"
+            packet[tcpOffset + 16:tcpOffset + 18] = struct.pack("!H", self.__checksum(pseudoHeader + packet[tcpOffset:]))
+
+            packets.setdefault(self.configData["vlan_ports"][port]["index"], []).append(str(packet))
 
         logger.info(
             "Generated {0} packets with distinct {1} MAC addresses and {2} IP addresses".format(
@@ -172,5 +212,25 @@ class PopulateFdb(BaseTest):
             )
         )
 
+        return packets
+
+    def __populateDutFdb(self):
+        """
+            Populates DUT FDB entries
+
+            Packets are sent in batches of BATCH_SIZE packets, to every port in turn
+
+            Args:
+                None
+
+            Returns:
+                None
+        """
+        packets = self.__preparePackets()
+        for batchStart in range(0, max(len(portPackets) for portPackets in packets.values()), self.BATCH_SIZE):
+            for port, portPackets in packets.items():
+                for packet in portPackets[batchStart:batchStart + self.BATCH_SIZE]:
+                    testutils.send(self, port, packet)
+
     def runTest(self):
         self.__populateDutFdb()
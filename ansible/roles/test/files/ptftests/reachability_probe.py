@@ -0,0 +1,281 @@
+'''
+Continuous, sequence-tagged reachability probing.
+
+Every probe flow has its own sender thread, which sends packets at a fixed rate on a drift-corrected
+schedule. The sequence number and the send timestamp of every packet are written into its payload.
+One receiver thread listens on all the ports the replies may come from and matches them to flows
+and sequence numbers, so losses, duplicates (flooding) and reordering are known per packet with
+millisecond accuracy, and a probe never waits for the replies of another probe.
+
+The tag replaces payload bytes of prebuilt packets. Its last 16-bit word compensates the
+one's complement sum of the replaced bytes, so L4 checksums of the packets stay valid.
+'''
+
+import socket
+import select
+import struct
+import threading
+import time
+import errno
+import itertools
+import bisect
+
+
+class ProbeFlow(object):
+    '''
+    Packets of one probe direction, e.g. servers->t1
+    '''
+    def __init__(self, flow_id, name, packets, rx_ifaces, payload_offset, rate):
+        '''
+        @param flow_id: id of the flow, written into the tag
+        @param name: name of the flow used in reports
+        @param packets: list of (tx_iface, packet) the flow cycles through
+        @param rx_ifaces: interfaces the replies are expected on
+        @param payload_offset: offset in the packets where the tag is written. Must be even from the L4 header
+        @param rate: packets per second
+        '''
+        self.flow_id = flow_id
+        self.name = name
+        self.packets = packets
+        self.rx_ifaces = rx_ifaces
+        self.payload_offset = payload_offset
+        self.interval = 1.0 / rate
+        self.lock = threading.Lock()
+        self.paused = threading.Event()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.sent = []          # send timestamp, indexed by sequence number
+            self.received = {}      # sequence number -> receive timestamp of the first copy
+            self.duplicates = {}    # sequence number -> number of extra copies
+            self.reordered = 0
+            self.max_seq = -1
+
+
+class ReachabilityProbe(object):
+    MAGIC = 'PrBe'
+    TAG = struct.Struct('!4sHId')
+    TAG_LEN = TAG.size + 2
+    ETH_P_ALL = 0x03
+    PACKET_OUTGOING = 4
+    RCV_SIZE = 4096
+    RCV_BUFFER_SIZE = 10 * 1024 * 1024
+    # Drop the schedule instead of catching up when the sender is late by more than that many packets
+    MAX_LAG = 100
+
+    def __init__(self, log=None):
+        self.flows = {}
+        self.flows_by_id = []
+        self.tx_sockets = {}
+        self.rx_sockets = {}
+        self.threads = []
+        self.running = False
+        self.log = log if log is not None else lambda message: None
+
+    def add_flow(self, name, packets, rx_ifaces, payload_offset, rate):
+        flow = ProbeFlow(len(self.flows_by_id), name, packets, rx_ifaces, payload_offset, rate)
+        self.flows[name] = flow
+        self.flows_by_id.append(flow)
+        for iface, _ in packets:
+            if iface not in self.tx_sockets:
+                self.tx_sockets[iface] = self.open_socket(iface)
+        for iface in rx_ifaces:
+            if iface not in self.rx_sockets:
+                self.rx_sockets[iface] = self.open_socket(iface)
+                self.rx_sockets[iface].setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.RCV_BUFFER_SIZE)
+        return flow
+
+    def open_socket(self, iface):
+        sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(self.ETH_P_ALL))
+        sock.bind((iface, self.ETH_P_ALL))
+        return sock
+
+    @staticmethod
+    def ones_sum(data):
+        s = sum(struct.unpack('!%dH' % (len(data) / 2), data))
+        while s >> 16:
+            s = (s & 0xffff) + (s >> 16)
+        return s
+
+    def tag(self, flow, packet, seq, ts):
+        offset = flow.payload_offset
+        tag = self.TAG.pack(self.MAGIC, flow.flow_id, seq, ts)
+        # one's complement subtraction of the tag from the sum of the replaced bytes
+        adjust = self.ones_sum(packet[offset:offset + self.TAG_LEN]) + (~self.ones_sum(tag) & 0xffff)
+        adjust = (adjust & 0xffff) + (adjust >> 16)
+        return packet[:offset] + tag + struct.pack('!H', adjust & 0xffff) + packet[offset + self.TAG_LEN:]
+
+    def start(self):
+        self.running = True
+        self.threads = [threading.Thread(target=self.receiver)]
+        self.threads += [threading.Thread(target=self.sender, args=(flow,)) for flow in self.flows_by_id]
+        for thr in self.threads:
+            thr.setDaemon(True)
+            thr.start()
+
+    def stop(self):
+        self.running = False
+        for thr in self.threads:
+            thr.join()
+        self.threads = []
+
+    def pause(self, names):
+        for name in names:
+            self.flows[name].paused.set()
+
+    def resume(self, names):
+        for name in names:
+            self.flows[name].paused.clear()
+
+    def sender(self, flow):
+        packets = itertools.cycle(flow.packets)
+        next_time = time.time()
+        while self.running:
+            if flow.paused.is_set():
+                time.sleep(flow.interval)
+                next_time = time.time()
+                continue
+
+            now = time.time()
+            if next_time > now:
+                time.sleep(next_time - now)
+            elif now - next_time > self.MAX_LAG * flow.interval:
+                next_time = now
+            next_time += flow.interval
+
+            iface, packet = next(packets)
+            with flow.lock:
+                seq = len(flow.sent)
+                ts = time.time()
+                flow.sent.append(ts)
+            try:
+                self.tx_sockets[iface].send(self.tag(flow, packet, seq, ts))
+            except socket.error as e:
+                self.log("Probe %s failed to send packet %d: %s" % (flow.name, seq, str(e)))
+
+    def receiver(self):
+        epoll = select.epoll()
+        mapping = {}
+        for sock in self.rx_sockets.values():
+            sock.setblocking(0)
+            epoll.register(sock.fileno(), select.EPOLLIN)
+            mapping[sock.fileno()] = sock
+
+        while self.running:
+            try:
+                events = epoll.poll(0.1)
+            except IOError as e:
+                if e.errno != errno.EINTR:
+                    raise
+                continue
+            for fd, _ in events:
+                sock = mapping[fd]
+                while True:
+                    try:
+                        data, addr = sock.recvfrom(self.RCV_SIZE)
+                    except socket.error as e:
+                        if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                            break
+                        raise
+                    if addr[2] != self.PACKET_OUTGOING:
+                        self.match(data, time.time())
+        epoll.close()
+
+    def match(self, data, rx_ts):
+        offset = data.find(self.MAGIC)
+        if offset < 0 or len(data) < offset + self.TAG.size:
+            return
+        _, flow_id, seq, _ = self.TAG.unpack_from(data, offset)
+        if flow_id >= len(self.flows_by_id):
+            return
+
+        flow = self.flows_by_id[flow_id]
+        with flow.lock:
+            if seq >= len(flow.sent):
+                return
+            if seq in flow.received:
+                flow.duplicates[seq] = flow.duplicates.get(seq, 0) + 1
+                return
+            flow.received[seq] = rx_ts
+            if seq < flow.max_seq:
+                flow.reordered += 1
+            else:
+                flow.max_seq = seq
+
+    def window_stats(self, name, window, grace):
+        '''
+        @summary: Statistics of the packets sent in [now - grace - window, now - grace]
+        @param grace: time given to the replies to arrive
+        @return: (sent, received, duplicates), None if nothing was sent in the window
+        '''
+        flow = self.flows[name]
+        end = time.time() - grace
+        start = end - window
+        with flow.lock:
+            sent = received = duplicates = 0
+            for seq in xrange(len(flow.sent) - 1, -1, -1):
+                ts = flow.sent[seq]
+                if ts > end:
+                    continue
+                if ts < start:
+                    break
+                sent += 1
+                if seq in flow.received:
+                    received += 1
+                duplicates += flow.duplicates.get(seq, 0)
+
+        if sent == 0:
+            return None
+
+        return sent, received, duplicates
+
+    def loss_windows(self, name, grace=1.0):
+        '''
+        @summary: Periods when packets of the flow were lost
+        @param grace: packets sent during the last grace seconds are not considered
+        @return: list of (start, end, lost packets). The period starts when the first lost packet
+            was sent and ends when the next packet which got through was sent
+        '''
+        flow = self.flows[name]
+        with flow.lock:
+            sent = list(flow.sent)
+            received = set(flow.received.keys())
+
+        # Send timestamps only grow, so the considered packets are a prefix of the list
+        end_time = time.time() - grace
+        considered = bisect.bisect_right(sent, end_time)
+        windows = []
+        first_lost = None
+        for seq in xrange(considered):
+            if seq not in received:
+                if first_lost is None:
+                    first_lost = seq
+            elif first_lost is not None:
+                windows.append((sent[first_lost], sent[seq], seq - first_lost))
+                first_lost = None
+        if first_lost is not None:
+            windows.append((sent[first_lost], sent[considered - 1], considered - first_lost))
+
+        return windows
+
+    def report(self, name):
+        '''
+        @summary: Summary of the flow since it was started
+        @return: dictionary with the numbers of sent, received, lost, duplicated and reordered packets,
+            the number of loss windows, the longest and the total loss time in milliseconds
+        '''
+        flow = self.flows[name]
+        windows = self.loss_windows(name)
+        durations = [(end - start) * 1000 for start, end, _ in windows]
+        with flow.lock:
+            return {
+                'sent': len(flow.sent),
+                'received': len(flow.received),
+                'lost': sum(lost for _, _, lost in windows),
+                'duplicates': sum(flow.duplicates.values()),
+                'reordered': flow.reordered,
+                'loss_windows': len(windows),
+                'longest_loss_ms': max(durations) if durations else 0.0,
+                'total_loss_ms': sum(durations),
+            }
@@ -15,11 +15,235 @@ from json import loads
 import threading
 import time
 import select
+import socket
+import struct
 from collections import Counter
 import logging 
-import ast 
+
+SFLOW_VERSION = 5
+FLOW_SAMPLE = 1
+COUNTER_SAMPLE = 2
+FLOW_SAMPLE_EXPANDED = 3
+COUNTER_SAMPLE_EXPANDED = 4
+SAMPLE_TYPES = {
+    FLOW_SAMPLE: 'FLOWSAMPLE',
+    COUNTER_SAMPLE: 'COUNTERSSAMPLE',
+    FLOW_SAMPLE_EXPANDED: 'FLOWSAMPLE_EXPANDED',
+    COUNTER_SAMPLE_EXPANDED: 'COUNTERSSAMPLE_EXPANDED',
+}
+RAW_PACKET_HEADER = 1
+GENERIC_INTERFACE_COUNTERS = 1
+PORT_NAME = 1005
+
+class SflowDecodeError(Exception):
+    pass
+
+class XdrReader(object):
+    """
+    Reads the XDR encoded fields of a datagram without copying it
+    """
+    def __init__(self, data, offset=0, end=None):
+        self.data = data
+        self.offset = offset
+        self.end = len(data) if end is None else end
+
+    def unpack(self, fmt, size):
+        if self.offset + size > self.end:
+            raise SflowDecodeError("Truncated datagram at offset %d" % self.offset)
+        values = struct.unpack_from(fmt, self.data, self.offset)
+        self.offset += size
+        return values
+
+    def uint(self):
+        return self.unpack('!I', 4)[0]
+
+    def uhyper(self):
+        return self.unpack('!Q', 8)[0]
+
+    def opaque(self, length):
+        if self.offset + length > self.end:
+            raise SflowDecodeError("Truncated datagram at offset %d" % self.offset)
+        value = self.data[self.offset:self.offset + length]
+        self.offset += (length + 3) & ~3
+        return value
+
+    def string(self):
+        return self.opaque(self.uint())
+
+    def sub(self, length):
+        """
+        Returns a reader of the next length bytes and skips them
+        """
+        if self.offset + length > self.end:
+            raise SflowDecodeError("Truncated datagram at offset %d" % self.offset)
+        reader = XdrReader(self.data, self.offset, self.offset + length)
+        self.offset += length
+        return reader
+
+def decode_flow_record(fmt, reader):
+    element = {'flowBlock_tag': '0:%d' % fmt}
+    if fmt == RAW_PACKET_HEADER:
+        element['headerProtocol'], element['sampledPacketSize'], element['strippedBytes'] = reader.unpack('!III', 12)
+        element['headerLen'] = len(reader.string())
+    return element
+
+def decode_counter_record(fmt, reader):
+    element = {'counterBlock_tag': '0:%d' % fmt}
+    if fmt == GENERIC_INTERFACE_COUNTERS:
+        element['ifIndex'], element['networkType'] = reader.unpack('!II', 8)
+        element['ifSpeed'] = reader.uhyper()
+        element['ifDirection'], element['ifStatus'] = reader.unpack('!II', 8)
+        element['ifInOctets'] = reader.uhyper()
+    elif fmt == PORT_NAME:
+        element['ifName'] = reader.string()
+    return element
+
+def decode_records(reader, decode_record):
+    elements = []
+    for _ in range(reader.uint()):
+        tag = reader.uint()
+        record = reader.sub(reader.uint())
+        if tag >> 12 == 0:
+            elements.append(decode_record(tag & 0xfff, record))
+    return elements
+
+def decode_sample(fmt, reader):
+    sample = {'sampleType': SAMPLE_TYPES[fmt], 'sampleSequenceNo': reader.uint()}
+    if fmt in (FLOW_SAMPLE_EXPANDED, COUNTER_SAMPLE_EXPANDED):
+        source_id_type, source_id_index = reader.unpack('!II', 8)
+    else:
+        source_id = reader.uint()
+        source_id_type, source_id_index = source_id >> 24, source_id & 0xffffff
+    sample['sourceId'] = '%d:%d' % (source_id_type, source_id_index)
+
+    if fmt in (FLOW_SAMPLE, FLOW_SAMPLE_EXPANDED):
+        sample['meanSkipCount'], sample['samplePool'], sample['dropEvents'] = reader.unpack('!III', 12)
+        if fmt == FLOW_SAMPLE_EXPANDED:
+            _, sample['inputPort'], _, sample['outputPort'] = reader.unpack('!IIII', 16)
+        else:
+            input_port, output_port = reader.unpack('!II', 8)
+            sample['inputPort'], sample['outputPort'] = input_port & 0x3fffffff, output_port & 0x3fffffff
+        sample['elements'] = decode_records(reader, decode_flow_record)
+    else:
+        sample['elements'] = decode_records(reader, decode_counter_record)
+    return sample
+
+def decode_datagram(data):
+    """
+    Decodes an sFlow v5 datagram
+    Returns the agent address and the list of the samples. Samples are dictionaries with the fields
+    named as in the 'sflowtool -j' output
+    """
+    reader = XdrReader(data)
+    version = reader.uint()
+    if version != SFLOW_VERSION:
+        raise SflowDecodeError("Unsupported sFlow version %d" % version)
+    address_type = reader.uint()
+    if address_type == 1:
+        agent = socket.inet_ntop(socket.AF_INET, reader.opaque(4))
+    elif address_type == 2:
+        agent = socket.inet_ntop(socket.AF_INET6, reader.opaque(16))
+    else:
+        raise SflowDecodeError("Unknown agent address type %d" % address_type)
+    sub_agent_id, sequence, uptime = reader.unpack('!III', 12)
+
+    samples = []
+    for _ in range(reader.uint()):
+        tag = reader.uint()
+        sample = reader.sub(reader.uint())
+        if tag >> 12 == 0 and tag & 0xfff in SAMPLE_TYPES:
+            samples.append(decode_sample(tag & 0xfff, sample))
+    return agent, samples
+
+class SflowCollector(threading.Thread):
+    """
+    Listens on the collector UDP port and decodes the samples as the datagrams arrive
+    """
+    RCV_BUFFER_SIZE = 4 * 1024 * 1024
+
+    def __init__(self, name, port):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.name = name
+        self.stopped = False
+        self.lock = threading.Lock()
+        self.flow_samples = []
+        self.counter_samples = []
+        self.datagrams = 0
+        self.errors = 0
+        self.last_sample_time = None
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.RCV_BUFFER_SIZE)
+        self.sock.bind(('', port))
+
+    def run(self):
+        logging.info("Collector %s starts collecting ......"%self.name)
+        while not self.stopped:
+            readable, _, _ = select.select([self.sock], [], [], 0.1)
+            if readable:
+                self.add_datagram(self.sock.recv(65535))
+        self.sock.close()
+
+    def stop(self):
+        self.stopped = True
+        self.join()
+
+    def add_datagram(self, data):
+        try:
+            agent, samples = decode_datagram(data)
+        except SflowDecodeError as e:
+            logging.info("Collector %s failed to decode datagram : %s" % (self.name, str(e)))
+            self.errors += 1
+            return
+        with self.lock:
+            self.datagrams += 1
+            for sample in samples:
+                if sample['sampleType'].startswith('FLOWSAMPLE'):
+                    self.flow_samples.append(sample)
+                else:
+                    sample['agent_id'] = agent
+                    self.counter_samples.append(sample)
+            self.last_sample_time = time.time()
+
+    def flow_port_count(self):
+        with self.lock:
+            return Counter(sample['inputPort'] for sample in self.flow_samples)
+
+    def counter_intf_count(self):
+        with self.lock:
+            return Counter(element['ifName'] for sample in self.counter_samples
+                           for element in sample['elements'] if 'ifName' in element)
+
+    def port_sample(self):
+        """
+        Returns the samples collected so far, in the format the analyzers expect
+        """
+        with self.lock:
+            flow_count = len(self.flow_samples)
+            counter_count = len(self.counter_samples)
+            port_sample = {self.name: {
+                'FlowSample': dict(enumerate(self.flow_samples, 1)),
+                'CounterSample': dict(enumerate(self.counter_samples, 1)),
+                'flow_count': flow_count,
+                'counter_count': counter_count,
+                'total_count': flow_count + counter_count,
+            }}
+        logging.info( "%s Sampled Packets : Total flow samples -> %s Total counter samples -> %s , %s datagrams , %s decode errors" %(self.name,flow_count,counter_count,self.datagrams,self.errors))
+        return port_sample
 
 class SflowTest(BaseTest):
+    # Number of packets sent on each interface, in units of the sampling rate
+    SAMPLED_PKTS = 50
+    # Samples are complete when no new sample arrived for that many seconds
+    QUIET_TIME = 2
+    # Maximum time to wait for the flow samples after the traffic was sent
+    FLOW_TIMEOUT = 10
+    # Time given to the counter samples on top of the polling interval
+    COUNTER_MARGIN = 5
+    # Time the counter samples are not expected in, when polling is disabled
+    NO_POLLING_TIME = 20
+
     def __init__(self):
         BaseTest.__init__(self)
         self.test_params = test_params_get()
@@ -45,12 +269,10 @@ class SflowTest(BaseTest):
             for port,index in self.interfaces.items():
                 self.sflow_interfaces.append(index["ptf_indices"])
         logging.info("Sflow interfaces under Test : %s" %self.interfaces)
-        self.collectors=['collector0','collector1']
         for param,value  in self.test_params.items():
             logging.info("%s : %s" %(param,value) )
     def tearDown(self):
         self.cmd(["supervisorctl", "stop", "arp_responder"])
-        self.cmd(["killall" , "sflowtool"])
     #--------------------------------------------------------------------------
     def generate_ArpResponderConfig(self):
         config = {}
@@ -74,63 +296,53 @@ class SflowTest(BaseTest):
 
     #--------------------------------------------------------------------------
 
-    def read_data(self, collector, sflow_port=['6343']):
+    def wait_for(self, condition, timeout):
         """
-        Starts sflowtool with the corresponding port and saves the data to file for processing
+        Polls the collectors until condition() is True. Returns False on timeout
         """
-        outfile='/tmp/%s'%collector
-        with open(outfile , 'w') as f:
-          process = subprocess.Popen(
-                  ['/usr/local/bin/sflowtool','-j','-p'] + sflow_port ,
-                  stdout=f,
-                  stderr=subprocess.STDOUT,
-                  shell = False
-                  )
-   
-          flow_count = 0
-          counter_count = 0
-          port_sample ={}
-          port_sample[collector]={}
-          port_sample[collector]['FlowSample'] = {}
-          port_sample[collector]['CounterSample'] = {}
-          logging.info("Collector %s starts collecting ......"%collector)
-          while not  self.stop_collector :
-              continue
-        process.terminate()
-        f.close()
-        with open(outfile , 'r') as sflow_data:
-             for line in sflow_data:
-                j = json.dumps(ast.literal_eval(line))
-                datagram = json.loads(j)
-                agent= datagram["agent"]
-                samples = datagram["samples"]
-                for sample in samples:
-                    sampleType = sample["sampleType"]
-                    if sampleType == "FLOWSAMPLE":
-                        flow_count+=1
-                        port_sample[collector]['FlowSample'][flow_count] = sample
-                    elif sampleType == "COUNTERSSAMPLE":
-                        counter_count+=1
-                        port_sample[collector]['CounterSample'][counter_count] = sample
-                        port_sample[collector]['CounterSample'][counter_count]['agent_id'] = agent
-        sflow_data.close()
-        port_sample[collector]['counter_count'] = counter_count
-        port_sample[collector]['flow_count'] = flow_count
-        port_sample[collector]['total_count'] = counter_count + flow_count
-        logging.info( "%s Sampled Packets : Total flow samples -> %s Total counter samples -> %s" %(collector,flow_count,counter_count))
-        return(port_sample)
+        deadline = time.time() + timeout
+        while not condition():
+            if time.time() > deadline:
+                return False
+            time.sleep(0.1)
+        return True
     #--------------------------------------------------------------------------
 
-    def collector_0(self):
-        collector='collector0'
-        self.collector0_samples=self.read_data('collector0')
+    def flow_samples_collected(self):
+        """
+        Flow samples are collected when every active collector has the minimum expected samples
+        of every enabled interface, and no new samples arrived for QUIET_TIME.
+        With no active collector nothing is expected, so the whole timeout is observed
+        """
+        if not self.active_col:
+            return False
+        for collector in self.active_col:
+            port_count = self.collectors[collector].flow_port_count()
+            last_sample_time = self.collectors[collector].last_sample_time
+            if last_sample_time is None or time.time() - last_sample_time < self.QUIET_TIME:
+                return False
+            for port in self.enabled_intf:
+                if port_count[int(self.interfaces[port]['ifindex'])] < self.SAMPLED_PKTS*0.6:
+                    return False
+        return True
     #--------------------------------------------------------------------------
 
+    def counter_samples_collected(self):
+        """
+        Counter samples are collected when every active collector has a sample of every interface.
+        With no active collector nothing is expected, so the whole timeout is observed
+        """
+        if not self.active_col:
+            return False
+        for collector in self.active_col:
+            intf_count = self.collectors[collector].counter_intf_count()
+            if not all(intf_count[intf] for intf in self.interfaces):
+                return False
+        return True
+    #--------------------------------------------------------------------------
 
-    def collector_1(self):
-        collector = 'collector1'
-        self.collector1_samples=count=self.read_data('collector1',['6344'])
-
+    def counter_sample_received(self):
+        return any(self.collectors[collector].counter_samples for collector in self.active_col)
     #--------------------------------------------------------------------------
 
     def packet_analyzer(self, port_sample, collector, poll_test):
@@ -143,6 +355,8 @@ class SflowTest(BaseTest):
         logging.info(data)
         if data['total_flow_count']: 
             data['flow_port_count'] = Counter(k['inputPort']  for k  in port_sample[collector]['FlowSample'].values())
+        else:
+            data['flow_port_count'] = Counter()
 
         if collector not in self.active_col:
            logging.info("....%s : Sample Packets are not expected , received %s flow packets  and %s counter packets"%(collector,data['total_flow_count'],data['total_counter_count']))
@@ -193,14 +407,14 @@ class SflowTest(BaseTest):
 
     def analyze_flow_sample(self, data, collector): 
         logging.info("packets collected from interfaces ifindex : %s" %data['flow_port_count'])
-        logging.info("Expected number of packets from each port : %s to %s"%(50*0.6,50*1.4))
+        logging.info("Expected number of packets from each port : %s to %s"%(self.SAMPLED_PKTS*0.6,self.SAMPLED_PKTS*1.4))
         for port in self.interfaces:
-            ifindex = self.interfaces[port]['ifindex'] 
+            ifindex = int(self.interfaces[port]['ifindex'])
             logging.info("....%s : Flow packets collected from port %s = %s"%(collector,port,data['flow_port_count'][ifindex]))
             if port in self.enabled_intf :
                 # Checking samples with tolerance of 40 % as the sampling is random and  not deterministic.Over many samples it should converge to a mean of 1:N
                 # Number of packets sent = 50 * sampling rate of interface 
-                self.assertTrue(50*0.6 <= data['flow_port_count'][ifindex] <= 50*1.4 ,
+                self.assertTrue(self.SAMPLED_PKTS*0.6 <= data['flow_port_count'][ifindex] <= self.SAMPLED_PKTS*1.4 ,
                         "Expected Number of samples are not collected  collected from Interface %s  in collector %s , Received %s" %(port,collector,data['flow_port_count'][ifindex]))
             else:
                 self.assertTrue(data['flow_port_count'][ifindex] == 0 ,
@@ -214,7 +428,7 @@ class SflowTest(BaseTest):
         src_mac = self.dataplane.get_mac(0, 0)
         pktlen=100
         #send 50*sampling_rate packets in each interface for better  analysis
-        for j in range(0,50,1):
+        for j in range(0,self.SAMPLED_PKTS,1):
             index = 0
             for intf in self.interfaces:
                 ip_src_addr = str(self.src_ip_list[index])
@@ -236,30 +450,31 @@ class SflowTest(BaseTest):
     def runTest(self):
         self.generate_ArpResponderConfig()
         time.sleep(1)
-        self.stop_collector=False
-        thr1 = threading.Thread(target=self.collector_0)
-        thr2 = threading.Thread(target=self.collector_1)
-        thr1.start()
-        time.sleep(2)
-        thr2.start()
-        #wait for the collectors to initialise
-        time.sleep(5)
-        pktlen=100
-        if self.poll_tests:
-           if self.polling_int==0:
-              time.sleep(20)
-           else:
-               #wait for polling time for collector to collect packets 
-               logging.info("Waiting for % seconds of polling interval"%self.polling_int)
-               time.sleep(self.polling_int)
-        else: 
-           self.sendTraffic()
-           time.sleep(5)
-        self.stop_collector = True
-        thr1.join()
-        thr2.join()
+        self.collectors = {
+            'collector0': SflowCollector('collector0', 6343),
+            'collector1': SflowCollector('collector1', 6344),
+        }
+        for collector in self.collectors.values():
+            collector.start()
+        try:
+            if self.poll_tests:
+               if self.polling_int==0:
+                  # Any counter sample fails the test, so stop as soon as one arrives
+                  self.wait_for(self.counter_sample_received, self.NO_POLLING_TIME)
+               else:
+                   logging.info("Waiting up to %s seconds of polling interval for the counter samples"%self.polling_int)
+                   if not self.wait_for(self.counter_samples_collected, self.polling_int + self.COUNTER_MARGIN) and self.active_col:
+                       logging.info("Counter samples of all the interfaces were not collected in time")
+            else: 
+               self.sendTraffic()
+               if not self.wait_for(self.flow_samples_collected, self.FLOW_TIMEOUT) and self.active_col:
+                   logging.info("Flow samples were not collected in time")
+        finally:
+            for collector in self.collectors.values():
+                collector.stop()
+        self.collector0_samples = self.collectors['collector0'].port_sample()
+        self.collector1_samples = self.collectors['collector1'].port_sample()
         logging.debug(self.collector0_samples)
         logging.debug(self.collector1_samples)
         self.packet_analyzer(self.collector0_samples,'collector0',self.poll_tests)
         self.packet_analyzer(self.collector1_samples,'collector1',self.poll_tests)
- 
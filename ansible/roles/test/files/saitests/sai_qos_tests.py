@@ -55,6 +55,59 @@ STOP_PORT_MAX_RATE = 1
 RELEASE_PORT_MAX_RATE = 0
 ECN_INDEX_IN_HEADER = 53 # Fits the ptf hex_dump_buffer() parse function
 DSCP_INDEX_IN_HEADER = 52 # Fits the ptf hex_dump_buffer() parse function
+COUNTER_SETTLE_INTERVAL = 1 # Seconds between two reads of the counters
+COUNTER_SETTLE_TIMEOUT = 8 # Seconds the counters are given to settle
+# PFC counters keep growing while a paused port sends PFC frames, they are left out of the settle comparison
+PFC_COUNTERS = range(2, 10)
+
+# Seconds every wait_for_counters_settle() call took, in the call order
+counter_settle_times = []
+
+
+def read_counters(client, port_ids, buffer_pool_id=None):
+    counters = {'port': {}, 'queue': {}, 'pg': {}, 'watermark': {}, 'buffer_pool': None}
+    for port_id in port_ids:
+        counters['port'][port_id], counters['queue'][port_id] = sai_thrift_read_port_counters(client, port_list[port_id])
+        counters['pg'][port_id] = sai_thrift_read_pg_counters(client, port_list[port_id])
+        counters['watermark'][port_id] = sai_thrift_read_port_watermarks(client, port_list[port_id])
+    if buffer_pool_id is not None:
+        counters['buffer_pool'] = sai_thrift_read_buffer_pool_watermark(client, buffer_pool_id)
+    return counters
+
+
+def settled_counters(counters):
+    port_counters = dict((port_id, [cnt for idx, cnt in enumerate(values) if idx not in PFC_COUNTERS])
+                         for port_id, values in counters['port'].items())
+    return (port_counters, counters['queue'], counters['pg'], counters['watermark'], counters['buffer_pool'])
+
+
+def wait_for_counters_settle(client, port_ids, buffer_pool_id=None, target=None,
+                             interval=COUNTER_SETTLE_INTERVAL, timeout=COUNTER_SETTLE_TIMEOUT):
+    """
+    Poll the port, queue and pg counters and the watermarks of the ports until target(counters) returns True
+    or, without a target, until they changed from the first read and two reads in a row agree. The first read
+    may be taken before the counters are refreshed, so agreeing with it doesn't mean they settled.
+    Gives up after timeout seconds.
+    Returns the last read counters
+    """
+    start = time.time()
+    counters = read_counters(client, port_ids, buffer_pool_id)
+    baseline = settled_counters(counters)
+    changed = False
+    while not (target and target(counters)) and time.time() - start < timeout:
+        time.sleep(interval)
+        last = settled_counters(counters)
+        counters = read_counters(client, port_ids, buffer_pool_id)
+        if target:
+            continue
+        current = settled_counters(counters)
+        changed = changed or current != baseline
+        if changed and current == last:
+            break
+    settle_time = time.time() - start
+    counter_settle_times.append(settle_time)
+    print >> sys.stderr, "counters of ports %s settled in %.2f seconds" % (port_ids, settle_time)
+    return counters
 
 
 class ARPpopulate(sai_base_test.ThriftInterfaceDataPlane):
@@ -205,7 +258,8 @@ class DscpMappingPB(sai_base_test.ThriftInterfaceDataPlane):
                         continue
 
             # Read Counters
-            time.sleep(10)
+            wait_for_counters_settle(self.client, [dst_port_id],
+                target=lambda counters: sum(counters['queue'][dst_port_id]) - sum(queue_results_base) >= 64)
             port_results, queue_results = sai_thrift_read_port_counters(self.client, port_list[dst_port_id])
 
             print >> sys.stderr, map(operator.sub, queue_results, queue_results_base)
@@ -304,7 +358,8 @@ class Dot1pToQueueMapping(sai_base_test.ThriftInterfaceDataPlane):
                     print >> sys.stderr, "dot1p: %d, calling send_packet" % (dot1p)
 
                 # validate queue counters increment by the correct pkt num
-                time.sleep(8)
+                wait_for_counters_settle(self.client, [dst_port_id],
+                    target=lambda counters: sum(counters['queue'][dst_port_id]) - sum(queue_results_base) >= len(dot1ps))
                 port_results, queue_results = sai_thrift_read_port_counters(self.client, port_list[dst_port_id])
                 print >> sys.stderr, queue_results_base
                 print >> sys.stderr, queue_results
@@ -395,7 +450,8 @@ class DscpToPgMapping(sai_base_test.ThriftInterfaceDataPlane):
                     print >> sys.stderr, "dscp: %d, calling send_packet" % (tos >> 2)
 
                 # validate pg counters increment by the correct pkt num
-                time.sleep(8)
+                wait_for_counters_settle(self.client, [src_port_id],
+                    target=lambda counters: sum(counters['pg'][src_port_id]) - sum(pg_cntrs_base) >= len(dscps))
                 pg_cntrs = sai_thrift_read_pg_counters(self.client, port_list[src_port_id])
                 print >> sys.stderr, pg_cntrs_base
                 print >> sys.stderr, pg_cntrs
@@ -504,7 +560,8 @@ class Dot1pToPgMapping(sai_base_test.ThriftInterfaceDataPlane):
                     print >> sys.stderr, "dot1p: %d, calling send_packet" % (dot1p)
 
                 # validate pg counters increment by the correct pkt num
-                time.sleep(8)
+                wait_for_counters_settle(self.client, [src_port_id],
+                    target=lambda counters: sum(counters['pg'][src_port_id]) - sum(pg_cntrs_base) >= len(dot1ps))
                 pg_cntrs = sai_thrift_read_pg_counters(self.client, port_list[src_port_id])
                 print >> sys.stderr, pg_cntrs_base
                 print >> sys.stderr, pg_cntrs
@@ -590,8 +647,8 @@ class PFCtest(sai_base_test.ThriftInterfaceDataPlane):
         try:
             # send packets short of triggering pfc
             send_packet(self, src_port_id, pkt, pkts_num_leak_out + pkts_num_trig_pfc - 1 - margin)
-            # allow enough time for the dut to sync up the counter values in counters_db
-            time.sleep(8)
+            # wait for the dut to sync up the counter values in counters_db
+            wait_for_counters_settle(self.client, [src_port_id, dst_port_id])
             # get a snapshot of counter values at recv and transmit ports
             # queue counters value is not of our interest here
             recv_counters, queue_counters = sai_thrift_read_port_counters(self.client, port_list[src_port_id])
@@ -605,8 +662,8 @@ class PFCtest(sai_base_test.ThriftInterfaceDataPlane):
 
             # send 1 packet to trigger pfc
             send_packet(self, src_port_id, pkt, 1 + 2 * margin)
-            # allow enough time for the dut to sync up the counter values in counters_db
-            time.sleep(8)
+            # wait for the dut to sync up the counter values in counters_db
+            wait_for_counters_settle(self.client, [src_port_id, dst_port_id])
             # get a snapshot of counter values at recv and transmit ports
             # queue counters value is not of our interest here
             recv_counters_base = recv_counters
@@ -621,8 +678,8 @@ class PFCtest(sai_base_test.ThriftInterfaceDataPlane):
 
             # send packets short of ingress drop
             send_packet(self, src_port_id, pkt, pkts_num_trig_ingr_drp - pkts_num_trig_pfc - 1 - 2 * margin)
-            # allow enough time for the dut to sync up the counter values in counters_db
-            time.sleep(8)
+            # wait for the dut to sync up the counter values in counters_db
+            wait_for_counters_settle(self.client, [src_port_id, dst_port_id])
             # get a snapshot of counter values at recv and transmit ports
             # queue counters value is not of our interest here
             recv_counters_base = recv_counters
@@ -637,8 +694,8 @@ class PFCtest(sai_base_test.ThriftInterfaceDataPlane):
 
             # send 1 packet to trigger ingress drop
             send_packet(self, src_port_id, pkt, 1 + 2 * margin)
-            # allow enough time for the dut to sync up the counter values in counters_db
-            time.sleep(8)
+            # wait for the dut to sync up the counter values in counters_db
+            wait_for_counters_settle(self.client, [src_port_id, dst_port_id])
             # get a snapshot of counter values at recv and transmit ports
             # queue counters value is not of our interest here
             recv_counters_base = recv_counters
@@ -735,8 +792,8 @@ class PFCXonTest(sai_base_test.ThriftInterfaceDataPlane):
                                     ip_ttl=ttl)
             send_packet(self, src_port_id, pkt, pkts_num_leak_out + 1)
 
-            # allow enough time for the dut to sync up the counter values in counters_db
-            time.sleep(8)
+            # wait for the dut to sync up the counter values in counters_db
+            wait_for_counters_settle(self.client, [src_port_id, dst_port_id, dst_port_2_id, dst_port_3_id])
             # get a snapshot of counter values at recv and transmit ports
             # queue counters value is not of our interest here
             recv_counters, queue_counters = sai_thrift_read_port_counters(self.client, port_list[src_port_id])
@@ -754,8 +811,8 @@ class PFCXonTest(sai_base_test.ThriftInterfaceDataPlane):
 
             sai_thrift_port_tx_enable(self.client, asic_type, [dst_port_2_id])
 
-            # allow enough time for the dut to sync up the counter values in counters_db
-            time.sleep(8)
+            # wait for the dut to sync up the counter values in counters_db
+            wait_for_counters_settle(self.client, [src_port_id, dst_port_id, dst_port_2_id, dst_port_3_id])
             # get a snapshot of counter values at recv and transmit ports
             # queue counters value is not of our interest here
             recv_counters_base = recv_counters
@@ -774,8 +831,8 @@ class PFCXonTest(sai_base_test.ThriftInterfaceDataPlane):
 
             sai_thrift_port_tx_enable(self.client, asic_type, [dst_port_3_id])
 
-            # allow enough time for the dut to sync up the counter values in counters_db
-            time.sleep(8)
+            # wait for the dut to sync up the counter values in counters_db
+            wait_for_counters_settle(self.client, [src_port_id])
             # get new base counter values at recv ports
             # queue counters value is not of our interest here
             recv_counters, queue_counters = sai_thrift_read_port_counters(self.client, port_list[src_port_id])
@@ -904,8 +961,8 @@ class HdrmPoolSizeTest(sai_base_test.ThriftInterfaceDataPlane):
 
             print >> sys.stderr, "Service pool almost filled"
             sys.stderr.flush()
-            # allow enough time for the dut to sync up the counter values in counters_db
-            time.sleep(8)
+            # wait for the dut to sync up the counter values in counters_db
+            wait_for_counters_settle(self.client, self.src_port_ids)
 
             for i in range(0, self.pgs_num):
                 # Prepare TCP packet data
@@ -926,8 +983,8 @@ class HdrmPoolSizeTest(sai_base_test.ThriftInterfaceDataPlane):
                 while (recv_counters[sidx_dscp_pg_tuples[i][2]] == recv_counters_bases[sidx_dscp_pg_tuples[i][0]][sidx_dscp_pg_tuples[i][2]]) and (pkt_cnt < 10):
                     send_packet(self, self.src_port_ids[sidx_dscp_pg_tuples[i][0]], pkt, 1)
                     pkt_cnt += 1
-                    # allow enough time for the dut to sync up the counter values in counters_db
-                    time.sleep(8)
+                    # wait for the dut to sync up the counter values in counters_db
+                    wait_for_counters_settle(self.client, [self.src_port_ids[sidx_dscp_pg_tuples[i][0]]])
 
                     # get a snapshot of counter values at recv and transmit ports
                     # queue_counters value is not of our interest here
@@ -958,8 +1015,8 @@ class HdrmPoolSizeTest(sai_base_test.ThriftInterfaceDataPlane):
                                         ip_ttl=ttl)
 
                 send_packet(self, self.src_port_ids[sidx_dscp_pg_tuples[i][0]], pkt, self.pkts_num_hdrm_full if i != self.pgs_num - 1 else self.pkts_num_hdrm_partial)
-                # allow enough time for the dut to sync up the counter values in counters_db
-                time.sleep(8)
+                # wait for the dut to sync up the counter values in counters_db
+                wait_for_counters_settle(self.client, [self.src_port_ids[sidx_dscp_pg_tuples[i][0]]])
 
                 recv_counters, queue_counters = sai_thrift_read_port_counters(self.client, port_list[self.src_port_ids[sidx_dscp_pg_tuples[i][0]]])
                 # assert no ingress drop
@@ -972,8 +1029,8 @@ class HdrmPoolSizeTest(sai_base_test.ThriftInterfaceDataPlane):
             i = self.pgs_num - 1
             # send 1 packet on last pg to trigger ingress drop
             send_packet(self, self.src_port_ids[sidx_dscp_pg_tuples[i][0]], pkt, 1 + 2 * margin)
-            # allow enough time for the dut to sync up the counter values in counters_db
-            time.sleep(8)
+            # wait for the dut to sync up the counter values in counters_db
+            wait_for_counters_settle(self.client, [self.src_port_ids[sidx_dscp_pg_tuples[i][0]]])
             recv_counters, queue_counters = sai_thrift_read_port_counters(self.client, port_list[self.src_port_ids[sidx_dscp_pg_tuples[i][0]]])
             # assert ingress drop
             assert(recv_counters[INGRESS_DROP] > recv_counters_bases[sidx_dscp_pg_tuples[i][0]][INGRESS_DROP])
@@ -1365,8 +1422,8 @@ class LossyQueueTest(sai_base_test.ThriftInterfaceDataPlane):
         try:
             # send packets short of triggering egress drop
             send_packet(self, src_port_id, pkt, pkts_num_leak_out + pkts_num_trig_egr_drp - 1 - margin)
-            # allow enough time for the dut to sync up the counter values in counters_db
-            time.sleep(8)
+            # wait for the dut to sync up the counter values in counters_db
+            wait_for_counters_settle(self.client, [src_port_id, dst_port_id])
             # get a snapshot of counter values at recv and transmit ports
             # queue counters value is not of our interest here
             recv_counters, queue_counters = sai_thrift_read_port_counters(self.client, port_list[src_port_id])
@@ -1380,8 +1437,8 @@ class LossyQueueTest(sai_base_test.ThriftInterfaceDataPlane):
 
             # send 1 packet to trigger egress drop
             send_packet(self, src_port_id, pkt, 1 + 2 * margin)
-            # allow enough time for the dut to sync up the counter values in counters_db
-            time.sleep(8)
+            # wait for the dut to sync up the counter values in counters_db
+            wait_for_counters_settle(self.client, [src_port_id, dst_port_id])
             # get a snapshot of counter values at recv and transmit ports
             # queue counters value is not of our interest here
             recv_counters, queue_counters = sai_thrift_read_port_counters(self.client, port_list[src_port_id])
@@ -1446,7 +1503,7 @@ class PGSharedWatermarkTest(sai_base_test.ThriftInterfaceDataPlane):
             # so if pg min is zero, it directly treks into shared pool by 1
             # this is the case for lossy traffic
             send_packet(self, src_port_id, pkt, pkts_num_leak_out + pkts_num_fill_min)
-            time.sleep(8)
+            wait_for_counters_settle(self.client, [src_port_id])
             q_wm_res, pg_shared_wm_res, pg_headroom_wm_res = sai_thrift_read_port_watermarks(self.client, port_list[src_port_id])
             print >> sys.stderr, "Init pkts num sent: %d, min: %d, actual watermark value to start: %d" % ((pkts_num_leak_out + pkts_num_fill_min), pkts_num_fill_min, pg_shared_wm_res[pg])
             if pkts_num_fill_min:
@@ -1474,7 +1531,7 @@ class PGSharedWatermarkTest(sai_base_test.ThriftInterfaceDataPlane):
                 print >> sys.stderr, "pkts num to send: %d, total pkts: %d, pg shared: %d" % (pkts_num, expected_wm, total_shared)
 
                 send_packet(self, src_port_id, pkt, pkts_num)
-                time.sleep(8)
+                wait_for_counters_settle(self.client, [src_port_id])
                 q_wm_res, pg_shared_wm_res, pg_headroom_wm_res = sai_thrift_read_port_watermarks(self.client, port_list[src_port_id])
                 print >> sys.stderr, "lower bound: %d, actual value: %d, upper bound (+%d): %d" % (expected_wm * cell_size, pg_shared_wm_res[pg], margin, (expected_wm + margin) * cell_size)
                 assert(pg_shared_wm_res[pg] <= (expected_wm + margin) * cell_size)
@@ -1484,7 +1541,7 @@ class PGSharedWatermarkTest(sai_base_test.ThriftInterfaceDataPlane):
 
             # overflow the shared pool
             send_packet(self, src_port_id, pkt, pkts_num)
-            time.sleep(8)
+            wait_for_counters_settle(self.client, [src_port_id])
             q_wm_res, pg_shared_wm_res, pg_headroom_wm_res = sai_thrift_read_port_watermarks(self.client, port_list[src_port_id])
             print >> sys.stderr, "exceeded pkts num sent: %d, expected watermark: %d, actual value: %d" % (pkts_num, (expected_wm * cell_size), pg_shared_wm_res[pg])
             assert(expected_wm == total_shared)
@@ -1542,7 +1599,7 @@ class PGHeadroomWatermarkTest(sai_base_test.ThriftInterfaceDataPlane):
         try:
             # send packets to trigger pfc but not trek into headroom
             send_packet(self, src_port_id, pkt, pkts_num_leak_out + pkts_num_trig_pfc)
-            time.sleep(8)
+            wait_for_counters_settle(self.client, [src_port_id])
             q_wm_res, pg_shared_wm_res, pg_headroom_wm_res = sai_thrift_read_port_watermarks(self.client, port_list[src_port_id])
             assert(pg_headroom_wm_res[pg] == 0)
 
@@ -1560,7 +1617,7 @@ class PGHeadroomWatermarkTest(sai_base_test.ThriftInterfaceDataPlane):
                 print >> sys.stderr, "pkts num to send: %d, total pkts: %d, pg headroom: %d" % (pkts_num, expected_wm, total_hdrm)
 
                 send_packet(self, src_port_id, pkt, pkts_num)
-                time.sleep(8)
+                wait_for_counters_settle(self.client, [src_port_id])
                 q_wm_res, pg_shared_wm_res, pg_headroom_wm_res = sai_thrift_read_port_watermarks(self.client, port_list[src_port_id])
                 print >> sys.stderr, "lower bound: %d, actual value: %d, upper bound: %d" % ((expected_wm - margin) * cell_size, pg_headroom_wm_res[pg], (expected_wm * cell_size))
                 assert(pg_headroom_wm_res[pg] <= expected_wm * cell_size)
@@ -1570,7 +1627,7 @@ class PGHeadroomWatermarkTest(sai_base_test.ThriftInterfaceDataPlane):
 
             # overflow the headroom
             send_packet(self, src_port_id, pkt, pkts_num)
-            time.sleep(8)
+            wait_for_counters_settle(self.client, [src_port_id])
             q_wm_res, pg_shared_wm_res, pg_headroom_wm_res = sai_thrift_read_port_watermarks(self.client, port_list[src_port_id])
             print >> sys.stderr, "exceeded pkts num sent: %d, actual value: %d, expected watermark: %d" % (pkts_num, pg_headroom_wm_res[pg], (expected_wm * cell_size))
             assert(expected_wm == total_hdrm)
@@ -1633,7 +1690,7 @@ class QSharedWatermarkTest(sai_base_test.ThriftInterfaceDataPlane):
             # TH2 uses scheduler-based TX enable, this does not require sending packets
             # to leak out
             send_packet(self, src_port_id, pkt, pkts_num_leak_out + pkts_num_fill_min)
-            time.sleep(8)
+            wait_for_counters_settle(self.client, [dst_port_id])
             q_wm_res, pg_shared_wm_res, pg_headroom_wm_res = sai_thrift_read_port_watermarks(self.client, port_list[dst_port_id])
             print >> sys.stderr, "Init pkts num sent: %d, min: %d, actual watermark value to start: %d" % ((pkts_num_leak_out + pkts_num_fill_min), pkts_num_fill_min, q_wm_res[queue])
             if pkts_num_fill_min:
@@ -1655,7 +1712,7 @@ class QSharedWatermarkTest(sai_base_test.ThriftInterfaceDataPlane):
                 print >> sys.stderr, "pkts num to send: %d, total pkts: %d, queue shared: %d" % (pkts_num, expected_wm, total_shared)
 
                 send_packet(self, src_port_id, pkt, pkts_num)
-                time.sleep(8)
+                wait_for_counters_settle(self.client, [dst_port_id])
                 q_wm_res, pg_shared_wm_res, pg_headroom_wm_res = sai_thrift_read_port_watermarks(self.client, port_list[dst_port_id])
                 print >> sys.stderr, "lower bound: %d, actual value: %d, upper bound: %d" % (expected_wm * cell_size, q_wm_res[queue], (expected_wm * cell_size))
                 assert(q_wm_res[queue] <= expected_wm * cell_size)
@@ -1665,7 +1722,7 @@ class QSharedWatermarkTest(sai_base_test.ThriftInterfaceDataPlane):
 
             # overflow the shared pool
             send_packet(self, src_port_id, pkt, pkts_num)
-            time.sleep(8)
+            wait_for_counters_settle(self.client, [dst_port_id])
             q_wm_res, pg_shared_wm_res, pg_headroom_wm_res = sai_thrift_read_port_watermarks(self.client, port_list[dst_port_id])
             print >> sys.stderr, "exceeded pkts num sent: %d, expected watermark: %d, actual value: %d" % (pkts_num, (expected_wm * cell_size), q_wm_res[queue])
             assert(expected_wm == total_shared)
@@ -1751,7 +1808,7 @@ class BufferPoolWatermarkTest(sai_base_test.ThriftInterfaceDataPlane):
             pkts_num_to_send += (pkts_num_leak_out + pkts_num_fill_min)
             send_packet(self, src_port_id, pkt, pkts_num_to_send)
             sai_thrift_port_tx_enable(self.client, asic_type, [dst_port_id])
-            time.sleep(8)
+            wait_for_counters_settle(self.client, [], buffer_pool_id=buf_pool_roid)
             buffer_pool_wm = sai_thrift_read_buffer_pool_watermark(self.client, buf_pool_roid)
             print >> sys.stderr, "Init pkts num sent: %d, min: %d, actual watermark value to start: %d" % ((pkts_num_leak_out + pkts_num_fill_min), pkts_num_fill_min, buffer_pool_wm)
             if pkts_num_fill_min:
@@ -1781,7 +1838,7 @@ class BufferPoolWatermarkTest(sai_base_test.ThriftInterfaceDataPlane):
                 pkts_num_to_send += pkts_num
                 send_packet(self, src_port_id, pkt, pkts_num_to_send)
                 sai_thrift_port_tx_enable(self.client, asic_type, [dst_port_id])
-                time.sleep(8)
+                wait_for_counters_settle(self.client, [], buffer_pool_id=buf_pool_roid)
                 buffer_pool_wm = sai_thrift_read_buffer_pool_watermark(self.client, buf_pool_roid)
                 print >> sys.stderr, "lower bound (-%d): %d, actual value: %d, upper bound (+%d): %d" % (lower_bound_margin, (expected_wm - lower_bound_margin)* cell_size, buffer_pool_wm, upper_bound_margin, (expected_wm + upper_bound_margin) * cell_size)
                 assert(buffer_pool_wm <= (expected_wm + upper_bound_margin) * cell_size)
@@ -1794,7 +1851,7 @@ class BufferPoolWatermarkTest(sai_base_test.ThriftInterfaceDataPlane):
             pkts_num_to_send += pkts_num
             send_packet(self, src_port_id, pkt, pkts_num_to_send)
             sai_thrift_port_tx_enable(self.client, asic_type, [dst_port_id])
-            time.sleep(8)
+            wait_for_counters_settle(self.client, [], buffer_pool_id=buf_pool_roid)
             buffer_pool_wm = sai_thrift_read_buffer_pool_watermark(self.client, buf_pool_roid)
             print >> sys.stderr, "exceeded pkts num sent: %d, expected watermark: %d, actual value: %d" % (pkts_num, (expected_wm * cell_size), buffer_pool_wm)
             assert(expected_wm == total_shared)
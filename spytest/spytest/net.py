@@ -63,9 +63,11 @@ class Net(object):
         self.tmpl = dict()
         self.rest = dict()
         self.syslogs = dict()
+        self.syslog_regex = dict()
         self.is_vsonic_cache = dict()
         self.memory_checks = dict()
         self.skip_trans_helper = dict()
+        self.applied_config = dict()
         self.image_install_status = OrderedDict()
         self.devices_used_in_tc = OrderedDict()
         self.devices_used_collection = False
@@ -95,10 +97,14 @@ class Net(object):
         #time.sleep = self.wait
         self.force_console_transfer = False
         self.max_cmds_once = 100
+        self.console_transfer_lines = 1000
+        self.transfer_store = os.getenv("SPYTEST_TRANSFER_STORE", "/var/tmp/spytest-store")
+        self.transfer_store_ready = dict()
         self.kdump_supported = bool(os.getenv("SPYTEST_KDUMP_ENABLE", "1") == "1")
         self.pending_downloads = dict()
         self.log_dutid_fmt = os.getenv("SPYTEST_LOG_DUTID_FMT", "LABEL")
         self.dut_log_lock = threading.Lock()
+        self.incremental_apply_json = bool(os.getenv("SPYTEST_INCREMENTAL_APPLY_JSON", "1") == "1")
 
     def is_use_last_prompt(self):
         fcli = os.getenv("SPYTEST_FASTER_CLI_OVERRIDE", None)
@@ -1818,6 +1824,7 @@ class Net(object):
     def cli_config(self, devname, cmd, mode=None, skip_error_check=False, delay_factor=0, **kwargs):
         devname = self._check_devname(devname)
         access = self._get_dev_access(devname)
+        self._invalidate_applied_config(devname)
         prompts = access["prompts"]
 
         if access["filemode"]:
@@ -1919,6 +1926,7 @@ class Net(object):
 
         devname = self._check_devname(devname)
         access = self._get_dev_access(devname)
+        self._invalidate_applied_config(devname)
 
         save_cmd = 'sudo config save -y'
         reload_cmd = 'sudo config reload -y'
@@ -1947,6 +1955,7 @@ class Net(object):
 
     def apply_script(self, devname, cmdlist):
         devname = self._check_devname(devname)
+        self._invalidate_applied_config(devname)
         access = self._get_dev_access(devname)
         if access["filemode"]:
             for cmd in cmdlist:
@@ -2032,6 +2041,19 @@ class Net(object):
             except:
                 raise ValueError("invalid json data")
 
+        # push only the entries changed since the last config applied by apply_json
+        applied_config = self.applied_config.get(devname)
+        delta = self._config_delta(applied_config, obj)
+        if delta is not None:
+            if not delta:
+                msg = "apply_json: config is already applied - nothing to push"
+                self.dut_log(devname, msg)
+                return
+            msg = "apply_json: pushing {} changed entries".format(
+                sum([len(v) if isinstance(v, dict) else 1 for v in delta.values()]))
+            self.dut_log(devname, msg)
+            indented = json.dumps(delta, indent=4)
+
         # write json content into file
         for retry in range(3):
             src_file = tempfile.mktemp()
@@ -2080,7 +2102,55 @@ class Net(object):
         if not applied:
             msg = "Failed to find the transfered destination file even after retries - try using echo"
             self.dut_log(devname, msg, lvl=logging.WARNING)
-            self.apply_json2(devname, data)
+            self.apply_json2(devname, json.dumps(delta) if delta else data)
+        elif self.incremental_apply_json and isinstance(obj, dict):
+            # commands issued above dropped the applied config, keep it updated with this one
+            self.applied_config[devname] = self._merge_config(applied_config or dict(), obj)
+
+    def _invalidate_applied_config(self, devname):
+        self.applied_config.pop(devname, None)
+
+    def _config_delta(self, applied, obj):
+        """
+        Find the CONFIG_DB entries of the config which differ from the last config applied by apply_json.
+        'config load' merges the fields of every entry, so unchanged entries and fields need not be pushed.
+        :return: config with the changed entries, None when the applied config is not known
+        :rtype: dict
+        """
+        if applied is None or not isinstance(obj, dict):
+            return None
+        delta = dict()
+        for table, entries in obj.items():
+            if not isinstance(entries, dict):
+                delta[table] = entries
+                continue
+            applied_entries = applied.get(table, {})
+            for key, fields in entries.items():
+                applied_fields = applied_entries.get(key)
+                if not isinstance(fields, dict) or not isinstance(applied_fields, dict):
+                    if fields != applied_fields or fields is None:
+                        delta.setdefault(table, dict())[key] = fields
+                    continue
+                changed = dict([(k, v) for k, v in fields.items() if applied_fields.get(k) != v])
+                if changed:
+                    delta.setdefault(table, dict())[key] = changed
+        return delta
+
+    def _merge_config(self, applied, obj):
+        for table, entries in obj.items():
+            if not isinstance(entries, dict):
+                # table is deleted or replaced
+                applied.pop(table, None)
+                continue
+            applied_entries = applied.setdefault(table, dict())
+            for key, fields in entries.items():
+                if isinstance(fields, dict) and isinstance(applied_entries.get(key), dict):
+                    applied_entries[key].update(copy.deepcopy(fields))
+                elif fields is None:
+                    applied_entries.pop(key, None)
+                else:
+                    applied_entries[key] = copy.deepcopy(fields)
+        return applied
 
     def apply_json2(self, devname, data):
         access = self._get_dev_access(devname)
@@ -2092,6 +2162,7 @@ class Net(object):
 
     def recover_from_onie(self, devname, install):
         devname = self._check_devname(devname)
+        self._invalidate_applied_config(devname)
         access = self._get_dev_access(devname)
         self._send_command(access, "onie-discovery-stop")
         self._send_command(access, "onie-stop")
@@ -2193,6 +2264,7 @@ class Net(object):
 
     def upgrade_onie_image1(self, devname, url, max_ready_wait=0):
         devname = self._check_devname(devname)
+        self._invalidate_applied_config(devname)
         access = self._get_dev_access(devname)
 
         if not self.wa.session_init_completed:
@@ -2249,6 +2321,7 @@ class Net(object):
 
     def upgrade_onie_image2(self, devname, url, max_ready_wait=0):
         devname = self._check_devname(devname)
+        self._invalidate_applied_config(devname)
         access = self._get_dev_access(devname)
 
         if not self.wa.session_init_completed:
@@ -2357,6 +2430,7 @@ class Net(object):
         """
         devname = self._check_devname(devname)
         access = self._get_dev_access(devname)
+        self._invalidate_applied_config(devname)
 
         if not self.wa.session_init_completed:
             if devname in self.image_install_status and self.image_install_status[devname]:
@@ -2441,6 +2515,7 @@ class Net(object):
 
         devname = self._check_devname(devname)
         access = self._get_dev_access(devname)
+        self._invalidate_applied_config(devname)
 
         flag_fast_warm_reboot = 0
         if method in ["normal", "reboot"]:
@@ -2603,21 +2678,16 @@ class Net(object):
         prompt = self._get_param(devname, "normal-user-cli-prompt")
         script_cmd = "rm -f {}.tmp {}".format(dst_file, dst_file)
         self._exec(devname, script_cmd, prompt)
-        redir = ">"
+        # stream many lines per prompt round trip using here documents
         lines = utils.b64encode(src_file)
-        (count, split) = (len(lines), self.max_cmds_once)
-        for i in range(0, count, split):
-            script_cmds = []
-            for j in range(i, i+split):
-                if j >= count:
-                    break
-                script_cmds.append(lines[j])
-            if script_cmds:
-                line = "".join(script_cmds)
-                script_cmd = "echo {} {} {}.tmp".format(line, redir, dst_file)
-                self._send_command(access, script_cmd, prompt, True)
-                redir = ">>"
-        script_cmd = "base64 -d {}.tmp > {}".format(dst_file, dst_file)
+        chunks = utils.split_list(lines, self.console_transfer_lines)
+        msg = "Console transfer: {} lines in {} chunks".format(len(lines), len(chunks))
+        self.dut_log(devname, msg)
+        for clist in chunks:
+            script_cmd = "cat >> {}.tmp << 'SPYTEST_EOF'\n{}\nSPYTEST_EOF".format(
+                dst_file, "\n".join(clist))
+            self._send_command(access, script_cmd, prompt, True, trace_dut_log=0, ufcli=False)
+        script_cmd = "base64 -d {0}.tmp > {0} && rm -f {0}.tmp".format(dst_file)
         self._exec(devname, script_cmd, prompt)
 
     def _transfer_base64_small(self, access, src_file, dst_file):
@@ -2699,9 +2769,44 @@ class Net(object):
         self.dut_log(devname, msg)
         if access["filemode"]:
             return dst_file
+
+        # files are kept in a store on the device by their md5
+        # so that the same content is never transferred twice
+        self._enter_linux_exit_vtysh(devname)
+        md5sum = utils.md5(src_file)
+        if self._copy_from_store(access, md5sum, dst_file):
+            self.dut_log(devname, "Transfer: copied {} from device store".format(md5sum))
+            return dst_file
+
+        # transfer compressed content
+        gz_file = utils.gzip_file(src_file, tempfile.mktemp(suffix=".gz"))
+        gz_dst_file = "/tmp/{}.gz".format(md5sum)
+        msg = "Transfer: {} bytes compressed to {} bytes".format(
+            os.path.getsize(src_file), os.path.getsize(gz_file))
+        self.dut_log(devname, msg)
+        try:
+            self._transfer_file(access, gz_file, gz_dst_file)
+        finally:
+            os.remove(gz_file)
+
+        if self._add_to_store(access, md5sum, gz_dst_file, dst_file):
+            return dst_file
+
+        # store is not usable or the content is corrupted - deliver the file as is
+        msg = "Transfer: failed to add {} to device store - transferring uncompressed".format(md5sum)
+        self.dut_log(devname, msg, lvl=logging.WARNING)
+        self._store_cmd(access, "rm -f {}".format(gz_dst_file))
+        self._transfer_file(access, src_file, dst_file)
+        if not self._store_cmd(access, "echo '{}  {}' | md5sum -c --status".format(md5sum, dst_file)):
+            msg = "Transfer: {} content does not match md5 {}".format(dst_file, md5sum)
+            self.dut_log(devname, msg, lvl=logging.ERROR)
+        return dst_file
+
+    def _transfer_file(self, access, src_file, dst_file):
+        devname = access["devname"]
         if self.force_console_transfer:
             self._transfer_base64(access, src_file, dst_file)
-            return dst_file
+            return
         try:
             connection_param = access["connection_param"]
             msg = "Doing SFTP transfer {}".format(connection_param["mgmt-ip"])
@@ -2713,7 +2818,35 @@ class Net(object):
             print(e)
             self.dut_log(devname, "SFTP Failed - Doing Console transfer")
             self._transfer_base64(access, src_file, dst_file)
-        return dst_file
+
+    def _store_cmd(self, access, script_cmd):
+        # the marker is only matched as a line of its own, never in the echoed command
+        devname = access["devname"]
+        prompt = self._get_param(devname, "normal-user-cli-prompt")
+        script_cmd = "{} && echo SPYTEST-STORE-OK".format(script_cmd)
+        output = self._send_command(access, script_cmd, prompt, True, trace_dut_log=1)
+        return "SPYTEST-STORE-OK" in [line.strip() for line in output.split("\n")]
+
+    def _copy_from_store(self, access, md5sum, dst_file):
+        store_file = "{}/{}".format(self.transfer_store, md5sum)
+        return self._store_cmd(access, "cp -f {} {} 2>/dev/null".format(store_file, dst_file))
+
+    def _add_to_store(self, access, md5sum, gz_file, dst_file):
+        store_file = "{}/{}".format(self.transfer_store, md5sum)
+        script_cmds = []
+        devname = access["devname"]
+        if not self.transfer_store_ready.get(devname):
+            # drop the files not used for a month
+            script_cmds.append("mkdir -p {0}".format(self.transfer_store))
+            script_cmds.append("(find {0} -type f -atime +30 -delete 2>/dev/null; true)".format(self.transfer_store))
+        script_cmds.append("gzip -dc {} > {}.tmp".format(gz_file, store_file))
+        script_cmds.append("echo '{0}  {1}.tmp' | md5sum -c --status".format(md5sum, store_file))
+        script_cmds.append("mv -f {0}.tmp {0}".format(store_file))
+        script_cmds.append("cp -f {} {}".format(store_file, dst_file))
+        script_cmds.append("rm -f {}".format(gz_file))
+        retval = self._store_cmd(access, " && ".join(script_cmds))
+        self.transfer_store_ready[devname] = retval
+        return retval
 
     def _upload_file2(self, devname, access, src_file, md5check=False):
         remote_dir = "/etc/spytest"
@@ -2882,6 +3015,8 @@ class Net(object):
     def _apply_remote(self, devname, option_type, value_list=[]):
         devname = self._check_devname(devname)
         access = self._get_dev_access(devname)
+        if option_type not in ["syslog-check", "memory-snapshot", "sairedis"]:
+            self._invalidate_applied_config(devname)
 
         # ensure we are in sonic mode
         self._enter_linux_exit_vtysh(devname)
@@ -2956,6 +3091,9 @@ class Net(object):
             args_str = args_str + " --phase '{} {}'".format(value_list[1], value_list[2])
             skip_error_check = True
             delay_factor = 3
+        elif option_type == "memory-snapshot":
+            args_str = ""
+            skip_error_check = True
         elif option_type == "sairedis":
             args_str = value_list[0]
             skip_error_check = True
@@ -3021,7 +3159,8 @@ class Net(object):
                                         skip_error_check, delay_factor,
                                         trace_dut_log=1)
             self.trace_callback_set(devname, False)
-            self.dut_log(devname, output)
+            if option_type != "memory-snapshot":
+                self.dut_log(devname, output)
             if execute_in_console:
                 self._tryssh_switch(devname, True)
         except Exception as exp:
@@ -3031,7 +3170,7 @@ class Net(object):
                 self._tryssh_switch(devname, False)
             raise exp
 
-        if option_type in ["run-test", "syslog-check"]:
+        if option_type in ["run-test", "syslog-check", "memory-snapshot"]:
             return output
 
         process_apply_config = True
@@ -3224,28 +3363,118 @@ class Net(object):
             msg = "memory check {}".format(phase)
             self.dut_log(devname, msg, lvl=logging.DEBUG)
         else:
-            if devname in self.memory_checks:
-                file_path = self.memory_checks[devname]
-            else:
-                file_path = self.make_local_file_path(devname, "", "all.log",
-                                                      "memory_utilization")
-                self.memory_checks[devname] = file_path
-                utils.write_file(file_path, "")
-            utils.write_file(file_path, "\n================ {} {} =================\n".format(phase, name), "a")
-            output = self._exec(devname, "cat /proc/meminfo", mode="normal-user", skip_error_check=True, trace_dut_log=1)
-            utils.write_file(file_path, output, "a")
-            utils.write_file(file_path, "\n --------------------------------\n", "a")
-            output = self._exec(devname, "docker stats -a --no-stream", mode="normal-user", skip_error_check=True, trace_dut_log=1)
-            utils.write_file(file_path, output, "a")
-            utils.write_file(file_path, "\n --------------------------------\n", "a")
-            output = self._exec(devname, "top -b -n 1", mode="normal-user", skip_error_check=True, trace_dut_log=1)
-            utils.write_file(file_path, output, "a")
-            utils.write_file(file_path, "\n --------------------------------\n", "a")
-            output = self._exec(devname, "pstree -p", mode="normal-user", skip_error_check=True, trace_dut_log=1)
-            utils.write_file(file_path, output, "a")
-            utils.write_file(file_path, "\n --------------------------------\n", "a")
-            output = self._exec(devname, "free -mlh", mode="normal-user", skip_error_check=True, trace_dut_log=1)
-            utils.write_file(file_path, output, "a")
+            self._memory_snapshot(devname, phase, name)
+
+    def _read_memory_snapshot(self, devname):
+        output = self._apply_remote(devname, "memory-snapshot")
+        for line in output.split("\n"):
+            line = line.strip()
+            if line.startswith("MEMORY-SNAPSHOT: "):
+                try:
+                    snapshot = json.loads(line[len("MEMORY-SNAPSHOT: "):])
+                except Exception:
+                    break
+                snapshot["processes"] = dict([("{} {}".format(pid, v[0]), v)
+                                              for pid, v in snapshot["processes"].items()])
+                return snapshot
+        msg = "Failed to read the memory snapshot"
+        self.dut_log(devname, msg, lvl=logging.WARNING)
+        return None
+
+    def _memory_snapshot(self, devname, phase, name):
+        """
+        Take the memory snapshot of the device in one remote call and report the usage
+        and its change since the previous phase. The trend since the first snapshot of
+        the run is rewritten after every snapshot.
+        """
+        snapshot = self._read_memory_snapshot(devname)
+        if snapshot is None:
+            return
+        snapshot["phase"] = "{} {}".format(phase, name)
+        snapshot["time"] = time.strftime("%Y-%m-%d %H:%M:%S")
+
+        if devname not in self.memory_checks:
+            self.memory_checks[devname] = SpyTestDict(
+                log=self.make_local_file_path(devname, "", "all.log", "memory_utilization"),
+                json=self.make_local_file_path(devname, "", "all.json", "memory_utilization"),
+                trend=self.make_local_file_path(devname, "", "trend.log", "memory_utilization"),
+                first=snapshot, prev=snapshot, history=[])
+            utils.write_file(self.memory_checks[devname].log, "")
+            utils.write_file(self.memory_checks[devname].json, "")
+        checks = self.memory_checks[devname]
+
+        # keep the compact part of every snapshot for the trend
+        meminfo = snapshot["meminfo"]
+        used = meminfo.get("MemTotal", 0) - meminfo.get("MemAvailable", 0)
+        checks.history.append([snapshot["phase"], used, snapshot["containers"]])
+
+        lines = ["", "================ {} {} =================".format(phase, name)]
+        lines.append(self._memory_report(snapshot, checks.prev, "previous snapshot"))
+        utils.write_file(checks.log, "\n".join(lines) + "\n", "a")
+        utils.write_file(checks.json, json.dumps(snapshot) + "\n", "a")
+        checks.prev = snapshot
+        utils.write_file(checks.trend, self._memory_trend(checks))
+
+    def _memory_report(self, snapshot, base, base_name, count=20):
+        meminfo, base_meminfo = snapshot["meminfo"], base["meminfo"]
+        used = meminfo.get("MemTotal", 0) - meminfo.get("MemAvailable", 0)
+        base_used = base_meminfo.get("MemTotal", 0) - base_meminfo.get("MemAvailable", 0)
+        lines = ["Memory: total {} MB used {} MB ({:+d} MB since {})".format(
+            meminfo.get("MemTotal", 0) // 1024, used // 1024, (used - base_used) // 1024, base_name)]
+
+        rows = []
+        for cname in sorted(snapshot["containers"]):
+            usage = snapshot["containers"][cname]
+            delta = usage - base["containers"].get(cname, usage)
+            rows.append([cname, "{:.1f}".format(usage / 1048576.0), "{:+.1f}".format(delta / 1048576.0)])
+        if rows:
+            lines.append(utils.sprint_vtable(["Container", "MB", "Delta MB"], rows))
+
+        def process_rows(keys):
+            rows = []
+            for key in keys:
+                pname, ppid, rss, cmdline = snapshot["processes"][key]
+                delta = rss - base["processes"].get(key, [None, None, rss])[2]
+                rows.append([key.split()[0], ppid, pname, "{:.1f}".format(rss / 1024.0),
+                             "{:+.1f}".format(delta / 1024.0), cmdline[:60]])
+            return rows
+        header = ["PID", "PPID", "Name", "RSS MB", "Delta MB", "Command"]
+        processes = snapshot["processes"]
+        top = sorted(processes, key=lambda k: processes[k][2], reverse=True)[:count]
+        lines.append("Top {} processes by RSS".format(count))
+        lines.append(utils.sprint_vtable(header, process_rows(top)))
+        common = [key for key in processes if key in base["processes"]]
+        growth = sorted(common, key=lambda k: processes[k][2] - base["processes"][k][2], reverse=True)
+        growth = [key for key in growth[:count] if processes[key][2] > base["processes"][key][2]]
+        if growth:
+            lines.append("Processes grown since {}".format(base_name))
+            lines.append(utils.sprint_vtable(header, process_rows(growth)))
+        return "\n".join(lines)
+
+    def _memory_trend(self, checks):
+        lines = ["Memory trend over {} snapshots".format(len(checks.history))]
+        rows = [[phase, "{:.1f}".format(used / 1024.0)] for phase, used, _ in checks.history]
+        lines.append(utils.sprint_vtable(["Phase", "Used MB"], rows))
+        rows = []
+        for cname in sorted(checks.prev["containers"]):
+            series = [containers[cname] for _, _, containers in checks.history if cname in containers]
+            rows.append([cname, "{:.1f}".format(series[0] / 1048576.0), "{:.1f}".format(series[-1] / 1048576.0),
+                         "{:.1f}".format(max(series) / 1048576.0), "{:+.1f}".format((series[-1] - series[0]) / 1048576.0)])
+        if rows:
+            lines.append(utils.sprint_vtable(["Container", "First MB", "Last MB", "Peak MB", "Growth MB"], rows))
+        lines.append(self._memory_report(checks.prev, checks.first, "first snapshot"))
+        return "\n".join(lines) + "\n"
+
+    def _get_syslog_regex(self, lvl):
+        syslog_levels = self.wa.syslog_levels
+        if lvl not in syslog_levels:
+            return None
+        if lvl not in self.syslog_regex:
+            index = syslog_levels.index(lvl)
+            needed = "|".join(syslog_levels[:index+1])
+            regex = r"^\S+\s+\d+\s+\d+:\d+:\d+(\.\d+){{0,1}}\s+\S+\s+({})\s+"
+            self.syslog_regex[lvl] = re.compile(regex.format(needed.upper()))
+        return self.syslog_regex[lvl]
 
     def do_syslog_checks(self, devname, phase, name):
         if self.cfg.syslog_check in ["none"]:
@@ -3271,13 +3500,13 @@ class Net(object):
             lvl = "none"
 
         output = self._apply_remote(devname, "syslog-check", [lvl, phase, name])
-        syslog_levels = self.wa.syslog_levels
-        if lvl in syslog_levels:
-            index = syslog_levels.index(lvl)
-            needed = "|".join(syslog_levels[:index+1])
-            regex = r"^\S+\s+\d+\s+\d+:\d+:\d+(\.\d+){{0,1}}\s+\S+\s+({})\s+"
-            cre = re.compile(regex.format(needed.upper()))
+        cre = self._get_syslog_regex(lvl)
+        if cre:
+            # the helper filters the messages and prints only the new ones as records
             for line in output.split("\n"):
+                if not line.startswith("SYSLOG-RECORD: "):
+                    continue
+                line = line[len("SYSLOG-RECORD: "):].strip()
                 if cre.search(line):
                     self.syslogs[devname].append([devname, msgtype, line])
 
@@ -3338,6 +3567,7 @@ class Net(object):
         if not file_list:
             return
         devname = self._check_devname(devname)
+        self._invalidate_applied_config(devname)
         for filepath in file_list:
             if isinstance(filepath, list):
                 val_list = [method]
@@ -3368,6 +3598,7 @@ class Net(object):
         :return:
         :rtype:
         """
+        self._invalidate_applied_config(self._check_devname(devname))
         val_list = [timeout, script_path]
         for arg in args:
             val_list.append(arg)
@@ -3412,6 +3643,7 @@ class Net(object):
 
     def exec_ssh(self, devname, username=None, password=None, cmdlist=[]):
         devname = self._check_devname(devname)
+        self._invalidate_applied_config(devname)
         access = self._get_dev_access(devname)
 
         if access["filemode"]:
@@ -3870,24 +4102,29 @@ class Net(object):
         self.rest[dut].reset_curr_pwd()
 
     def rest_create(self, dut, path, data, *args, **kwargs):
+        self._invalidate_applied_config(self._check_devname(dut))
         return self.rest[dut].post(path, data, *args, **kwargs)
 
     def rest_update(self, dut, path, data, *args, **kwargs):
+        self._invalidate_applied_config(self._check_devname(dut))
         return self.rest[dut].put(path, data, *args, **kwargs)
 
     def rest_modify(self, dut, path, data, *args, **kwargs):
+        self._invalidate_applied_config(self._check_devname(dut))
         return self.rest[dut].patch(path, data, *args, **kwargs)
 
     def rest_read(self, dut, path, *args, **kwargs):
         return self.rest[dut].get(path, *args, **kwargs)
 
     def rest_delete(self, dut, path, *args, **kwargs):
+        self._invalidate_applied_config(self._check_devname(dut))
         return self.rest[dut].delete(path, *args, **kwargs)
 
     def rest_parse(self, dut, filepath=None, all_sections=False, paths=[], **kwargs):
         return self.rest[dut].parse(filepath, all_sections, paths, **kwargs)
 
     def rest_apply(self, dut, data):
+        self._invalidate_applied_config(self._check_devname(dut))
         return self.rest[dut].apply(data)
 
     def get_credentials(self, dut):
@@ -4069,6 +4306,7 @@ class Net(object):
         devname = self._check_devname(devname)
         access = self._get_dev_access(devname)
         prompts = access["prompts"]
+        self._invalidate_applied_config(devname)
 
         if expect_mode in ["unknown-mode", "unknown-prompt"]:
             msg = "Unknown prompt/mode."
@@ -4143,6 +4381,7 @@ class Net(object):
 
     def exec_ssh_remote_dut(self, devname, ipaddress, username, password, command=None, timeout=30):
         devname = self._check_devname(devname)
+        self._invalidate_applied_config(devname)
         access = self._get_dev_access(devname)
 
         if access["filemode"]:
@@ -4176,6 +4415,7 @@ class Net(object):
 
     def run_uicli_script(self, devname, scriptname):
         devname = self._check_devname(devname)
+        self._invalidate_applied_config(devname)
         access = self._get_dev_access(devname)
 
         if access["filemode"]:
@@ -4733,6 +4973,7 @@ class Net(object):
 
     def run_uirest_script(self, devname, scriptname):
         devname = self._check_devname(devname)
+        self._invalidate_applied_config(devname)
         access = self._get_dev_access(devname)
 
         if access["filemode"]:
@@ -4995,6 +5236,7 @@ class Net(object):
 
     def run_uignmi_script(self, devname, scriptname, **kwargs):
         devname = self._check_devname(devname)
+        self._invalidate_applied_config(devname)
         access = self._get_dev_access(devname)
 
         if access["filemode"]:
@@ -5482,6 +5724,7 @@ class Net(object):
         return command
 
     def gnmi_apply(self, devname, config_step, **kwargs):
+        self._invalidate_applied_config(self._check_devname(devname))
         operation = config_step["operation"]
         if operation == "patch":
             action = "set"
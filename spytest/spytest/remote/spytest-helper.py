@@ -8,6 +8,7 @@ Please be sure before changing the file.
 
 import os
 import re
+import sys
 import glob
 import json
 import socket
@@ -767,17 +768,79 @@ def read_messages(file_path, all_file, var_file, our_file):
     retval = execute_check_cmd("wc -l {}".format(our_file))
     write_offset(file_path, retval, offset)
 
-def syslog_read_msgs(lvl, phase):
+def read_cursor(file_path):
+    lines = read_lines(file_path, [])
+    try:
+        (inode, offset) = [int(value) for value in lines[0].split()[:2]]
+    except:
+        (inode, offset) = (0, 0)
+    return (inode, offset)
+
+def write_cursor(file_path, inode, offset):
+    with open(file_path, "w") as outfile:
+        outfile.write("{} {}".format(inode, offset))
+
+def scan_lines(file_path, offset, regex, out):
+    """
+    Print the complete lines of the file after the offset which match the regex.
+    :return: offset after the last complete line
+    """
+    pending = b""
+    with open(file_path, "rb") as infile:
+        infile.seek(offset)
+        while True:
+            chunk = infile.read(1024 * 1024)
+            if not chunk:
+                break
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
+            offset = offset + len(chunk)
+            for line in lines:
+                if regex.match(line):
+                    out.write(b"SYSLOG-RECORD: " + line + b"\n")
+    # a partially written line is read next time
+    return offset - len(pending)
+
+def syslog_read_msgs(lvl, phase, var_file="/var/log/syslog"):
+    """
+    Print the new syslog messages of the given level and the more severe ones.
+    The position read up to is kept in the cursor file as the inode and the byte offset,
+    so only the messages added since the previous call are read, even after the log rotation.
+    """
     if phase: execute_check_cmd("sudo echo {}".format(phase))
-    file_path = "{}/syslog.offset".format(spytest_dir)
-    var_file = "/var/log/syslog"
-    our_file = "{}/syslog.txt".format(spytest_dir)
-    read_messages(file_path, var_file, var_file, our_file)
-    if lvl != "none" and lvl in syslog_levels:
+    cursor_file = "{}/syslog.cursor".format(spytest_dir)
+    (inode, offset) = read_cursor(cursor_file)
+    try:
+        stat = os.stat(var_file)
+    except OSError:
+        print("SYSLOG-CURSOR: {} is missing".format(var_file))
+        return
+
+    # files to read from the given offsets
+    if stat.st_ino == inode and stat.st_size >= offset:
+        files = [(var_file, offset)]
+    else:
+        files = [(var_file, 0)]
+        rotated = "{}.1".format(var_file)
+        if inode and os.path.exists(rotated) and os.stat(rotated).st_ino == inode:
+            files.insert(0, (rotated, offset))
+
+    if lvl == "none" or lvl not in syslog_levels:
+        # the messages are not needed, just move the cursor to the end
+        offset = stat.st_size
+    else:
         index = syslog_levels.index(lvl)
         needed = "|".join(syslog_levels[:index+1])
-        cmd = r"""grep -E "^\S+\s+[0-9]+\s+[0-9]+:[0-9]+:[0-9]+(\.[0-9]+){{0,1}}\s+\S+\s+({})" {}"""
-        execute_check_cmd(cmd.format(needed.upper(), our_file), False, True)
+        regex = r"^\S+\s+[0-9]+\s+[0-9]+:[0-9]+:[0-9]+(\.[0-9]+){{0,1}}\s+\S+\s+({})\s+"
+        regex = re.compile(regex.format(needed.upper()).encode())
+        out = getattr(sys.stdout, "buffer", sys.stdout)
+        sys.stdout.flush()
+        for file_path, file_offset in files:
+            offset = scan_lines(file_path, file_offset, regex, out)
+        out.flush()
+
+    write_cursor(cursor_file, stat.st_ino, offset)
+    print("SYSLOG-CURSOR: {} {}".format(stat.st_ino, offset))
 
 def do_sairedis(op):
     if op == "clean":
@@ -792,6 +855,59 @@ def do_sairedis(op):
     if op == "read":
         print("SAI-REDIS-FILE: /etc/spytest/sairedis.txt")
 
+def read_cgroup_memory(container_id):
+    # docker stats reports the usage without the page cache
+    # cgroupfs and systemd drivers of cgroup v1, then cgroup v2
+    for path in ["/sys/fs/cgroup/memory/docker/{}".format(container_id),
+                 "/sys/fs/cgroup/memory/system.slice/docker-{}.scope".format(container_id),
+                 "/sys/fs/cgroup/system.slice/docker-{}.scope".format(container_id)]:
+        usage = read_lines(path + "/memory.usage_in_bytes", []) or \
+                read_lines(path + "/memory.current", [])
+        if not usage:
+            continue
+        stat = dict([line.split() for line in read_lines(path + "/memory.stat", [])])
+        cache = stat.get("total_inactive_file", stat.get("inactive_file", 0))
+        return int(usage[0]) - int(cache)
+    return None
+
+def memory_snapshot():
+    """
+    Print the memory usage of the system, of every process and of every docker container
+    as one json record. Values are read from /proc and from the memory cgroups
+    instead of running docker stats, top, pstree and free.
+    """
+    snapshot = {"meminfo": {}, "processes": {}, "containers": {}}
+    for line in read_lines("/proc/meminfo", []):
+        parts = line.split()
+        snapshot["meminfo"][parts[0].rstrip(":")] = int(parts[1])
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        status = {}
+        for line in read_lines("/proc/{}/status".format(pid), []):
+            name, _, value = line.partition(":")
+            status[name] = value.strip()
+        # kernel threads have no memory of their own
+        if "VmRSS" not in status:
+            continue
+        cmdline = read_lines("/proc/{}/cmdline".format(pid), [""])
+        cmdline = " ".join(cmdline).replace("\0", " ").strip()
+        snapshot["processes"][pid] = [status["Name"], int(status["PPid"]),
+                                      int(status["VmRSS"].split()[0]), cmdline[:120]]
+    try:
+        cmd = "docker ps --no-trunc --format '{{.ID}} {{.Names}}'"
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
+        output = proc.communicate()[0]
+    except:
+        output = ""
+    for line in output.split("\n"):
+        parts = line.split()
+        if len(parts) == 2:
+            usage = read_cgroup_memory(parts[0])
+            if usage is not None:
+                snapshot["containers"][parts[1]] = usage
+    print("MEMORY-SNAPSHOT: {}".format(json.dumps(snapshot)))
+
 def invalid_ip(addr):
     try:
         socket.inet_aton(addr)
@@ -936,6 +1052,8 @@ if __name__ == "__main__":
     parser.add_argument("--syslog-check", action="store", default=None,
             choices=syslog_levels,
             help="read syslog messages of given level and clear all syslog messages.")
+    parser.add_argument("--memory-snapshot", action="store_true", default=False,
+            help="print memory usage of the system, processes and containers as json.")
     parser.add_argument("--phase", action="store", default=None,
             help="phase for checks.")
     parser.add_argument("--sairedis", action="store", default="none",
@@ -1021,6 +1139,8 @@ if __name__ == "__main__":
         enable_disable_debug(False)
     elif args.syslog_check:
         syslog_read_msgs(args.syslog_check, args.phase)
+    elif args.memory_snapshot:
+        memory_snapshot()
     elif args.sairedis != "none":
         do_sairedis(args.sairedis)
     elif args.execute_from_file:
@@ -2,12 +2,14 @@ import os
 import re
 import sys
 import csv
+import gzip
 import time
 import base64
 import random
 import socket
 import string
 import struct
+import shutil
 import hashlib
 import textwrap
 import datetime
@@ -250,14 +252,20 @@ def md5(fname):
     return hash_md5.hexdigest()
 
 def b64encode(file_path):
-    fh = open_file(file_path)
-    text = fh.read()
-    encoded_data = base64.b64encode(text)
+    with open(file_path, "rb") as fh:
+        encoded_data = base64.b64encode(fh.read()).decode("ascii")
     retval = []
-    for i in xrange((len(encoded_data) / 76) + 1):
+    for i in range((len(encoded_data) // 76) + 1):
         retval.append(encoded_data[i * 76:(i + 1) * 76])
     return retval
 
+def gzip_file(file_path, dst_path=None):
+    dst_path = dst_path or "{}.gz".format(file_path)
+    with open(file_path, "rb") as src:
+        with gzip.open(dst_path, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+    return dst_path
+
 ######################## to be removed after refactoring ####################
 ######################## to be removed after refactoring ####################
 class ExecAllFunc(object):
@@ -3,11 +3,15 @@ import sys
 import time
 import traceback
 import threading
+from collections import deque
 import utilities.common as utils
 
 # change this to 1 to force single entry thread calls
 min_items = 2
 
+# maximum number of worker threads kept for the parallel calls
+max_workers = 32
+
 shutting_down = False
 def set_shutting_down():
     global shutting_down
@@ -34,6 +38,76 @@ def wait_for_threads(threads):
         if not alive or shutting_down:
             break
 
+class _Task(object):
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.done = threading.Event()
+
+    def run(self):
+        try:
+            self.func(*self.args, **self.kwargs)
+        finally:
+            self.done.set()
+
+class WorkerPool(object):
+    """
+    Worker threads shared by all the parallel calls.
+    The threads are created on demand up to max_workers and reused,
+    the callers wait for the completion of their own tasks only.
+    """
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.tasks = deque()
+        self.workers = set()
+        self.idle = 0
+
+    def submit(self, func, args=(), kwargs={}):
+        task = _Task(func, args, kwargs)
+        with self.cond:
+            self.tasks.append(task)
+            if len(self.tasks) > self.idle and len(self.workers) < max_workers:
+                worker = threading.Thread(target=self._worker)
+                worker.daemon = True
+                self.workers.add(worker)
+                worker.start()
+            else:
+                self.cond.notify()
+        return task
+
+    def wait(self, tasks):
+        # a worker waiting for nested calls runs the tasks not started yet
+        # itself, so that the nested calls can't starve for the workers
+        nested = threading.current_thread() in self.workers
+        for task in tasks:
+            if nested:
+                with self.cond:
+                    queued = task in self.tasks
+                    if queued:
+                        self.tasks.remove(task)
+                if queued:
+                    task.run()
+                    continue
+            while not task.done.wait(1):
+                if shutting_down:
+                    return
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                self.idle = self.idle + 1
+                while not self.tasks:
+                    self.cond.wait()
+                self.idle = self.idle - 1
+                task = self.tasks.popleft()
+            try:
+                task.run()
+            except BaseException:
+                traceback.print_exc()
+
+pool = WorkerPool()
+
 def exec_foreach (use_threads, items, func, *args, **kwargs):
     set_in_parallel(True)
     retvals = list()
@@ -49,7 +123,7 @@ def exec_foreach (use_threads, items, func, *args, **kwargs):
             retvals[index] = None
             exceptions[index] = e2
 
-    threads = list()
+    tasks = list()
     args_list = list(args)
     args_list.insert(0, "")
     args_list.insert(0, retvals)
@@ -64,10 +138,8 @@ def exec_foreach (use_threads, items, func, *args, **kwargs):
         if not use_threads or len(items) < min_items:
             _thread_func(*args, **kwargs)
         else:
-            x = threading.Thread(target=_thread_func, args=args, kwargs=kwargs)
-            threads.append(x)
-            x.start()
-    wait_for_threads(threads)
+            tasks.append(pool.submit(_thread_func, args, kwargs))
+    pool.wait(tasks)
     set_in_parallel(False)
     for exp in exceptions:
         if isinstance(exp, SystemExit):
@@ -102,7 +174,7 @@ def exec_all(use_threads, entries, first_on_main=False):
 
     f_args = None
     f_kwargs = {}
-    threads = list()
+    tasks = list()
     index = 0
     for entry in entries:
         if isinstance(entry, utils.ExecAllFunc):
@@ -123,12 +195,10 @@ def exec_all(use_threads, entries, first_on_main=False):
         elif not use_threads or len(entries) < min_items:
             _thread_func(*args, **kwargs)
         else:
-            x = threading.Thread(target=_thread_func, args=args, kwargs=kwargs)
-            threads.append(x)
-            x.start()
+            tasks.append(pool.submit(_thread_func, args, kwargs))
     if first_on_main:
         _thread_func(*f_args, **f_kwargs)
-    wait_for_threads(threads)
+    pool.wait(tasks)
     set_in_parallel(False)
     for exp in exceptions:
         if isinstance(exp, SystemExit):
@@ -160,7 +230,7 @@ def exec_parallel(use_threads, items, func, kwarg_list,*args):
         except SystemExit as e2:
             retvals[index] = None
             exceptions[index] = e2
-    threads = list()
+    tasks = list()
     args_list = list(args)
     args_list.insert(0, "")
     args_list.insert(0, retvals)
@@ -175,10 +245,8 @@ def exec_parallel(use_threads, items, func, kwarg_list,*args):
         if not use_threads or len(items) < min_items:
             _thread_func(*args, **kwargs)
         else:
-            x = threading.Thread(target=_thread_func, args=args, kwargs=kwargs)
-            threads.append(x)
-            x.start()
-    wait_for_threads(threads)
+            tasks.append(pool.submit(_thread_func, args, kwargs))
+    pool.wait(tasks)
     set_in_parallel(False)
     for exp in exceptions:
         if isinstance(exp, SystemExit):
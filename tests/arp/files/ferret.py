@@ -11,12 +11,15 @@ import BaseHTTPServer
 import time
 import socket
 import ctypes
+import ctypes.util
+import errno
 import ssl
 import struct
 import binascii
 import itertools
 import argparse
 import os
+import multiprocessing
 
 from pprint import pprint
 
@@ -25,20 +28,25 @@ from functools import partial
 from collections import namedtuple
 
 
-Record = namedtuple('Record', ['hostname', 'family', 'expired', 'lo', 'mac', 'vxlan_id'])
+Record = namedtuple('Record', ['hostname', 'family', 'expired', 'lo', 'mac', 'vxlan_id', 'template'])
 
 ASIC_TYPE=None
 
 
 class Ferret(BaseHTTPServer.BaseHTTPRequestHandler):
     server_version = "FerretHTTP/0.1"
+    subscribers = []
 
     def do_POST(self):
         if not self.path.startswith('/Ferret/NeighborAdvertiser/Slices/'):
             self.send_error(404, "URL is not supported")
         else:
             info = self.extract_info()
-            self.update_db(info)
+            try:
+                self.update_db(info)
+            except (IOError, OSError, EOFError) as e:
+                self.send_error(500, "Can't update the workers: %s" % e)
+                return
             self.send_resp(info)
 
     def extract_info(self):
@@ -48,15 +56,22 @@ class Ferret(BaseHTTPServer.BaseHTTPRequestHandler):
         return j
 
     def generate_entries(self, hostname, family, expire, lo, info, mapping_family):
+        updates = {}
         for i in info['vlanInterfaces']:
             vxlan_id = int(i['vxlanId'])
             for j in i[mapping_family]:
                 mac = str(j['macAddr']).replace(':', '')
                 addr = str(j['ipAddr'])
-                r = Record(hostname=hostname, family=family, expired=expire, lo=lo, mac=mac, vxlan_id=vxlan_id)
-                self.db[addr] = r
+                if family == 'ipv4':
+                    key = socket.inet_aton(addr)
+                    template = Responder.generate_template(binascii.unhexlify(mac), key, vxlan_id)
+                else:
+                    key = socket.inet_pton(socket.AF_INET6, addr)
+                    template = None
+                r = Record(hostname=hostname, family=family, expired=expire, lo=lo, mac=mac, vxlan_id=vxlan_id, template=template)
+                updates[key] = r
 
-        return
+        return updates
 
     def update_db(self, info):
         hostname = str(info['switchInfo']['name'])
@@ -65,8 +80,12 @@ class Ferret(BaseHTTPServer.BaseHTTPRequestHandler):
         duration = int(info['respondingSchemes']['durationInSec'])
         expired  = time.time() + duration
 
-        self.generate_entries(hostname, 'ipv4', expired, lo_ipv4, info, 'ipv4AddrMappings')
-        self.generate_entries(hostname, 'ipv6', expired, lo_ipv6, info, 'ipv6AddrMappings')
+        updates = self.generate_entries(hostname, 'ipv4', expired, lo_ipv4, info, 'ipv4AddrMappings')
+        updates.update(self.generate_entries(hostname, 'ipv6', expired, lo_ipv6, info, 'ipv6AddrMappings'))
+
+        self.db.update(updates)
+        for worker in self.subscribers:
+            worker.send(updates, self.db)
 
         return
 
@@ -95,7 +114,7 @@ class Ferret(BaseHTTPServer.BaseHTTPRequestHandler):
 class RestAPI(object):
     PORT = 448
 
-    def __init__(self, obj, db, src_ip):
+    def __init__(self, obj, db, src_ip, subscribers=None):
         self.httpd = SocketServer.TCPServer(("", self.PORT), obj)
         self.context = ssl.SSLContext(ssl.PROTOCOL_TLS)
         self.context.verify_mode = ssl.CERT_NONE
@@ -105,6 +124,7 @@ class RestAPI(object):
         self.db = db
         obj.db = db
         obj.src_ip = src_ip
+        obj.subscribers = subscribers if subscribers is not None else []
 
     def handler(self):
         return self.httpd.fileno()
@@ -113,11 +133,39 @@ class RestAPI(object):
         return self.httpd.handle_request()
 
 
+class iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+
+class msghdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_name', ctypes.c_void_p),
+        ('msg_namelen', ctypes.c_uint32),
+        ('msg_iov', ctypes.POINTER(iovec)),
+        ('msg_iovlen', ctypes.c_size_t),
+        ('msg_control', ctypes.c_void_p),
+        ('msg_controllen', ctypes.c_size_t),
+        ('msg_flags', ctypes.c_int),
+    ]
+
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', msghdr), ('msg_len', ctypes.c_uint)]
+
+
+libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+if hasattr(libc, 'recvmmsg'):
+    libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    libc.recvmmsg.restype = ctypes.c_int
+
+
 class Interface(object):
     ETH_P_ALL = 0x03
     RCV_TIMEOUT = 1000
     RCV_SIZE = 4096
+    RCV_BATCH = 64
     SO_ATTACH_FILTER = 26
+    MSG_DONTWAIT = 0x40
 
     def __init__(self, iface, bpf_src):
         self.iface = iface
@@ -129,152 +177,185 @@ class Interface(object):
             self.socket.setsockopt(socket.SOL_SOCKET, self.SO_ATTACH_FILTER, bpf)
         self.socket.bind((self.iface, 0))
         self.socket.settimeout(self.RCV_TIMEOUT)
+        self.init_batch()
 
     def __del__(self):
         self.socket.close()
 
+    def init_batch(self):
+        self.buffers = [ctypes.create_string_buffer(self.RCV_SIZE) for _ in range(self.RCV_BATCH)]
+        self.iovecs = (iovec * self.RCV_BATCH)()
+        self.msgs = (mmsghdr * self.RCV_BATCH)()
+        for buf, iov, msg in zip(self.buffers, self.iovecs, self.msgs):
+            iov.iov_base = ctypes.addressof(buf)
+            iov.iov_len = self.RCV_SIZE
+            msg.msg_hdr.msg_iov = ctypes.pointer(iov)
+            msg.msg_hdr.msg_iovlen = 1
+
     def handler(self):
         return self.socket.fileno()
 
     def recv(self):
         return self.socket.recv(self.RCV_SIZE)
 
+    def recv_batch(self):
+        """ Returns all the frames queued on the socket, up to RCV_BATCH frames per system call """
+        if not hasattr(libc, 'recvmmsg'):
+            return [self.recv()]
+
+        n = libc.recvmmsg(self.socket.fileno(), self.msgs, self.RCV_BATCH, self.MSG_DONTWAIT, None)
+        if n < 0:
+            err = ctypes.get_errno()
+            if err in (errno.EAGAIN, errno.EINTR):
+                return []
+            raise OSError(err, os.strerror(err))
+
+        return [ctypes.string_at(self.buffers[i], self.msgs[i].msg_len) for i in range(n)]
+
     def send(self, data):
         self.socket.send(data)
 
 
 class Poller(object):
-    def __init__(self, httpd, interfaces, responder):
+    def __init__(self, httpd, interfaces, responder, updates=None):
         self.responder = responder
         self.mapping = {interface.handler(): interface for interface in interfaces}
         self.httpd = httpd
+        self.updates = updates
+        self.epoll = select.epoll()
+        for handler in self.mapping.keys():
+            self.epoll.register(handler, select.EPOLLIN)
+        if self.httpd is not None:
+            self.epoll.register(self.httpd.handler(), select.EPOLLIN)
+        if self.updates is not None:
+            self.epoll.register(self.updates.fileno(), select.EPOLLIN)
 
     def poll(self):
-        handlers = self.mapping.keys() + [self.httpd.handler()]
         while True:
-            (rdlist, _, _) = select.select(handlers, [], [])
-            for handler in rdlist:
-                if handler == self.httpd.handler():
-                    self.httpd.handle()
-                else:
+            try:
+                events = self.epoll.poll()
+            except IOError as e:
+                if e.errno != errno.EINTR:
+                    raise
+                continue
+            for handler, _ in events:
+                if handler in self.mapping:
                     self.responder.action(self.mapping[handler])
+                elif self.updates is not None and handler == self.updates.fileno():
+                    self.responder.db.update(self.updates.recv())
+                else:
+                    self.httpd.handle()
 
 
 class Responder(object):
     ARP_PKT_LEN = 60
     ARP_OP_REQUEST = 1
+    ARP_CHUNK = binascii.unhexlify('08060001080006040002') # defines a part of the packet for ARP Reply
+    ARP_PAD = binascii.unhexlify('00' * 18)
+    IPV4_HDR = binascii.unhexlify('45000060977e400040110000')
+    UDP_HDR = binascii.unhexlify('c00012b5004c1280')
+    # Sum of the constant 16-bit words of the outer IPv4 header. Addresses are added per packet
+    IPV4_HDR_CSUM = sum(struct.unpack('!6H', IPV4_HDR))
+    # Offsets inside of the reply: outer eth(14) + ipv4(20) + udp(8) + vxlan(8) + inner arp reply(60)
+    REPLY_IP_CSUM = 0x18
+    REPLY_IP_SRC = 0x1a
+    REPLY_INNER = 0x32
     def __init__(self, db):
-        self.arp_chunk = binascii.unhexlify('08060001080006040002') # defines a part of the packet for ARP Reply
-        self.arp_pad = binascii.unhexlify('00' * 18)
         self.db = db
 
     def hexdump(self, data):
         print " ".join("%02x" % ord(d) for d in data)
 
     def action(self, interface):
-        data = interface.recv()
+        for data in interface.recv_batch():
+            new_pkt = self.process(data)
+            if new_pkt is not None:
+                interface.send(new_pkt)
 
-        ext_dst_mac  = data[0x00:0x06]
-        ext_src_mac  = data[0x06:0x0c]
+        return
+
+    def process(self, data):
         ext_eth_type = data[0x0c:0x0e]
-        if ext_eth_type != binascii.unhexlify('0800'):
+        if ext_eth_type != '\x08\x00':
             print "Not 0x800 eth type"
             self.hexdump(data)
             print
-            return
-        src_ip = data[0x001a:0x001e]
-        dst_ip = data[0x1e:0x22]
-        gre_flags = data[0x22:0x24]
-        gre_type  = data[0x24:0x26]
+            return None
 
-        gre_type_r = struct.unpack('!H', gre_type)[0]
-        self.hexdump(data)
-        if gre_type_r == 0x88be:   # Broadcom
-            arp_request = data[0x26:]
+        gre_type = data[0x24:0x26]
+        if gre_type == '\x88\xbe':   # Broadcom
+            arp_offset = 0x26
             if ASIC_TYPE == "barefoot":
                 # ERSPAN type 2
                 # Ethernet(14) + IP(20) + GRE(4) + ERSPAN(8) = 46 = 0x2e
                 # Note: Count GRE as 4 byte, only mandatory fields.
                 # References: https://tools.ietf.org/html/rfc1701
                 #             https://tools.ietf.org/html/draft-foschiano-erspan-00
-                arp_request = data[0x2E:]
-
-        elif gre_type_r == 0x8949: # Mellanox
-            arp_request = data[0x3c:]
+                arp_offset = 0x2e
+        elif gre_type == '\x89\x49': # Mellanox
+            arp_offset = 0x3c
         else:
-            print "GRE type 0x%x is not supported" % gre_type_r
+            print "GRE type 0x%x is not supported" % struct.unpack('!H', gre_type)[0]
             self.hexdump(data)
             print
-            return
+            return None
 
-        if len(arp_request) > self.ARP_PKT_LEN:
+        if len(data) - arp_offset > self.ARP_PKT_LEN:
             print "Too long packet"
             self.hexdump(data)
             print
-            return
+            return None
 
-        remote_mac, remote_ip, request_ip, op_type = self.extract_arp_info(arp_request)
         # Don't send ARP response if the ARP op code is not request
-        if op_type != self.ARP_OP_REQUEST:
-            return
-
-        request_ip_str = socket.inet_ntoa(request_ip)
+        if data[arp_offset + 20:arp_offset + 22] != '\x00\x01':
+            return None
 
-        if request_ip_str not in self.db:
+        request_ip = data[arp_offset + 38:arp_offset + 42]
+        r = self.db.get(request_ip)
+        if r is None:
             print "Not in db"
-            return
+            return None
 
-        r = self.db[request_ip_str]
         if r.expired < time.time():
             print "Expired row in db"
-            del self.db[request_ip_str]
-            return
-
-        if r.family == 'ipv4':
-            new_pkt  = ext_src_mac + ext_dst_mac + ext_eth_type # outer eth frame
-            ipv4 = binascii.unhexlify('45000060977e400040110000') + dst_ip + src_ip # ip
-            crc = self.calculate_header_crc(ipv4)
-            ipv4 = ipv4[0:10] + crc + ipv4[12:]
-            new_pkt += ipv4
-            new_pkt += binascii.unhexlify('c00012b5004c1280')              # udp
-            new_pkt += binascii.unhexlify('08000000%06x00' % r.vxlan_id) # vxlan
-
-            arp_reply = self.generate_arp_reply(binascii.unhexlify(r.mac), remote_mac, request_ip, remote_ip)
-            new_pkt += arp_reply
-        else:
-            print 'Support of family %s is not implemented' % r.family
-            return
-
-        interface.send(new_pkt)
-
-        return
-
-    def calculate_header_crc(self, ipv4):
-        s = 0
-        for l,r in zip(ipv4[::2], ipv4[1::2]):
-            l_u = struct.unpack("B", l)[0]
-            r_u = struct.unpack("B", r)[0]
-            s += (l_u << 8) + r_u
-
-        c = s >> 16
-        s = s & 0xffff
-
-        while c != 0:
-            s += c
-            c = s >> 16
-            s = s & 0xffff
-
-        s = 0xffff - s
+            del self.db[request_ip]
+            return None
 
-        return binascii.unhexlify("%x" % s)
-
-    def extract_arp_info(self, data):
-        # remote_mac, remote_ip, request_ip, op_type
-        return data[6:12], data[28:32], data[38:42], (ord(data[20]) * 256 + ord(data[21]))
+        if r.family != 'ipv4':
+            print 'Support of family %s is not implemented' % r.family
+            return None
 
-    def generate_arp_reply(self, local_mac, remote_mac, local_ip, remote_ip):
-        eth_hdr = remote_mac + local_mac
-        return eth_hdr + self.arp_chunk + local_mac + local_ip + remote_mac + remote_ip + self.arp_pad
+        # Outer headers are the received ones with swapped addresses, the inner ARP reply comes from the template
+        src_ip = data[0x1a:0x1e]
+        dst_ip = data[0x1e:0x22]
+        new_pkt = bytearray(r.template)
+        new_pkt[0x00:0x06] = data[0x06:0x0c]
+        new_pkt[0x06:0x0c] = data[0x00:0x06]
+        new_pkt[self.REPLY_IP_SRC:self.REPLY_IP_SRC + 8] = dst_ip + src_ip
+        new_pkt[self.REPLY_IP_CSUM:self.REPLY_IP_CSUM + 2] = self.calculate_header_crc(dst_ip + src_ip, self.IPV4_HDR_CSUM)
+        remote_mac = data[arp_offset + 6:arp_offset + 12]
+        remote_ip = data[arp_offset + 28:arp_offset + 32]
+        new_pkt[self.REPLY_INNER:self.REPLY_INNER + 6] = remote_mac
+        new_pkt[self.REPLY_INNER + 32:self.REPLY_INNER + 42] = remote_mac + remote_ip
+
+        return str(new_pkt)
+
+    @classmethod
+    def generate_template(cls, local_mac, local_ip, vxlan_id):
+        new_pkt  = '\x00' * 12 + '\x08\x00'                            # outer eth frame
+        new_pkt += cls.IPV4_HDR + '\x00' * 8                           # ip
+        new_pkt += cls.UDP_HDR                                         # udp
+        new_pkt += binascii.unhexlify('08000000%06x00' % vxlan_id)     # vxlan
+        new_pkt += '\x00' * 6 + local_mac + cls.ARP_CHUNK + local_mac + local_ip + '\x00' * 10 + cls.ARP_PAD
+
+        return new_pkt
+
+    def calculate_header_crc(self, ipv4, s=0):
+        s += sum(struct.unpack('!%dH' % (len(ipv4) / 2), ipv4))
+        while s >> 16:
+            s = (s & 0xffff) + (s >> 16)
+
+        return struct.pack('!H', 0xffff - s)
 
 def get_bpf_for_bgp():
     bpf_src = [
@@ -310,6 +391,7 @@ def parse_args():
     parser.add_argument('-f', '--config-file', help='file with configuration', required=True)
     parser.add_argument('-s', '--src-ip', help='Ferret endpoint ip', required=True)
     parser.add_argument('-a', '--asic-type', help='ASIC vendor name', type=str, required=False)
+    parser.add_argument('-w', '--workers', help='number of processes the interfaces are sharded between', type=int, default=1)
     args = parser.parse_args()
     if not os.path.isfile(args.config_file):
         print "Can't open config file '%s'" % args.config_file
@@ -317,16 +399,59 @@ def parse_args():
 
     global ASIC_TYPE
     ASIC_TYPE = args.asic_type
-    return args.config_file, args.src_ip
+    return args.config_file, args.src_ip, args.workers
+
+def run_worker(iface_names, updates):
+    bpf_src = get_bpf_for_bgp()
+    ifaces = [Interface(iface_name, bpf_src) for iface_name in iface_names]
+    responder = Responder({})
+    p = Poller(None, ifaces, responder, updates)
+    p.poll()
+
+class Worker(object):
+    """
+    Child process answering ARP requests on a group of interfaces.
+    It gets the db updates from the parent over a pipe.
+    """
+    def __init__(self, iface_names):
+        self.iface_names = iface_names
+        self.start()
+
+    def start(self):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=run_worker, args=(self.iface_names, child_conn))
+        self.process.daemon = True
+        self.process.start()
+        # Only the child keeps its end open, so sending to a dead child fails instead of filling the pipe
+        child_conn.close()
+
+    def send(self, updates, db):
+        try:
+            self.conn.send(updates)
+        except (IOError, OSError, EOFError) as e:
+            print "Worker %d failed (%s), restarting it" % (self.process.pid, e)
+            self.conn.close()
+            if self.process.is_alive():
+                self.process.terminate()
+            self.process.join()
+            self.start()
+            # The new worker starts with an empty db
+            self.conn.send(db)
 
 def main():
     db = {}
 
-    config_file, src_ip = parse_args()
+    config_file, src_ip, workers = parse_args()
     iface_names = extract_iface_names(config_file)
-    rest = RestAPI(Ferret, db, src_ip)
+
+    # With several workers the interfaces are split between child processes,
+    # the parent serves the REST API and pushes the db updates to every child
+    groups = [iface_names[i::workers] for i in range(workers)]
+    subscribers = [Worker(group) for group in groups[1:] if group]
+
+    rest = RestAPI(Ferret, db, src_ip, subscribers)
     bpf_src = get_bpf_for_bgp()
-    ifaces = [Interface(iface_name, bpf_src) for iface_name in iface_names]
+    ifaces = [Interface(iface_name, bpf_src) for iface_name in groups[0]]
     responder = Responder(db)
     p = Poller(rest, ifaces, responder)
     p.poll()
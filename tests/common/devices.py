@@ -11,13 +11,175 @@ import logging
 import os
 import re
 import json
+import base64
+import uuid
 import ipaddress
-from multiprocessing.pool import ThreadPool
+import threading
+from multiprocessing import TimeoutError
 from datetime import datetime
 
 from errors import RunAnsibleModuleFail
 from errors import UnsupportedAnsibleModule
 
+# Upper bound of ansible modules run in background by all the hosts together
+MAX_ASYNC_MODULES = 16
+
+_async_slots = threading.BoundedSemaphore(MAX_ASYNC_MODULES)
+
+
+class AsyncModuleTask(object):
+    """
+    @summary: Handle of an ansible module running in background.
+
+    Every module runs in its own thread, which waits for one of the MAX_ASYNC_MODULES slots shared by all the
+    hosts. A terminated module gives its slot back at once, so modules hung on a host don't hold up the others.
+    """
+    def __init__(self, func):
+        self.func = func
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.holds_slot = False
+        self.terminated = False
+        self.value = None
+        self.error = None
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+
+    def run(self):
+        _async_slots.acquire()
+        with self.lock:
+            if self.terminated:
+                _async_slots.release()
+                return
+            self.holds_slot = True
+        try:
+            self.value = self.func()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.release_slot()
+            self.done.set()
+
+    def release_slot(self):
+        with self.lock:
+            if self.holds_slot:
+                self.holds_slot = False
+                _async_slots.release()
+
+    def is_alive(self):
+        return not self.terminated and not self.done.is_set()
+
+    def terminate(self):
+        """
+        @summary: A running module can't be interrupted, so it is left to finish in background outside of the
+        slots and its result is dropped. A module which is still waiting for a slot is not run.
+        AsyncModuleResult.get() doesn't wait for a terminated module.
+        """
+        if not self.done.is_set():
+            logging.debug("Dropping result of the running ansible module")
+            self.terminated = True
+            self.release_slot()
+
+
+class AsyncModuleResult(object):
+    """
+    @summary: Result of an ansible module running in background.
+    """
+    def __init__(self, task):
+        self.task = task
+
+    def ready(self):
+        return self.task.terminated or self.task.done.is_set()
+
+    def get(self, timeout=None):
+        """
+        @summary: Wait for the module and return its result. The result of a terminated module is a failure.
+        """
+        if self.task.terminated and not self.task.done.is_set():
+            return {'failed': True, 'msg': 'ansible module was terminated'}
+        if not self.task.done.wait(timeout):
+            raise TimeoutError("ansible module is still running")
+        if self.task.error is not None:
+            raise self.task.error
+        return self.task.value
+
+
+class BatchResult(dict):
+    """
+    @summary: Result of a command queued by AnsibleHostBase.batch. It is filled when the batch exits.
+    """
+    pass
+
+
+class CommandBatch(object):
+    """
+    @summary: Collects shell commands and runs them on the host in one remote script.
+
+    Each command runs in its own subshell, its stdout, stderr and exit code are collected separately and returned
+    framed with base64, so the results are the same as if the commands were run one by one with the shell module.
+    """
+    def __init__(self, host, module_ignore_errors=False):
+        self.host = host
+        self.module_ignore_errors = module_ignore_errors
+        self.commands = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.run()
+        return False
+
+    def shell(self, cmd, module_ignore_errors=None):
+        result = BatchResult(cmd=cmd)
+        ignore_errors = self.module_ignore_errors if module_ignore_errors is None else module_ignore_errors
+        self.commands.append((cmd, ignore_errors, result))
+        return result
+
+    command = shell
+
+    def _script(self, marker):
+        lines = ['d=$(mktemp -d)']
+        for i, (cmd, _, _) in enumerate(self.commands):
+            # The command is on its own lines, so a trailing comment or here-doc doesn't swallow the ')'
+            lines.append('(\n%s\n) >"$d/out" 2>"$d/err" </dev/null; rc=$?' % cmd)
+            lines.append('echo "%s %d $rc"; base64 -w0 "$d/out"; echo; base64 -w0 "$d/err"; echo' % (marker, i))
+        lines.append('rm -rf "$d"')
+        return '\n'.join(lines)
+
+    def run(self):
+        if not self.commands:
+            return
+        marker = 'BATCH-{}'.format(uuid.uuid4().hex)
+        res = self.host.shell(self._script(marker), module_ignore_errors=True)
+        # Empty outputs of the last command are stripped from the module's stdout, pad them back
+        lines = res['stdout'].split('\n') + ['', '']
+        failed = []
+        for i in range(len(lines)):
+            if not lines[i].startswith(marker):
+                continue
+            _, index, rc = lines[i].split()
+            cmd, ignore_errors, result = self.commands[int(index)]
+            stdout = base64.b64decode(lines[i + 1]).rstrip('\n')
+            stderr = base64.b64decode(lines[i + 2]).rstrip('\n')
+            result.update({
+                'rc': int(rc),
+                'stdout': stdout,
+                'stderr': stderr,
+                'stdout_lines': stdout.splitlines(),
+                'stderr_lines': stderr.splitlines(),
+                'failed': int(rc) != 0,
+            })
+            if result['failed'] and not ignore_errors:
+                failed.append(result)
+        if len([result for _, _, result in self.commands if 'rc' in result]) != len(self.commands):
+            raise RunAnsibleModuleFail("batch of {} commands failed".format(len(self.commands)), res)
+        if failed:
+            raise RunAnsibleModuleFail("run batched command '{}' failed".format(failed[0]['cmd']), failed[0])
+
+
 class AnsibleHostBase(object):
     """
     @summary: The base class for various objects.
@@ -52,11 +214,11 @@ class AnsibleHostBase(object):
         module_async = complex_args.pop('module_async', False)
 
         if module_async:
-            def run_module(module_args, complex_args):
-                return self.module(*module_args, **complex_args)[self.hostname]
-            pool = ThreadPool()
-            result = pool.apply_async(run_module, (module_args, complex_args))
-            return pool, result
+            module = self.module
+            def run_module():
+                return module(*module_args, **complex_args)[self.hostname]
+            task = AsyncModuleTask(run_module)
+            return task, AsyncModuleResult(task)
 
         res = self.module(*module_args, **complex_args)[self.hostname]
         if res.is_failed and not module_ignore_errors:
@@ -64,6 +226,24 @@ class AnsibleHostBase(object):
 
         return res
 
+    def batch(self, module_ignore_errors=False):
+        """
+        @summary: Queue shell commands and run them on the host in one remote call.
+
+        Usage:
+            with duthost.batch() as batch:
+                uptime = batch.shell("uptime")
+                routes = batch.shell("ip route show", module_ignore_errors=True)
+            logging.info(uptime["stdout"])
+
+        The results are dicts with the same 'rc', 'stdout', 'stderr', 'stdout_lines' and 'stderr_lines' keys as
+        the shell module returns. They are filled when the 'with' block exits. RunAnsibleModuleFail is raised then
+        for the first failed command, unless errors are ignored for it.
+
+        @param module_ignore_errors: Default for the queued commands.
+        """
+        return CommandBatch(self, module_ignore_errors)
+
 
 class Localhost(AnsibleHostBase):
     """
@@ -295,6 +475,23 @@ class SonicHost(AnsibleHostBase):
 
         return result
 
+    def get_fdb_count(self, first_mac="00:00:00:00:00:00", last_mac="FF:FF:FF:FF:FF:FF"):
+        """
+        @summary: Count the FDB entries in ASIC DB with MAC addresses in the given range.
+                  The entries are counted by one Lua script run inside redis, no key is sent back.
+        @param first_mac: first MAC address of the range
+        @param last_mac: last MAC address of the range
+        """
+        script = "local n = 0 " \
+                 "for _, key in ipairs(redis.call('KEYS', 'ASIC_STATE:SAI_OBJECT_TYPE_FDB_ENTRY:*')) do " \
+                 "local mac = string.match(key, '\"mac\":\"([0-9A-F:]+)\"') " \
+                 "if mac and mac >= ARGV[1] and mac <= ARGV[2] then n = n + 1 end " \
+                 "end " \
+                 "return n"
+        output = self.shell("redis-cli -n 1 EVAL \"{}\" 0 {} {}".format(script.replace('"', '\\"'),
+                                                                       first_mac.upper(), last_mac.upper()))
+        return int(output["stdout"].strip() or 0)
+
     def get_pmon_daemon_states(self):
         """
         @summary: get state list of daemons from pmon docker.
@@ -62,6 +62,7 @@ class AdvancedReboot:
         self.vnetPkts = self.request.config.getoption("--vnet_pkts")
         self.rebootLimit = self.request.config.getoption("--reboot_limit")
         self.sniffTimeIncr = self.request.config.getoption("--sniff_time_incr")
+        self.probeRate = self.request.config.getoption("--probe_rate")
         self.allowVlanFlooding = self.request.config.getoption("--allow_vlan_flooding")
         self.stayInTargetImage = self.request.config.getoption("--stay_in_target_image")
         self.newSonicImage = self.request.config.getoption("--new_sonic_image")
@@ -305,11 +306,10 @@ class AdvancedReboot:
         '''
         Clears ARP and FDB entries
         '''
-        logger.info('Clearing arp entries on DUT  {}'.format(self.duthost.hostname))
-        self.duthost.shell('sonic-clear arp')
-
-        logger.info('Clearing all fdb entries on DUT  {}'.format(self.duthost.hostname))
-        self.duthost.shell('sonic-clear fdb all')
+        logger.info('Clearing arp and all fdb entries on DUT  {}'.format(self.duthost.hostname))
+        with self.duthost.batch() as batch:
+            batch.shell('sonic-clear arp')
+            batch.shell('sonic-clear fdb all')
 
     def __fetchTestLogs(self, rebootOper=None):
         '''
@@ -440,6 +440,7 @@ class AdvancedReboot:
                 "nexthop_ips" : self.rebootData['nexthop_ips'],
                 "allow_vlan_flooding" : self.allowVlanFlooding,
                 "sniff_time_incr" : self.sniffTimeIncr,
+                "probe_rate" : self.probeRate,
                 "setup_fdb_before_test" : True,
                 "vnet" : self.vnet,
                 "vnet_pkts" : self.vnetPkts,
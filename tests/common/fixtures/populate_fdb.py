@@ -3,6 +3,7 @@ import logging
 import pytest
 
 from ptf_runner import ptf_runner
+from common.utilities import wait_until
 
 logger = logging.getLogger(__name__)
 
@@ -25,6 +26,8 @@ class PopulateFdb:
     """
     PTFRUNNER_QLEN = 1000
     VLAN_CONFIG_FILE = "/tmp/vlan_config.json"
+    FDB_LEARN_TIMEOUT = 120
+    FDB_POLL_INTERVAL = 1
 
     def __init__(self, request, duthost, ptfhost):
         """
@@ -81,6 +84,43 @@ class PopulateFdb:
         logger.info("Copying ptftests to {0}".format(self.ptfhost.hostname))
         self.ptfhost.copy(src="ptftests", dest="/root")
 
+    def __convertMacToStr(self, mac):
+        """
+            Converts MAC address to string
+
+            Args:
+                mac (int): MAC Address
+
+            Returns:
+                mac (str): string representation of MAC address
+        """
+        mac = "{:012x}".format(mac)
+        return ":".join(mac[i : i + 2] for i in range(0, len(mac), 2))
+
+    def __waitFdbLearned(self):
+        """
+            Waits until DUT FDB has learned all the MAC addresses of the sent packets
+
+            Args:
+                None
+
+            Returns:
+                None
+        """
+        macsPerIp = int(self.macToIpRatio.split(':')[1])
+        numMac = (self.packetCount + macsPerIp - 1) // macsPerIp
+        startMac = int(self.startMac.replace(':', ''), 16)
+        firstMac = self.__convertMacToStr(startMac)
+        lastMac = self.__convertMacToStr(startMac + self.packetCount - 1)
+
+        def fdbLearned():
+            learned = self.duthost.get_fdb_count(firstMac, lastMac)
+            logger.info("DUT FDB has learned {0} of {1} MAC addresses".format(learned, numMac))
+            return learned >= numMac
+
+        assert wait_until(self.FDB_LEARN_TIMEOUT, self.FDB_POLL_INTERVAL, fdbLearned), \
+            "DUT FDB has not learned {0} MAC addresses in {1} seconds".format(numMac, self.FDB_LEARN_TIMEOUT)
+
     def run(self):
         """
             Populates DUT FDB entries
@@ -110,6 +150,8 @@ class PopulateFdb:
             log_file="/tmp/populate_fdb.PopulateFdb.log"
         )
 
+        self.__waitFdbLearned()
+
 @pytest.fixture
 def populate_fdb(request, duthost, ptfhost):
     """
@@ -1,94 +1,148 @@
 import argparse
+import json
 import time
+import sys
 import os
 
 from  datetime import datetime
 
 
-FETCH_CPU_CMD = "ps -eo pcpu,args | sort -k 1 -r | tail -n +2"
-FETCH_HDD_CMD = "df -hm /"
+DUT_MONITOR_LOG = "/tmp/dut_monitor.log"
 MEASURE_DELAY = 2
+TOP_CONSUMERS = 10
+HDD_MOUNT_POINT = "/"
+CLK_TCK = os.sysconf(os.sysconf_names["SC_CLK_TCK"])
 
 
-def process_cpu(log_file):
+class CpuSampler(object):
     """
-    @summary: Fetch CPU utilization. Write to the file total and top 10 process CPU utilization.
-    @param log_file: Opened file object to store fetched CPU utilization.
+    @summary: Calculate total and per process CPU utilization between two samples from '/proc/<pid>/stat'.
+              Files are read directly, no processes are forked to take the sample.
     """
-    buff = []
-    general_template = """
-"{timestamp}":
-    total: {total}
-    top_consumer:
-"""
-    per_process_template = "        {cpu_utilization}: \"{process}\""
-    top_consumer_list = []
-    total = 0
-    top_consumer_counter = 10
-
-    for line in os.popen(FETCH_CPU_CMD).readlines():
-        process_consumed = float(line.split()[0])
-        total += process_consumed
-        if top_consumer_counter:
-            top_consumer_list.append(per_process_template.format(cpu_utilization=process_consumed,
-                                     process=" ".join(line.split()[1:])))
-            top_consumer_counter -= 1
-
-    result = general_template.format(timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S"), total=total) \
-                + "\n".join(top_consumer_list)
-    log_file.write(result)
-
-
-def process_ram(log_file):
+    def __init__(self):
+        self.process_ticks = self.read_process_ticks()
+        self.names = {}
+        self.timestamp = time.time()
+
+    @staticmethod
+    def read_process_ticks():
+        """
+        @summary: Read CPU time (user + system) of every process.
+        @return: Dictionary (pid, start time) -> CPU time in ticks. Start time tells reused pids apart.
+        """
+        ticks = {}
+        for pid in os.listdir("/proc"):
+            if not pid.isdigit():
+                continue
+            try:
+                with open("/proc/{}/stat".format(pid)) as stream:
+                    # Process name can contain spaces, fields are counted after it
+                    fields = stream.read().rsplit(")", 1)[1].split()
+            except (IOError, OSError, IndexError):
+                # Process exited
+                continue
+            ticks[(pid, fields[19])] = int(fields[11]) + int(fields[12])
+        return ticks
+
+    def process_name(self, key):
+        if key not in self.names:
+            try:
+                with open("/proc/{}/cmdline".format(key[0])) as stream:
+                    name = stream.read().replace("\0", " ").strip()
+                if not name:
+                    with open("/proc/{}/comm".format(key[0])) as stream:
+                        name = "[{}]".format(stream.read().strip())
+            except (IOError, OSError):
+                name = "pid {}".format(key[0])
+            self.names[key] = name
+        return self.names[key]
+
+    def sample(self):
+        """
+        @summary: Calculate CPU utilization since the previous sample.
+        @return: Total CPU utilization, and the list of the top consumers as pairs of CPU utilization and process
+                 command line. Utilization is in percents of one CPU, the total is the sum over all processes
+                 the way it was summed from 'ps', so it can exceed 100 on multi-core DUTs.
+        """
+        timestamp = time.time()
+        process_ticks = self.read_process_ticks()
+
+        interval_ticks = (timestamp - self.timestamp) * CLK_TCK
+        consumers = []
+        for key, ticks in process_ticks.items():
+            delta = ticks - self.process_ticks.get(key, 0)
+            if delta > 0:
+                consumers.append((delta, key))
+        consumers.sort(reverse=True)
+        total = 100.0 * sum(delta for delta, _ in consumers) / interval_ticks if interval_ticks else 0.0
+        top_consumers = [[round(100.0 * delta / interval_ticks, 1), self.process_name(key)]
+                         for delta, key in consumers[:TOP_CONSUMERS]]
+
+        for key in set(self.names) - set(process_ticks):
+            del self.names[key]
+        self.process_ticks = process_ticks
+        self.timestamp = timestamp
+        return round(total, 1), top_consumers
+
+
+def read_ram():
     """
-    @summary: Fetch RAM utilization and write it to the file.
+    @summary: Fetch RAM utilization.
               Use 'MemTotal' and 'MemAvailable' from '/proc/meminfo' to obtain used RAM amount.
-    @param log_file: Opened file object to store fetched RAM utilization.
     """
     with open('/proc/meminfo') as stream:
         for line in stream:
-            if 'MemAvailable' in line:
+            if line.startswith('MemAvailable'):
                 available_mem_in_kb = int(line.split()[1])
-            if 'MemTotal' in line:
+            if line.startswith('MemTotal'):
                 total_mem_in_kb = int(line.split()[1])
 
     used = total_mem_in_kb - available_mem_in_kb
-    used_percent = used * 100 / total_mem_in_kb
-    log_file.write("\"{date}\": {used_ram}\n".format(date=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                   used_ram=used_percent))
+    return used * 100 / total_mem_in_kb
 
 
-def process_hdd(log_file):
+def read_hdd():
     """
-    @summary: Fetch used amount of HDD and write it to the file. Execute command defined in FETCH_HDD_CMD.
-    @param log_file: Opened file object to store fetched HDD utilization.
+    @summary: Fetch used amount of HDD in percents, calculated the same way as 'df' does.
     """
-    output_line_id = 1
-    use_value_id = 4
-    hdd_usage = os.popen(FETCH_HDD_CMD).read().split("\n")[output_line_id].split()[use_value_id].rstrip("%")
-    log_file.write("\"{date}\": {used_ram}\n".format(date=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                   used_ram=hdd_usage))
+    stat = os.statvfs(HDD_MOUNT_POINT)
+    used = stat.f_blocks - stat.f_bfree
+    available = used + stat.f_bavail
+    return (used * 100 + available - 1) // available if available else 0
 
 
-def main():
-    cpu_log = open("/tmp/cpu.log", "w")
-    ram_log = open("/tmp/ram.log", "w")
-    hdd_log = open("/tmp/hdd.log", "w")
+def main(append):
+    log = open(DUT_MONITOR_LOG, "a" if append else "w")
+    cpu = CpuSampler()
 
     print "Started resources monitoring ..."
+    sys.stdout.flush()
+    cpu_time = sum(os.times()[:2])
     while True:
-        process_cpu(cpu_log)
-        process_ram(ram_log)
-        process_hdd(hdd_log)
         time.sleep(MEASURE_DELAY)
-        cpu_log.flush()
-        ram_log.flush()
-        hdd_log.flush()
+        sample_start = time.time()
+        cpu_total, top_consumers = cpu.sample()
+        record = {
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "cpu": {"total": cpu_total, "top_consumer": top_consumers},
+            "ram": read_ram(),
+            "hdd": read_hdd(),
+        }
+        # Cost of the monitoring itself: time to take the sample and CPU used by this script since the last one
+        prev_cpu_time, cpu_time = cpu_time, sum(os.times()[:2])
+        record["overhead"] = {
+            "sample_ms": round((time.time() - sample_start) * 1000, 2),
+            "cpu": round(100.0 * (cpu_time - prev_cpu_time) / MEASURE_DELAY, 2),
+        }
+        log.write(json.dumps(record) + "\n")
+        log.flush()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--start", help="device file", action="store_true", default=False)
+    parser.add_argument("--append", help="append to the records of the previous run", action="store_true",
+                        default=False)
     args = parser.parse_args()
 
     if args.start:
-        main()
+        main(args.append)
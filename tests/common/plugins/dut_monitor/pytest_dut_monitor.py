@@ -4,6 +4,7 @@ import threading
 import logging
 import time
 import os
+import json
 import yaml
 
 from collections import OrderedDict
@@ -13,9 +14,11 @@ from errors import HDDThresholdExceeded, RAMThresholdExceeded, CPUThresholdExcee
 
 logger = logging.getLogger(__name__)
 DUT_MONITOR = "/tmp/dut_monitor.py"
-DUT_CPU_LOG = "/tmp/cpu.log"
-DUT_RAM_LOG = "/tmp/ram.log"
-DUT_HDD_LOG = "/tmp/hdd.log"
+DUT_MONITOR_LOG = "/tmp/dut_monitor.log"
+# Interval in seconds of fetching new measurements from the DUT while the test runs
+FETCH_INTERVAL = 5
+# Size of the head of DUT_MONITOR_LOG kept to detect that the file was recreated
+LOG_HEAD_SIZE = 128
 
 
 class DUTMonitorPlugin(object):
@@ -57,12 +60,17 @@ class DUTMonitorPlugin(object):
             if dut_hwsku in general_thresholds[dut_platform]["hwsku"]:
                 dut_thresholds.update(general_thresholds[dut_platform]["hwsku"][dut_hwsku])
 
+        # Check the measurements against the thresholds as they arrive
+        dut_ssh.on_records = lambda records: self.check_records(records, dut_thresholds)
+
         yield dut_thresholds
 
         # Stop monitoring on DUT
         dut_ssh.stop()
-        # Download log files with CPU, RAM and HDD measurements data
+        dut_ssh.on_records = None
+        # Download the rest of CPU, RAM and HDD measurements data
         measurements = dut_ssh.get_log_files()
+        self.report_overhead(measurements["overhead"])
         # Verify hardware resources consumption does not exceed defined threshold
         if measurements["hdd"]:
             try:
@@ -85,6 +93,41 @@ class DUTMonitorPlugin(object):
         if monitor_exceptions:
             raise Exception("\n".join(item.message for item in monitor_exceptions))
 
+    def check_records(self, records, thresholds):
+        """
+        Report measurements exceeding the thresholds while the test is running.
+        Thresholds defined over a time interval are verified after the test.
+        """
+        for record in records:
+            if record["hdd"] > thresholds["hdd_used"]:
+                logger.warning("{}: used HDD {}% exceeds threshold {}%".format(record["timestamp"], record["hdd"],
+                                                                             thresholds["hdd_used"]))
+            if record["ram"] > thresholds["ram_peak"]:
+                logger.warning("{}: used RAM {}% exceeds threshold {}%".format(record["timestamp"], record["ram"],
+                                                                             thresholds["ram_peak"]))
+            if record["cpu"]["total"] > thresholds["cpu_total"]:
+                logger.warning("{}: total CPU {}% exceeds threshold {}%".format(record["timestamp"],
+                                                                              record["cpu"]["total"],
+                                                                              thresholds["cpu_total"]))
+            for process_consumption, process_name in record["cpu"]["top_consumer"]:
+                if process_consumption >= thresholds["cpu_process"]:
+                    logger.warning("{}: process '{}' CPU {}% exceeds threshold {}%".format(record["timestamp"],
+                                                                                          process_name,
+                                                                                          process_consumption,
+                                                                                          thresholds["cpu_process"]))
+
+    def report_overhead(self, overhead_meas):
+        """
+        Report resources consumed by the monitoring itself on the DUT
+        """
+        if not overhead_meas:
+            return
+        sample_ms = [item["sample_ms"] for item in overhead_meas.values()]
+        cpu = [item["cpu"] for item in overhead_meas.values()]
+        logger.info("DUT monitoring overhead: {} samples; sample time average {:.2f} ms, max {:.2f} ms; "
+                    "CPU average {:.2f}%, max {:.2f}%".format(len(sample_ms), sum(sample_ms) / len(sample_ms),
+                                                             max(sample_ms), sum(cpu) / len(cpu), max(cpu)))
+
     def assert_hhd(self, hdd_meas, thresholds):
         """
         Verify that free disk space on the DUT is not overutilized
@@ -185,7 +228,7 @@ class DUTMonitorPlugin(object):
                 fail_msg += handle_total_measurements(total_overused)
                 total_overused = []
 
-            for process_consumption, process_name in cpu_meas[timestamp]["top_consumer"].items():
+            for process_consumption, process_name in cpu_meas[timestamp]["top_consumer"]:
                 if process_consumption >= thresholds["cpu_process"]:
                     if process_name not in process_overused:
                         process_overused[process_name] = []
@@ -240,6 +283,11 @@ class DUTMonitorClient(object):
         self.host = host
         self.init()
         self.run_channel = None
+        self.records = []
+        self.offset = 0
+        self.head = ""
+        self.on_records = None
+        self._lock = threading.Lock()
         self._thread = threading.Thread(name="Connection tracker", target=self._track_connection)
         self._thread.setDaemon(True)
         self._thread.start()
@@ -261,9 +309,11 @@ class DUTMonitorClient(object):
                     logger.debug(repr(err))
                 else:
                     if self.running:
-                        self.start()
+                        self.start(append=True)
             else:
-                time.sleep(5)
+                if self.running and self.on_records:
+                    self.on_records(self.fetch_records())
+                time.sleep(FETCH_INTERVAL)
 
     def _upload_to_dut(self):
         """
@@ -301,11 +351,18 @@ class DUTMonitorClient(object):
             logger.warning("Skip command {}".format(cmd))
             return (None, None, None)
 
-    def start(self):
+    def start(self, append=False):
         """
         @summary: Start HW resources monitoring on the DUT.
-                  Write obtained values to the following files on the DUT: DUT_CPU_LOG, DUT_RAM_LOG, DUT_HDD_LOG
+                  Write obtained values to the DUT_MONITOR_LOG file on the DUT, one JSON record per line.
+        @param append: Continue the records of the previous run, used when monitoring is restarted after
+                       lost connection.
         """
+        if not append:
+            with self._lock:
+                self.records = []
+                self.offset = 0
+                self.head = ""
         self.running = True
         self._upload_to_dut()
         logger.debug("Start HW resources monitoring on the DUT...")
@@ -314,7 +371,7 @@ class DUTMonitorClient(object):
         self.run_channel.get_pty()
         self.run_channel.settimeout(5)
         # Start monitoring on DUT
-        self.run_channel.exec_command("python {} --start".format(DUT_MONITOR))
+        self.run_channel.exec_command("python {} --start{}".format(DUT_MONITOR, " --append" if append else ""))
         # Ensure monitoring started
         output = self.run_channel.recv(1024)
         if not "Started resources monitoring ..." in output:
@@ -329,32 +386,44 @@ class DUTMonitorClient(object):
         if not self.run_channel.closed:
             self.run_channel.close()
 
-    def read_yml(self, file_pointer):
+    def fetch_records(self):
         """
-        @summary: Read yaml file content. Convert it to the ordered data.
-        @return: OrderedDict with sorted keys by timestamp, or empty dict for empty file.
+        @summary: Download the records added to the DUT_MONITOR_LOG since the last fetch.
+        @return: List of the new records.
         """
-        with file_pointer as fp:
-            measurements = yaml.safe_load("".join(fp))
-        if measurements is None:
-            return {}
-        # Sort json data to process logs chronologically
-        keys = measurements.keys()
-        keys.sort()
-        key_value_pairs = [(item, measurements[item]) for item in keys]
-        return OrderedDict(key_value_pairs)
+        with self._lock:
+            try:
+                with self.ssh.open_sftp() as sftp:
+                    with sftp.file(DUT_MONITOR_LOG) as fp:
+                        # The file is recreated when the DUT is rebooted, read it from the start then
+                        head = fp.read(LOG_HEAD_SIZE)
+                        if not head.startswith(self.head) or fp.stat().st_size < self.offset:
+                            logger.debug("{} was recreated on the DUT".format(DUT_MONITOR_LOG))
+                            self.offset = 0
+                        self.head = head
+                        fp.seek(self.offset)
+                        data = fp.read()
+            except (IOError, paramiko.SSHException, AttributeError) as err:
+                logger.debug("Failed to fetch measurements - {}".format(repr(err)))
+                return []
+            # The last line can be partially written, leave it for the next fetch
+            complete = data[:data.rfind("\n") + 1]
+            self.offset += len(complete)
+            records = [json.loads(line) for line in complete.splitlines() if line]
+            self.records.extend(records)
+        return records
 
     def get_log_files(self):
         """
-        @summary: Fetch monitoring logs from device, parse, convert to dictionary with sorted order.
-        @return: Dictionary with keys "cpu", "ram", "hdd", values contains appropriate measurements made on DUT.
+        @summary: Fetch the rest of monitoring records from device, convert them to dictionaries with
+                  measurements sorted by timestamp.
+        @return: Dictionary with keys "cpu", "ram", "hdd" and "overhead", values contains appropriate measurements
+                 made on DUT.
         """
         logger.debug("Downloading file from the DUT...")
-        cpu_log_fp = self.ssh.open_sftp().file(DUT_CPU_LOG)
-        ram_log_fp = self.ssh.open_sftp().file(DUT_RAM_LOG)
-        hdd_log_fp = self.ssh.open_sftp().file(DUT_HDD_LOG)
-
-        cpu_meas = self.read_yml(cpu_log_fp)
-        ram_meas = self.read_yml(ram_log_fp)
-        hdd_meas = self.read_yml(hdd_log_fp)
-        return {"cpu": cpu_meas, "ram": ram_meas, "hdd": hdd_meas}
+        self.fetch_records()
+        measurements = {"cpu": OrderedDict(), "ram": OrderedDict(), "hdd": OrderedDict(), "overhead": OrderedDict()}
+        for record in sorted(self.records, key=lambda record: record["timestamp"]):
+            for key in measurements:
+                measurements[key][record["timestamp"]] = record[key]
+        return measurements
@@ -0,0 +1,21 @@
+"""
+Helpers for the fixtures building the testbed host objects.
+
+Every ansible_adhoc() call creates a new inventory manager, so looking up a host through it per fixture is slow
+on big topologies. Inventory lookups are memoized for the session instead.
+"""
+
+_inventory_cache = {}
+
+
+def get_inventory_host(ansible_adhoc, hostname):
+    """
+    @summary: Return the inventory host object of a host. Lookups are memoized, so the inventory
+        manager is created and queried only once per host in a session.
+    @param ansible_adhoc: Fixture provided by the pytest-ansible package.
+    @param hostname: Name of the host in the inventory.
+    @return: The inventory host object, None if the host is not in the inventory.
+    """
+    if hostname not in _inventory_cache:
+        _inventory_cache[hostname] = ansible_adhoc().options['inventory_manager'].get_host(hostname)
+    return _inventory_cache[hostname]
@@ -16,6 +16,7 @@ import ipaddr as ipaddress
 from collections import defaultdict
 from common.fixtures.conn_graph_facts import conn_graph_facts
 from common.devices import SonicHost, Localhost, PTFHost, EosHost, FanoutHost
+from common.provisioning import get_inventory_host
 
 logger = logging.getLogger(__name__)
 
@@ -140,10 +141,11 @@ def disable_ssh_timout(dut):
     @param dut: Ansible host DUT
     '''
     logger.info('Disabling ssh time out on dut: %s' % dut.hostname)
-    dut.command("sudo sed -i 's/^ClientAliveInterval/#&/' /etc/ssh/sshd_config")
-    dut.command("sudo sed -i 's/^ClientAliveCountMax/#&/' /etc/ssh/sshd_config")
+    with dut.batch() as batch:
+        batch.command("sudo sed -i 's/^ClientAliveInterval/#&/' /etc/ssh/sshd_config")
+        batch.command("sudo sed -i 's/^ClientAliveCountMax/#&/' /etc/ssh/sshd_config")
 
-    dut.command("sudo systemctl restart ssh")
+        batch.command("sudo systemctl restart ssh")
     time.sleep(5)
 
 
@@ -153,10 +155,11 @@ def enable_ssh_timout(dut):
     @param dut: Ansible host DUT
     '''
     logger.info('Enabling ssh time out on dut: %s' % dut.hostname)
-    dut.command("sudo sed -i '/^#ClientAliveInterval/s/^#//' /etc/ssh/sshd_config")
-    dut.command("sudo sed -i '/^#ClientAliveCountMax/s/^#//' /etc/ssh/sshd_config")
+    with dut.batch() as batch:
+        batch.command("sudo sed -i '/^#ClientAliveInterval/s/^#//' /etc/ssh/sshd_config")
+        batch.command("sudo sed -i '/^#ClientAliveCountMax/s/^#//' /etc/ssh/sshd_config")
 
-    dut.command("sudo systemctl restart ssh")
+        batch.command("sudo systemctl restart ssh")
     time.sleep(5)
 
 
@@ -232,7 +235,8 @@ def fanouthosts(ansible_adhoc, conn_graph_facts, creds):
         if fanout_host in fanout_hosts.keys():
             fanout  = fanout_hosts[fanout_host]
         else:
-            host_vars = ansible_adhoc().options['inventory_manager'].get_host(fanout_host).vars
+            inventory_host = get_inventory_host(ansible_adhoc, fanout_host)
+            host_vars = inventory_host.vars if inventory_host is not None else {}
             os_type = 'eos' if 'os' not in host_vars else host_vars['os']
             fanout  = FanoutHost(ansible_adhoc, os_type, fanout_host, 'FanoutLeaf', creds['fanout_admin_user'], creds['fanout_admin_password'])
             fanout_hosts[fanout_host] = fanout
@@ -280,8 +284,10 @@ def pytest_runtest_makereport(item, call):
 
 def fetch_dbs(duthost, testname):
     dbs = [[0, "appdb"], [1, "asicdb"], [2, "counterdb"], [4, "configdb"]]
+    with duthost.batch() as batch:
+        for db in dbs:
+            batch.shell("redis-dump -d {} --pretty -o {}.json".format(db[0], db[1]))
     for db in dbs:
-        duthost.shell("redis-dump -d {} --pretty -o {}.json".format(db[0], db[1]))
         duthost.fetch(src="{}.json".format(db[1]), dest="logs/{}".format(testname))
 
 
@@ -1,50 +1,47 @@
 
 import pytest
 import ptf.testutils as testutils
+import ptf.packet as scapy
 
-import time
 import itertools
 import logging
 import pprint
 
+from common.utilities import wait_until
+
 DEFAULT_FDB_ETHERNET_TYPE = 0x1234
 DUMMY_MAC_PREFIX = "02:11:22:33"
 DUMMY_MAC_COUNT = 10
-FDB_POPULATE_SLEEP_TIMEOUT = 2
+FDB_LEARN_TIMEOUT = 30
+FDB_POLL_INTERVAL = 1
 FDB_WAIT_EXPECTED_PACKET_TIMEOUT = 5
 PKT_TYPES = ["ethernet", "arp_request", "arp_reply"]
 
 logger = logging.getLogger(__name__)
 
 
-def send_eth(ptfadapter, source_port, source_mac, dest_mac):
+def eth_packet(source_mac, dest_mac):
     """
-    send ethernet packet
-    :param ptfadapter: PTF adapter object
-    :param source_port: source port
+    build ethernet packet
     :param source_mac: source MAC
     :param dest_mac: destination MAC
-    :return:
+    :return: packet
     """
-    pkt = testutils.simple_eth_packet(
+    return testutils.simple_eth_packet(
         eth_dst=dest_mac,
         eth_src=source_mac,
         eth_type=DEFAULT_FDB_ETHERNET_TYPE
     )
-    logger.debug('send packet source port id {} smac: {} dmac: {}'.format(source_port, source_mac, dest_mac))
-    testutils.send(ptfadapter, source_port, pkt)
 
 
-def send_arp_request(ptfadapter, source_port, source_mac, dest_mac):
+def arp_request_packet(source_mac, dest_mac):
     """
-    send arp request packet
-    :param ptfadapter: PTF adapter object
-    :param source_port: source port
+    build arp request packet
     :param source_mac: source MAC
     :param dest_mac: destination MAC
-    :return:
+    :return: packet
     """
-    pkt = testutils.simple_arp_packet(pktlen=60,
+    return testutils.simple_arp_packet(pktlen=60,
                 eth_dst='ff:ff:ff:ff:ff:ff',
                 eth_src=source_mac,
                 vlan_vid=0,
@@ -55,20 +52,16 @@ def send_arp_request(ptfadapter, source_port, source_mac, dest_mac):
                 hw_snd=source_mac,
                 hw_tgt='ff:ff:ff:ff:ff:ff',
                 )
-    logger.debug('send ARP request packet source port id {} smac: {} dmac: {}'.format(source_port, source_mac, dest_mac))
-    testutils.send(ptfadapter, source_port, pkt)
 
 
-def send_arp_reply(ptfadapter, source_port, source_mac, dest_mac):
+def arp_reply_packet(source_mac, dest_mac):
     """
-    send arp reply packet
-    :param ptfadapter: PTF adapter object
-    :param source_port: source port
+    build arp reply packet
     :param source_mac: source MAC
     :param dest_mac: destination MAC
-    :return:
+    :return: packet
     """
-    pkt = testutils.simple_arp_packet(eth_dst=dest_mac,
+    return testutils.simple_arp_packet(eth_dst=dest_mac,
                 eth_src=source_mac,
                 arp_op=2,
                 ip_snd='10.10.1.2',
@@ -76,8 +69,39 @@ def send_arp_reply(ptfadapter, source_port, source_mac, dest_mac):
                 hw_tgt=dest_mac,
                 hw_snd=source_mac,
                 )
-    logger.debug('send ARP reply packet source port id {} smac: {} dmac: {}'.format(source_port, source_mac, dest_mac))
-    testutils.send(ptfadapter, source_port, pkt)
+
+
+PKT_BUILDERS = {
+    "ethernet": eth_packet,
+    "arp_request": arp_request_packet,
+    "arp_reply": arp_reply_packet,
+}
+
+
+def send_fdb_packets(ptfadapter, source_port, source_macs, dest_mac, pkt_type):
+    """
+    send one packet of the given type for each source MAC
+    The packet is built once, the source MAC of every next packet is written into it in place
+    :param ptfadapter: PTF adapter object
+    :param source_port: source port
+    :param source_macs: source MACs
+    :param dest_mac: destination MAC
+    :param pkt_type: packet type, one of PKT_TYPES
+    :return:
+    """
+    pkt = PKT_BUILDERS[pkt_type](source_macs[0], dest_mac)
+    # the source MAC is in the Ethernet header and in the sender hardware address of ARP
+    mac_offsets = [6]
+    if scapy.ARP in pkt:
+        mac_offsets.append(len(pkt) - len(pkt[scapy.ARP]) + 8)
+    data = bytearray(str(pkt))
+
+    for source_mac in source_macs:
+        raw_mac = bytearray(int(octet, 16) for octet in source_mac.split(':'))
+        for offset in mac_offsets:
+            data[offset:offset + 6] = raw_mac
+        logger.debug('send {} packet source port id {} smac: {} dmac: {}'.format(pkt_type, source_port, source_mac, dest_mac))
+        testutils.send(ptfadapter, source_port, str(data))
 
 
 def send_recv_eth(ptfadapter, source_port, source_mac, dest_port, dest_mac):
@@ -101,9 +125,10 @@ def send_recv_eth(ptfadapter, source_port, source_mac, dest_port, dest_mac):
     testutils.verify_packet_any_port(ptfadapter, pkt, [dest_port], timeout=FDB_WAIT_EXPECTED_PACKET_TIMEOUT)
 
 
-def setup_fdb(ptfadapter, vlan_table, router_mac, pkt_type):
+def setup_fdb(ptfadapter, duthost, vlan_table, router_mac, pkt_type):
     """
     :param ptfadapter: PTF adapter object
+    :param duthost: DUT host object
     :param vlan_table: VLAN table map: VLAN subnet -> list of VLAN members
     :return: FDB table map : VLAN member -> MAC addresses set
     """
@@ -116,7 +141,7 @@ def setup_fdb(ptfadapter, vlan_table, router_mac, pkt_type):
         for member in vlan_table[vlan]:
             mac = ptfadapter.dataplane.get_mac(0, member)
             # send a packet to switch to populate layer 2 table with MAC of PTF interface
-            send_eth(ptfadapter, member, mac, router_mac)
+            send_fdb_packets(ptfadapter, member, [mac], router_mac, "ethernet")
 
             # put in learned MAC
             fdb[member] = { mac }
@@ -126,20 +151,18 @@ def setup_fdb(ptfadapter, vlan_table, router_mac, pkt_type):
             dummy_macs = ['{}:{:02x}:{:02x}'.format(DUMMY_MAC_PREFIX, member, i)
                           for i in range(DUMMY_MAC_COUNT)]
 
-            for dummy_mac in dummy_macs:
-                if pkt_type == "ethernet":
-                    send_eth(ptfadapter, member, dummy_mac, router_mac)
-                elif pkt_type == "arp_request":
-                    send_arp_request(ptfadapter, member, dummy_mac, router_mac)
-                elif pkt_type == "arp_reply":
-                    send_arp_reply(ptfadapter, member, dummy_mac, router_mac)
-                else:
-                    pytest.fail("Unknown option '{}'".format(pkt_type))
+            send_fdb_packets(ptfadapter, member, dummy_macs, router_mac, pkt_type)
 
             # put in set learned dummy MACs
             fdb[member].update(dummy_macs)
 
-    time.sleep(FDB_POPULATE_SLEEP_TIMEOUT)
+    # wait until the DUT has learned all the dummy MACs instead of a fixed time
+    dummy_mac_count = DUMMY_MAC_COUNT * sum([len(members) for members in vlan_table.values()])
+    def dummy_macs_learned():
+        return duthost.get_fdb_count(DUMMY_MAC_PREFIX + ":00:00", DUMMY_MAC_PREFIX + ":ff:ff") >= dummy_mac_count
+
+    if not wait_until(FDB_LEARN_TIMEOUT, FDB_POLL_INTERVAL, dummy_macs_learned):
+        logger.warning("DUT has not learned {} dummy MACs in {} seconds".format(dummy_mac_count, FDB_LEARN_TIMEOUT))
 
     return fdb
 
@@ -193,7 +216,7 @@ def test_fdb(ansible_adhoc, testbed, ptfadapter, duthost, ptfhost, pkt_type):
 
     vlan_member_count = sum([ len(members) for name, members in vlan_table.items() ])
 
-    fdb = setup_fdb(ptfadapter, vlan_table, router_mac, pkt_type)
+    fdb = setup_fdb(ptfadapter, duthost, vlan_table, router_mac, pkt_type)
     for vlan in vlan_table:
         for src, dst in itertools.combinations(vlan_table[vlan], 2):
             for src_mac, dst_mac in itertools.product(fdb[src], fdb[dst]):
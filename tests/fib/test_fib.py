@@ -16,6 +16,8 @@ SRC_IPV6_RANGE = ['20D0:A800:0:00::', '20D0:A800:0:00::FFFF']
 DST_IPV6_RANGE = ['20D0:A800:0:01::', '20D0:A800:0:01::FFFF']
 VLANIDS = range(1032, 1279)
 VLANIP = '192.168.{}.1/24'
+# Hash test sends its flows in bursts, the PTF queue of a port must hold a whole burst
+HASH_TEST_QLEN = 1000
 
 g_vars = {}
 
@@ -213,6 +215,7 @@ class TestHash():
                         "vlan_ids": VLANIDS,
                         "hash_keys": self.hash_keys },
                 log_file=log_file,
+                qlen=HASH_TEST_QLEN,
                 socket_recv_size=16384)
 
     def test_hash_ipv6(self, ptfhost):
@@ -234,4 +237,5 @@ class TestHash():
                         "vlan_ids": VLANIDS,
                         "hash_keys": self.hash_keys },
                 log_file=log_file,
+                qlen=HASH_TEST_QLEN,
                 socket_recv_size=16384)
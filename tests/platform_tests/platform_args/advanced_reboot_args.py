@@ -61,6 +61,14 @@ def add_advanced_reboot_args(parser):
         help="Sniff time increment",
     )
 
+    parser.addoption(
+        "--probe_rate",
+        action="store",
+        type=int,
+        default=100,
+        help="Rate in pps of each continuous reachability probe, 0 to probe in rounds",
+    )
+
     parser.addoption(
         "--new_sonic_image",
         action="store",
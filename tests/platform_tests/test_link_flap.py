@@ -1,9 +1,17 @@
 import logging
+import time
+from multiprocessing.pool import ThreadPool
 
 import pytest
 
 from common.platform.device_utils import fanout_switch_port_lookup
-from common.utilities import wait_until
+
+# Maximum number of links flapped at the same time
+FLAP_GROUP_SIZE = 8
+# Time given to a link to change its state, in seconds
+LINK_STATE_TIMEOUT = 30
+# Interval between two reads of the DUT interface status, in seconds
+LINK_STATE_POLL_INTERVAL = 0.5
 
 class TestLinkFlap:
     def __get_dut_if_status(self, dut, ifname=None):
@@ -15,29 +23,101 @@ class TestLinkFlap:
         return status
 
 
-    def __check_if_status(self, dut, dut_port, exp_state, verbose=False):
-        status = self.__get_dut_if_status(dut, dut_port)[dut_port]
-        if verbose:
-            logging.debug("Interface status : {}".format(status))
-        return status['oper_state'] == exp_state
-
+    def __set_fanout_ports(self, group, up):
+        """
+        @summary: Shut down or bring up the fanout ports of a group of links. The ports of one fanout are set
+            with one config call, different fanouts are set concurrently.
+        @return: Dictionary of DUT port to the time its fanout port was set.
+        """
+        ports_of = {}
+        for dut_port, fanout, fanout_port in group:
+            ports_of.setdefault(fanout, []).append((dut_port, fanout_port))
+
+        def set_fanout(item):
+            fanout, ports = item
+            fanout_ports = [fanout_port for _, fanout_port in ports]
+            if fanout.get_fanout_os() == 'eos':
+                # EOS configures a comma separated interface range in one session
+                fanout_ports = [','.join(fanout_ports)]
+            for fanout_port in fanout_ports:
+                if up:
+                    logging.info("Bring up fanout switch {} port {}".format(fanout.hostname, fanout_port))
+                    fanout.no_shutdown(fanout_port)
+                else:
+                    logging.info("Shutting down fanout switch {} port {}".format(fanout.hostname, fanout_port))
+                    fanout.shutdown(fanout_port)
+            set_time = time.time()
+            return [(dut_port, set_time) for dut_port, _ in ports]
+
+        if not up:
+            for dut_port, fanout, fanout_port in group:
+                self.ports_shutdown_by_test.add((fanout, fanout_port))
+
+        if len(ports_of) == 1:
+            results = [set_fanout(ports_of.items()[0])]
+        else:
+            pool = ThreadPool(processes=len(ports_of))
+            try:
+                results = pool.map(set_fanout, ports_of.items())
+            finally:
+                pool.close()
+                pool.join()
+        set_times = {}
+        for result in results:
+            set_times.update(result)
+
+        if up:
+            for dut_port, fanout, fanout_port in group:
+                self.ports_shutdown_by_test.discard((fanout, fanout_port))
+
+        return set_times
+
+
+    def __wait_for_state(self, dut, set_times, exp_state):
+        """
+        @summary: Poll the status of all the DUT ports with one query until every port is in the expected state.
+        @param set_times: Dictionary of DUT port to the time its fanout port was set.
+        @return: Dictionary of DUT port to the seconds it took to reach the expected state. The ports that
+            didn't reach the state before LINK_STATE_TIMEOUT are not in the dictionary.
+        """
+        elapsed = {}
+        deadline = time.time() + LINK_STATE_TIMEOUT
+        while True:
+            status = self.__get_dut_if_status(dut)
+            now = time.time()
+            for dut_port, set_time in set_times.items():
+                if dut_port not in elapsed and status[dut_port]['oper_state'] == exp_state:
+                    elapsed[dut_port] = now - set_time
+            if len(elapsed) == len(set_times) or now > deadline:
+                break
+            time.sleep(LINK_STATE_POLL_INTERVAL)
+
+        for dut_port in set(set_times) - set(elapsed):
+            logging.debug("Interface status : {}".format(status[dut_port]))
+
+        return elapsed
+
+
+    def __toggle_link_group(self, dut, group):
+        dut_ports = [dut_port for dut_port, _, _ in group]
+        logging.info("Testing link flap on {}".format(', '.join(dut_ports)))
 
-    def __toggle_one_link(self, dut, dut_port, fanout, fanout_port):
-        logging.info("Testing link flap on {}".format(dut_port))
+        status = self.__get_dut_if_status(dut)
+        not_up = [dut_port for dut_port in dut_ports if status[dut_port]['oper_state'] != 'up']
+        assert not not_up, "Fail: dut ports {}: link operational down".format(not_up)
 
-        assert self.__check_if_status(dut, dut_port, 'up', verbose=True), "Fail: dut port {}: link operational down".format(status)
+        set_times = self.__set_fanout_ports(group, up=False)
+        down_times = self.__wait_for_state(dut, set_times, 'down')
+        not_down = sorted(set(dut_ports) - set(down_times))
+        assert not not_down, "dut ports {} didn't go down as expected".format(not_down)
 
-        logging.info("Shutting down fanout switch {} port {} connecting to {}".format(fanout.hostname, fanout_port, dut_port))
-        self.ports_shutdown_by_test.add((fanout, fanout_port))
-        fanout.shutdown(fanout_port)
-        wait_until(30, 1, self.__check_if_status, dut, dut_port, 'down')
-        assert self.__check_if_status(dut, dut_port, 'down', verbose=True), "dut port {} didn't go down as expected".format(dut_port)
+        set_times = self.__set_fanout_ports(group, up=True)
+        up_times = self.__wait_for_state(dut, set_times, 'up')
+        not_up = sorted(set(dut_ports) - set(up_times))
+        assert not not_up, "dut ports {} didn't come up as expected".format(not_up)
 
-        logging.info("Bring up fanout switch {} port {} connecting to {}".format(fanout.hostname, fanout_port, dut_port))
-        fanout.no_shutdown(fanout_port)
-        wait_until(30, 1, self.__check_if_status, dut, dut_port, 'up')
-        assert self.__check_if_status(dut, dut_port, 'up', verbose=True), "dut port {} didn't go down as expected".format(dut_port)
-        self.ports_shutdown_by_test.discard((fanout, fanout_port))
+        for dut_port in dut_ports:
+            self.flap_times[dut_port] = (down_times[dut_port], up_times[dut_port])
 
 
     def __build_test_candidates(self, dut, fanouthosts):
@@ -57,17 +137,53 @@ class TestLinkFlap:
         return candidates
 
 
+    def __build_flap_groups(self, dut, candidates):
+        """
+        @summary: Split the candidates into groups of links that can be flapped at the same time.
+            Members of the same port channel are put into different groups, so that a port channel never
+            loses more than one member at a time.
+        """
+        mg_facts = dut.minigraph_facts(host=dut.hostname)['ansible_facts']
+        portchannel_of = {}
+        for portchannel, info in mg_facts.get('minigraph_portchannels', {}).items():
+            for member in info['members']:
+                portchannel_of[member] = portchannel
+
+        groups = []
+        for candidate in candidates:
+            portchannel = portchannel_of.get(candidate[0])
+            for group in groups:
+                if len(group) < FLAP_GROUP_SIZE and \
+                   (portchannel is None or portchannel not in [portchannel_of.get(c[0]) for c in group]):
+                    group.append(candidate)
+                    break
+            else:
+                groups.append([candidate])
+
+        return groups
+
+
+    def __report_flap_times(self):
+        logging.info("Link flap times (seconds from the fanout port change to the DUT port state change):")
+        logging.info("{:<20} {:>10} {:>10}".format("Port", "Down", "Up"))
+        for dut_port in sorted(self.flap_times):
+            down_time, up_time = self.flap_times[dut_port]
+            logging.info("{:<20} {:>10.2f} {:>10.2f}".format(dut_port, down_time, up_time))
+
+
     def run_link_flap_test(self, dut, fanouthosts):
         self.ports_shutdown_by_test = set()
+        self.flap_times = {}
 
         candidates = self.__build_test_candidates(dut, fanouthosts)
         if not candidates:
             pytest.skip("Didn't find any port that is admin up and present in the connection graph")
 
         try:
-            for dut_port, fanout, fanout_port in candidates:
-                self.__toggle_one_link(dut, dut_port, fanout, fanout_port)
+            for group in self.__build_flap_groups(dut, candidates):
+                self.__toggle_link_group(dut, group)
         finally:
+            self.__report_flap_times()
             logging.info("Restoring fanout switch ports that were shut down by test")
             for fanout, fanout_port in self.ports_shutdown_by_test:
                 logging.debug("Restoring fanout switch {} port {} shut down by test".format(fanout.hostname, fanout_port))
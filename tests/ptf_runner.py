@@ -1,8 +1,16 @@
 import pipes
 
+# Tests are run through a daemon on the PTF host which keeps scapy and ptf imported,
+# see scripts/ptf_daemon.py. It is copied once per PTF host.
+PTF_DAEMON = "scripts/ptf_daemon.py"
+PTF_DAEMON_DEST = "/root/ptf_daemon.py"
+_ptf_daemon_hosts = set()
+
+
 def ptf_runner(host, testdir, testname, platform_dir=None, params={},
                platform="remote", qlen=0, relax=True, debug_level="info",
-               socket_recv_size=None, log_file=None, device_sockets=[]):
+               socket_recv_size=None, log_file=None, device_sockets=[],
+               use_daemon=True):
 
     cmd = "ptf --test-dir {} {}".format(testdir, testname)
 
@@ -34,4 +42,10 @@ def ptf_runner(host, testdir, testname, platform_dir=None, params={},
     if device_sockets:
         cmd += " ".join(map(" --device-socket {}".format, device_sockets))
 
+    if use_daemon:
+        if host.hostname not in _ptf_daemon_hosts:
+            host.copy(src=PTF_DAEMON, dest=PTF_DAEMON_DEST)
+            _ptf_daemon_hosts.add(host.hostname)
+        cmd = "python {} run -- {}".format(PTF_DAEMON_DEST, cmd[len("ptf "):])
+
     host.shell(cmd, chdir="/root")
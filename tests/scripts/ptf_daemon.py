@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+'''
+Run ptf tests through a daemon which keeps scapy and ptf imported.
+
+The daemon listens on a unix socket. For every request it forks a child, which runs the
+ptf script with the requested arguments, working directory and environment, so test
+params, module state and the exit status are isolated between runs exactly as with a
+new ptf process. The dataplane is opened by the child, its threads can't be forked.
+Output of the child is streamed back over the socket as it is produced, followed by a
+trailer with its exit status.
+
+Usage:
+    ptf_daemon.py serve [--socket PATH]
+    ptf_daemon.py run [--socket PATH] -- <ptf arguments>
+
+'run' starts the daemon when it is not running and falls back to executing ptf
+directly when the daemon is not available.
+'''
+
+from __future__ import print_function
+
+import argparse
+import errno
+import fcntl
+import json
+import os
+import select
+import signal
+import socket
+import sys
+import time
+import uuid
+
+SOCKET_PATH = '/var/run/ptf_daemon.sock'
+LOG_FILE = '/tmp/ptf_daemon.log'
+PTF = 'ptf'
+START_TIMEOUT = 60
+REAP_INTERVAL = 0.1
+RECV_SIZE = 65536
+# Trailer sent after the output of a test: '\n<token> <exit status>\n'
+TRAILER_MAX = 64
+
+
+def log(msg):
+    sys.stderr.write('%s %s\n' % (time.strftime('%Y-%m-%d %H:%M:%S'), msg))
+    sys.stderr.flush()
+
+
+def find_ptf():
+    for path in os.environ.get('PATH', os.defpath).split(os.pathsep):
+        candidate = os.path.join(path, PTF)
+        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return candidate
+    raise Exception('%s was not found in PATH' % PTF)
+
+
+def recv_request(conn):
+    data = b''
+    while not data.endswith(b'\n'):
+        chunk = conn.recv(RECV_SIZE)
+        if not chunk:
+            raise Exception('connection closed before request was received')
+        data += chunk
+    return json.loads(data.decode('utf-8'))
+
+
+def run_test(conn, request, ptf_path):
+    # Runs in the forked child, never returns
+    code = 1
+    try:
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        null = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(null, 0)
+        os.dup2(conn.fileno(), 1)
+        os.dup2(conn.fileno(), 2)
+        os.close(null)
+        try:
+            sys.stdout = os.fdopen(1, 'w', 0)
+        except ValueError:
+            sys.stdout = os.fdopen(1, 'w', 1)
+        sys.stderr = sys.stdout
+
+        os.environ.clear()
+        os.environ.update(request['env'])
+        os.chdir(request['cwd'])
+        sys.argv = [ptf_path] + request['args']
+        sys.path[0] = os.path.dirname(os.path.realpath(ptf_path))
+
+        import runpy
+        try:
+            runpy.run_path(ptf_path, run_name='__main__')
+            code = 0
+        except SystemExit as e:
+            if e.code is None:
+                code = 0
+            elif isinstance(e.code, int):
+                code = e.code
+            else:
+                print(e.code)
+                code = 1
+    except BaseException:
+        import traceback
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+        except Exception:
+            pass
+        os._exit(code)
+
+
+def serve(socket_path):
+    lock = open(socket_path + '.lock', 'w')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError:
+        # Another daemon is running or starting
+        return
+
+    # Warm up the imports shared by every test, the child inherits them
+    start = time.time()
+    import scapy.all
+    import ptf
+    import ptf.packet
+    import ptf.mask
+    import ptf.dataplane
+    import ptf.testutils
+    import ptf.base_tests
+    import unittest
+    ptf_path = find_ptf()
+    log('preloaded imports in %.2f seconds' % (time.time() - start))
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(16)
+    log('listening on %s' % socket_path)
+
+    # Single threaded, so forking is safe: tests are reaped by polling
+    running = {}
+    while True:
+        try:
+            readable, _, _ = select.select([server], [], [], REAP_INTERVAL)
+        except select.error as e:
+            if e.args[0] != errno.EINTR:
+                raise
+            readable = []
+
+        if readable:
+            conn, _ = server.accept()
+            try:
+                request = recv_request(conn)
+            except Exception as e:
+                log('bad request: %s' % e)
+                conn.close()
+                continue
+            pid = os.fork()
+            if pid == 0:
+                server.close()
+                lock.close()
+                # The clients of the other tests must see EOF when their test exits, not when this one does
+                for other, _ in running.values():
+                    other.close()
+                run_test(conn, request, ptf_path)
+            log('pid %d: ptf %s' % (pid, ' '.join(request['args'])))
+            running[pid] = (conn, request['token'])
+
+        for pid in list(running):
+            done, status = os.waitpid(pid, os.WNOHANG)
+            if not done:
+                continue
+            conn, token = running.pop(pid)
+            if os.WIFEXITED(status):
+                code = os.WEXITSTATUS(status)
+            else:
+                code = 128 + os.WTERMSIG(status)
+            log('pid %d: exit status %d' % (pid, code))
+            try:
+                conn.sendall(('\n%s %d\n' % (token, code)).encode('utf-8'))
+            except socket.error as e:
+                log('pid %d: client went away: %s' % (pid, e))
+            conn.close()
+
+
+def daemonize(socket_path):
+    pid = os.fork()
+    if pid:
+        os.waitpid(pid, 0)
+        return
+    os.setsid()
+    if os.fork():
+        os._exit(0)
+    null = os.open(os.devnull, os.O_RDWR)
+    out = os.open(LOG_FILE, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    os.dup2(null, 0)
+    os.dup2(out, 1)
+    os.dup2(out, 2)
+    os.chdir('/')
+    try:
+        serve(socket_path)
+    except Exception as e:
+        log('daemon failed: %s' % e)
+    os._exit(0)
+
+
+def connect(socket_path):
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(socket_path)
+    except socket.error:
+        conn.close()
+        return None
+    return conn
+
+
+def connect_or_start(socket_path):
+    conn = connect(socket_path)
+    if conn is not None:
+        return conn
+    daemonize(socket_path)
+    deadline = time.time() + START_TIMEOUT
+    while time.time() < deadline:
+        time.sleep(0.2)
+        conn = connect(socket_path)
+        if conn is not None:
+            return conn
+    return None
+
+
+def write_out(data):
+    out = getattr(sys.stdout, 'buffer', sys.stdout)
+    out.write(data)
+    out.flush()
+
+
+def run(socket_path, args):
+    conn = connect_or_start(socket_path)
+    if conn is None:
+        log('ptf daemon is not available, running ptf directly')
+        os.execvp(PTF, [PTF] + args)
+
+    token = 'PTF-DAEMON-EXIT-%s' % uuid.uuid4().hex
+    request = {'args': args, 'cwd': os.getcwd(), 'env': dict(os.environ), 'token': token}
+    conn.sendall((json.dumps(request) + '\n').encode('utf-8'))
+
+    # Stream the output, holding back enough bytes to strip the trailer. The trailer is the last data
+    # sent for the test, so reading stops once it is complete
+    marker = ('\n%s ' % token).encode('utf-8')
+    pending = b''
+    pos = -1
+    while True:
+        chunk = conn.recv(RECV_SIZE)
+        if not chunk:
+            break
+        pending += chunk
+        pos = pending.rfind(marker)
+        if pos >= 0 and pending.endswith(b'\n') and len(pending) > pos + len(marker) + 1:
+            break
+        pos = -1
+        if len(pending) > TRAILER_MAX:
+            write_out(pending[:-TRAILER_MAX])
+            pending = pending[-TRAILER_MAX:]
+    conn.close()
+
+    if pos < 0:
+        write_out(pending)
+        log('ptf daemon closed the connection without an exit status')
+        return 1
+    write_out(pending[:pos])
+    return int(pending[pos + len(marker):].strip())
+
+
+def main():
+    # Everything after '--' is passed to ptf as is
+    argv = sys.argv[1:]
+    args = []
+    if '--' in argv:
+        args = argv[argv.index('--') + 1:]
+        argv = argv[:argv.index('--')]
+
+    parser = argparse.ArgumentParser(description='Run ptf tests through a daemon')
+    parser.add_argument('command', choices=['serve', 'run'])
+    parser.add_argument('--socket', default=SOCKET_PATH)
+    opts = parser.parse_args(argv)
+
+    if opts.command == 'serve':
+        daemonize(opts.socket)
+        return 0
+    return run(opts.socket, args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())